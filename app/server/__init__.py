@@ -1,17 +1,30 @@
+import time
+
+# Timed for the startup report, see app.server.startup
+_import_started = time.perf_counter()
+
 from flask import Flask, send_from_directory, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
+from .replica import RoutingSession
 import os
 
+_import_seconds = time.perf_counter() - _import_started
+
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 
 
 def create_app(config_name=None):
     app = Flask(__name__, static_folder="../static", static_url_path="/static")
 
+    # Time the factory and the first request, logged once it is served
+    from .startup import StartupTimer
+
+    startup_timer = StartupTimer(app, import_seconds=_import_seconds)
+
     # Load configuration
     if config_name is None:
         config_name = os.getenv("FLASK_ENV", "development")
@@ -24,6 +37,103 @@ def create_app(config_name=None):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    # Initialize read replica routing of read-only views
+    from .replica import ReadReplica
+
+    ReadReplica(app)
+
+    # Initialize routing of urls rows to their shard databases
+    from .shards import ShardRouter
+
+    ShardRouter(app)
+
+    # Initialize short code allocation
+    from .codes import CodeAllocator
+
+    CodeAllocator(app)
+
+    # Initialize off-request password hashing
+    from .hashing import PasswordHasher
+
+    PasswordHasher(app)
+
+    # Initialize per-worker caches
+    from .cache import TTLCache
+
+    app.extensions["redirect_cache"] = TTLCache(
+        maxsize=app.config["REDIRECT_CACHE_SIZE"],
+        ttl=app.config["REDIRECT_CACHE_TTL"],
+    )
+    app.extensions["stats_cache"] = TTLCache(
+        maxsize=8, ttl=app.config["ADMIN_STATS_CACHE_TTL"]
+    )
+    app.extensions["count_cache"] = TTLCache(
+        maxsize=8, ttl=app.config["ADMIN_COUNT_CACHE_TTL"]
+    )
+
+    # Initialize write-behind click counting
+    from .clicks import ClickAggregator
+
+    ClickAggregator(app)
+
+    # Initialize cross-worker events and the negative lookup filter
+    from .events import EventBus
+    from .bloom import ShortCodeFilter
+
+    event_bus = EventBus(app)
+    short_code_filter = ShortCodeFilter(app)
+
+    # Initialize the authenticated principal cache, evicted on token rotation
+    from .auth import PrincipalCache, forget_principal
+
+    principal_cache = PrincipalCache(
+        maxsize=app.config["PRINCIPAL_CACHE_SIZE"],
+        ttl=app.config["PRINCIPAL_CACHE_TTL"],
+        bus=event_bus,
+    )
+    app.extensions["principal_cache"] = principal_cache
+    event_bus.subscribe("auth_revoked", forget_principal)
+    event_bus.on_reconnect(principal_cache.clear)
+
+    # Initialize periodic maintenance jobs
+    from .scheduler import Scheduler
+    from .stats import reconcile_counters, reconcile_user_url_counts
+
+    from .reaper import Reaper
+    from .partitions import PartitionManager
+    from .archive import URLArchiver
+
+    scheduler = Scheduler(app)
+    reaper = Reaper(app)
+    partition_manager = PartitionManager(app)
+    archiver = URLArchiver(app)
+    scheduler.add_job(
+        "reconcile_stats", reconcile_counters, app.config["STATS_RECONCILE_INTERVAL"]
+    )
+    scheduler.add_job(
+        "reconcile_user_url_counts",
+        reconcile_user_url_counts,
+        app.config["STATS_RECONCILE_INTERVAL"],
+    )
+    scheduler.add_job("reap_expired_urls", reaper.run, app.config["REAPER_INTERVAL"])
+    scheduler.add_job(
+        "create_url_partitions",
+        partition_manager.create_ahead,
+        app.config["URL_PARTITION_INTERVAL"],
+    )
+    scheduler.add_job(
+        "archive_urls",
+        archiver.run,
+        app.config["ARCHIVE_INTERVAL"] if archiver.enabled else 0,
+    )
+
+    @app.before_request
+    def start_background_workers():
+        # Started lazily so every forked worker gets its own threads
+        event_bus.start()
+        short_code_filter.start()
+        scheduler.start()
+
     # Configure CORS
     CORS(
         app,
@@ -49,4 +159,5 @@ def create_app(config_name=None):
     app.register_blueprint(user_bp)
     app.register_blueprint(admin_bp, url_prefix="/admin")
 
+    startup_timer.factory_done()
     return app
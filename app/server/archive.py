@@ -0,0 +1,367 @@
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app.server.models import URL, ArchivedURL, User, default_expires_at
+from app.server.redirects import get_redirect_cache
+from app.server.bloom import get_short_code_filter
+from app.server.events import get_event_bus
+from app.server.stats import record_url_created, record_urls_deleted
+from app.server.shards import get_shard_router, on_shard, shard_connection, shard_name
+from app.server.partitions import row_cutoff
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+_urls = URL.__table__
+_archive = ArchivedURL.__table__
+
+# urls columns kept in the archive, which adds archived_at and reason
+ARCHIVED_COLUMNS = [
+    "short_code",
+    "original_url",
+    "user_id",
+    "created_at",
+    "expires_at",
+    "is_permanent",
+    "click_count",
+    "last_accessed",
+]
+
+
+class RestoreConflict(Exception):
+    """Raised when an archived URL cannot be put back into urls"""
+
+
+def _utc(moment):
+    """moment as an aware datetime; SQLite returns naive ones"""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def archive_reason(row, now):
+    """Why a URL leaving urls at now is archived: "expired" or "idle" """
+    if not row.is_permanent and row.expires_at and _utc(row.expires_at) < now:
+        return "expired"
+    return "idle"
+
+
+def archive_chunk(cutoff, idle_before, chunk_size, after=0):
+    """DELETE of the next chunk of URLs to archive, in id order
+
+    A URL is archived once it expired before cutoff, or, with idle_before,
+    when it was last accessed (or created, if never) before idle_before.
+    Rows locked by a concurrent run are skipped rather than waited for.
+    """
+    condition = and_(_urls.c.is_permanent == False, _urls.c.expires_at < cutoff)
+    if idle_before is not None:
+        last_used = func.coalesce(_urls.c.last_accessed, _urls.c.created_at)
+        condition = or_(condition, last_used < idle_before)
+    candidates = (
+        select(_urls.c.id)
+        .where(_urls.c.id > after, condition)
+        .order_by(_urls.c.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True)
+    )
+    return (
+        delete(_urls)
+        .where(_urls.c.id.in_(candidates.scalar_subquery()))
+        .returning(*_urls.c)
+    )
+
+
+class URLArchiver:
+    """Moves expired and idle URLs out of urls into a compact archive
+
+    Every chunk of URLs moved is written to a gzip-compressed NDJSON file in
+    the archive directory first, then inserted into url_archive in the
+    transaction that deletes it from urls. The file keeps a .partial suffix
+    until that transaction commits, and is removed if it does not. A run works through each shard in
+    id order within a time budget, and the next run resumes where it
+    stopped. Where urls is partitioned, expired URLs of month partitions are
+    left to the reaper, which archives them when it drops their partition.
+
+    Archived URLs stop redirecting (other workers may serve cached ones for
+    REDIRECT_CACHE_TTL more) and are restored one by one with restore().
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.directory = "archive"
+        self.idle_days = 0
+        self.chunk_size = 1000
+        self.time_budget = 30
+        self.runs = 0
+        self.archived_total = 0
+        self.files_written = 0
+        self.restored_total = 0
+        self.last_run = None
+        self._cursor = 0
+        self._shard_index = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config["ARCHIVE_ENABLED"]
+        self.directory = app.config["ARCHIVE_DIR"]
+        self.idle_days = app.config["ARCHIVE_IDLE_DAYS"]
+        self.chunk_size = app.config["ARCHIVE_CHUNK_SIZE"]
+        self.time_budget = app.config["ARCHIVE_TIME_BUDGET"]
+        app.extensions["url_archiver"] = self
+
+    def _write_file(self, rows, shard, now):
+        """Write rows to a new compressed .partial file; returns its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = (
+            f"urls-{now:%Y%m%dT%H%M%S}-{shard_name(shard)}-{uuid.uuid4().hex[:8]}"
+            ".ndjson.gz"
+        )
+        partial = os.path.join(self.directory, name) + ".partial"
+        with open(partial, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+                for row in rows:
+                    compressed.write(
+                        json.dumps(self._record(row, now), default=str).encode("utf-8")
+                        + b"\n"
+                    )
+            raw.flush()
+            os.fsync(raw.fileno())
+        return partial
+
+    @contextmanager
+    def files(self):
+        """Collect the paths store() returns within a block that commits them
+
+        Once the block completes, its rows committed, the files get their
+        final names; if it raises, they are deleted, like the rows.
+        """
+        partials = []
+        try:
+            yield partials
+        except BaseException:
+            for partial in partials:
+                try:
+                    os.remove(partial)
+                except FileNotFoundError:
+                    pass
+            raise
+        for partial in partials:
+            # Only files of committed rows carry the final name
+            os.replace(partial, partial[: -len(".partial")])
+            self.files_written += 1
+
+    def _record(self, row, now):
+        record = {name: getattr(row, name) for name in ARCHIVED_COLUMNS}
+        for name in ("created_at", "expires_at", "last_accessed"):
+            if record[name] is not None:
+                record[name] = _utc(record[name]).isoformat()
+        record["archived_at"] = now.isoformat()
+        record["reason"] = archive_reason(row, now)
+        return record
+
+    def store(self, rows, shard=None, now=None):
+        """Archive urls rows about to be deleted from shard
+
+        Writes them to a .partial file, then inserts them into url_archive in
+        the current session transaction, which must delete them from urls. A
+        code archived before, then taken by a new URL, keeps the latest.
+        Returns the file's path, for files() to name once committed, or None
+        without rows.
+        """
+        rows = list(rows)
+        if not rows:
+            return None
+        if now is None:
+            now = datetime.now(timezone.utc)
+        partial = self._write_file(rows, shard, now)
+
+        values = [
+            dict(
+                {name: getattr(row, name) for name in ARCHIVED_COLUMNS},
+                archived_at=now,
+                reason=archive_reason(row, now),
+            )
+            for row in rows
+        ]
+        dialect = postgresql if db.engine.dialect.name == "postgresql" else sqlite
+        insert = dialect.insert(_archive).values(values)
+        db.session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[_archive.c.short_code],
+                set_={
+                    column.key: insert.excluded[column.key]
+                    for column in _archive.c
+                    if column.key != "short_code"
+                },
+            )
+        )
+        self.archived_total += len(rows)
+        return partial
+
+    def _archive_chunk(self, shard, cutoff, idle_before, now, chunk_size, after):
+        with self.files() as files:
+            with on_shard(shard):
+                rows = db.session.execute(
+                    archive_chunk(cutoff, idle_before, chunk_size, after)
+                ).all()
+            if rows:
+                files.append(self.store(rows, shard, now))
+                record_urls_deleted(db.session, rows)
+                get_event_bus().publish("urls_deleted", len(rows))
+            db.session.commit()
+
+        redirect_cache = get_redirect_cache()
+        for row in rows:
+            redirect_cache.invalidate(row.short_code)
+        if rows:
+            get_short_code_filter().discard(len(rows))
+        return rows
+
+    def run(self, time_budget=None, chunk_size=None, now=None):
+        """Archive expired and idle URLs until none are left or the time is up
+
+        Returns a summary of the run.
+        """
+        if time_budget is None:
+            time_budget = self.time_budget
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if now is None:
+            now = datetime.now(timezone.utc)
+        idle_before = now - timedelta(days=self.idle_days) if self.idle_days else None
+
+        started = time.monotonic()
+        shards = get_shard_router().shards
+        index = self._shard_index if self._shard_index < len(shards) else 0
+        cursor = self._cursor
+        summary = {"archived_count": 0, "chunks": 0, "complete": False}
+        cutoff = None
+        try:
+            while True:
+                if cutoff is None:
+                    cutoff = row_cutoff(shard_connection(shards[index]), now)
+                rows = self._archive_chunk(
+                    shards[index], cutoff, idle_before, now, chunk_size, cursor
+                )
+                summary["chunks"] += 1
+                summary["archived_count"] += len(rows)
+                if rows:
+                    cursor = max(row.id for row in rows)
+
+                if len(rows) < chunk_size:
+                    # Done with this shard, go on with the next one
+                    cursor = 0
+                    cutoff = None
+                    index += 1
+                    if index == len(shards):
+                        summary["complete"] = True
+                        index = 0
+                        break
+                if time.monotonic() - started >= time_budget:
+                    break
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self._cursor = cursor
+            self._shard_index = index
+
+        self.runs += 1
+        summary.update(
+            cutoff=now.isoformat(),
+            idle_before=idle_before.isoformat() if idle_before else None,
+            elapsed_seconds=round(time.monotonic() - started, 3),
+        )
+        self.last_run = summary
+        logger.info(
+            "Archived %d URLs in %d chunks (%s)",
+            summary["archived_count"],
+            summary["chunks"],
+            "complete" if summary["complete"] else "time budget used, will resume",
+        )
+        return summary
+
+    def restore(self, short_code, expires_at=None, is_permanent=None, now=None):
+        """Move an archived URL back into urls; returns it, or None if not archived
+
+        The URL keeps its code, owner, creation time and clicks, and counts as
+        accessed now so it is not archived again as idle right away. Given
+        expires_at, it expires then; otherwise an expired URL gets the default
+        expiry unless made permanent. Raises RestoreConflict if its owner was deleted or its
+        code was taken meanwhile.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        archived = db.session.get(ArchivedURL, short_code, with_for_update=True)
+        if archived is None:
+            return None
+        if db.session.get(User, archived.user_id) is None:
+            raise RestoreConflict("The owner of the URL no longer exists")
+
+        if is_permanent is None:
+            is_permanent = archived.is_permanent and expires_at is None
+        if is_permanent:
+            expires_at = None
+        elif expires_at is None:
+            expires_at = _utc(archived.expires_at)
+            if expires_at is None or expires_at <= now:
+                expires_at = default_expires_at(now)
+
+        url = URL(
+            original_url=archived.original_url,
+            short_code=archived.short_code,
+            user_id=archived.user_id,
+            created_at=archived.created_at,
+            expires_at=expires_at,
+            is_permanent=is_permanent,
+            click_count=archived.click_count,
+            last_accessed=now,
+        )
+        try:
+            with on_shard(get_shard_router().shard_for(short_code)):
+                with db.session.begin_nested():
+                    db.session.add(url)
+        except IntegrityError:
+            raise RestoreConflict("The short code is taken by another URL")
+
+        db.session.delete(archived)
+        record_url_created(db.session, url)
+        get_event_bus().publish("url_created", short_code)
+        self.restored_total += 1
+        return url
+
+    def stats(self):
+        """Return archiver counters as a dictionary for metrics endpoints"""
+        return {
+            "enabled": self.enabled,
+            "idle_days": self.idle_days,
+            "chunk_size": self.chunk_size,
+            "time_budget": self.time_budget,
+            "runs": self.runs,
+            "archived_total": self.archived_total,
+            "files_written": self.files_written,
+            "restored_total": self.restored_total,
+            "last_run": self.last_run,
+        }
+
+
+def find_archived_url(short_code):
+    """The archived URL with short_code, or None"""
+    return db.session.get(ArchivedURL, short_code)
+
+
+def get_url_archiver():
+    """Get the URL archiver of the current application"""
+    return current_app.extensions["url_archiver"]
@@ -1,10 +1,16 @@
+from collections import namedtuple
 from functools import wraps
 from flask import current_app, request, jsonify, g
+from app.server.cache import TTLCache
 from app.server.models import User, Admin
 import jwt
 import os
+import threading
 from datetime import datetime, timedelta, timezone
 
+# What authenticated routes need to know about the account behind a token
+Principal = namedtuple("Principal", ["id", "username", "access_token", "is_active"])
+
 
 def generate_jwt(username, role, access_token):
     """Generate JWT"""
@@ -18,6 +24,101 @@ def generate_jwt(username, role, access_token):
     return jwt.encode(payload, secret_key, algorithm="HS256")
 
 
+class PrincipalCache(TTLCache):
+    """Per-worker cache of resolved principals that revocations keep honest
+
+    A lookup only stores its principal if no token was revoked since it
+    started, so a request that read the account just before a login or
+    logout committed cannot cache the revoked token after its eviction.
+    Revocations missed while the event bus was disconnected cannot be told
+    apart, so the cache is cleared when it reconnects and bypassed while it
+    is not listening.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, bus=None):
+        super().__init__(maxsize, ttl)
+        self.bus = bus
+        self.revocations = 0
+        self._revocation_lock = threading.Lock()
+
+    @property
+    def usable(self):
+        """Whether revocations currently reach this worker"""
+        return self.bus is None or not self.bus.enabled or self.bus.listening
+
+    def version(self):
+        """Revocation state to take before a lookup, see set_unless_revoked"""
+        generation = self.bus.generation if self.bus is not None else None
+        return (self.revocations, generation)
+
+    def set_unless_revoked(self, key, value, version):
+        """Store value unless a token was revoked since version was taken"""
+        with self._revocation_lock:
+            if self.version() == version:
+                self.set(key, value)
+
+    def revoke(self, key):
+        """Evict key and keep lookups in flight from storing it again"""
+        with self._revocation_lock:
+            self.revocations += 1
+            self.invalidate(key)
+
+    def clear(self):
+        with self._revocation_lock:
+            self.revocations += 1
+            super().clear()
+
+    def stats(self):
+        return dict(super().stats(), revocations=self.revocations)
+
+
+def get_principal_cache():
+    """Get the principal cache of the current application, if there is one"""
+    return current_app.extensions.get("principal_cache")
+
+
+def load_principal(model, role, username, access_token):
+    """Resolve an active account by username and access token, or None
+
+    Resolved principals are cached per worker under (role, username,
+    access_token) for a short TTL, so most authenticated requests skip the
+    account query. Token rotation and logout evict the entry on every worker
+    through forget_principal; see PrincipalCache for the races it covers.
+    """
+    cache = get_principal_cache()
+    if cache is not None and not cache.usable:
+        cache = None
+    key = (role, username, access_token)
+    if cache is not None:
+        principal = cache.get(key)
+        if principal is not None:
+            return principal
+        version = cache.version()
+
+    account = model.query.filter_by(
+        username=username, access_token=access_token, is_active=True
+    ).first()
+    if not account:
+        return None
+
+    principal = Principal(account.id, account.username, access_token, account.is_active)
+    if cache is not None:
+        cache.set_unless_revoked(key, principal, version)
+    return principal
+
+
+def forget_principal(key):
+    """Evict a cached principal from this worker
+
+    Handles "auth_revoked" events, which carry the [role, username,
+    access_token] of a rotated or cleared token and are published in the
+    transaction that changes it.
+    """
+    cache = get_principal_cache()
+    if cache is not None:
+        cache.revoke(tuple(key))
+
+
 def require_user_auth(f):
     """Decorator to require user authentication"""
 
@@ -38,9 +139,7 @@ def require_user_auth(f):
             if role != "user":
                 return jsonify({"error": "Invalid token role"}), 401
 
-            user = User.query.filter_by(
-                username=username, access_token=access_token, is_active=True
-            ).first()
+            user = load_principal(User, role, username, access_token)
             if not user:
                 return jsonify({"error": "Invalid or inactive user token"}), 401
 
@@ -75,9 +174,7 @@ def require_admin_auth(f):
             if role != "admin":
                 return jsonify({"error": "Invalid token role"}), 401
 
-            admin = Admin.query.filter_by(
-                username=username, access_token=access_token, is_active=True
-            ).first()
+            admin = load_principal(Admin, role, username, access_token)
             if not admin:
                 return jsonify({"error": "Invalid or inactive admin token"}), 401
 
@@ -0,0 +1,343 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import func, or_, select
+from app.server.cache import TTLCache
+from app.server.models import URL
+from app.server.shards import shard_connection
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+# Rows re-read below the highest loaded id on every refresh, so URLs whose
+# transaction committed after a later id was already seen are not missed
+REFRESH_ID_OVERLAP = 1000
+
+
+class BloomFilter:
+    """Bloom filter over strings with double hashing on a BLAKE2b digest"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(
+            int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)),
+            8,
+        )
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class ShortCodeFilter:
+    """Answers "definitely not a live short code" without touching the database
+
+    A Bloom filter over all live short codes is built in the background when
+    a worker starts serving. Codes created by this worker are added directly,
+    codes created elsewhere arrive through the event bus and a periodic
+    refresh catches up on anything missed. Bloom filters cannot forget, so
+    deleted codes are remembered in the negative cache and the filter is
+    rebuilt once too many of them have accumulated.
+
+    The filter only rejects codes while it is synced with a listening event
+    bus, that is, it was loaded after the current LISTEN connection was
+    established. Otherwise codes created on other workers could be missing
+    from it, so every code is treated as possibly existing. Without the event
+    bus the filter is disabled. Bulk imports do not send their codes, so
+    after one the filter is not trusted until a refresh has loaded them.
+
+    With sharded urls the filter holds the codes of every shard, each
+    refreshed from its own highest loaded id.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.rebuilds = 0
+        self.definite_misses = 0
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.bus = app.extensions["event_bus"]
+        self.shard_router = app.extensions["shard_router"]
+        self.enabled = app.config["SHORT_CODE_FILTER_ENABLED"] and self.bus.enabled
+        self.min_capacity = app.config["SHORT_CODE_FILTER_MIN_CAPACITY"]
+        self.error_rate = app.config["SHORT_CODE_FILTER_ERROR_RATE"]
+        self.refresh_interval = app.config["SHORT_CODE_FILTER_REFRESH_INTERVAL"]
+        self.negative_cache = TTLCache(
+            maxsize=app.config["NEGATIVE_CACHE_SIZE"],
+            ttl=app.config["NEGATIVE_CACHE_TTL"],
+        )
+        app.extensions["short_code_filter"] = self
+
+        self.bus.subscribe("url_created", self.add)
+        self.bus.subscribe("urls_created", self.add_many)
+        self.bus.subscribe("urls_deleted", self.discard)
+        self.bus.subscribe("urls_imported", self._on_import)
+        self.bus.on_reconnect(self._on_reconnect)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._bloom = None
+        self._max_ids = {}
+        self._synced_generation = None
+        self._imports = 0
+        self._synced_imports = 0
+        self._added = 0
+        self._stale = 0
+        self._added_during_rebuild = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._bloom is not None
+
+    @property
+    def authoritative(self):
+        """Whether the filter has every live short code and may reject codes"""
+        return (
+            self._bloom is not None
+            and self.bus.listening
+            and self._synced_generation == self.bus.generation
+            and self._synced_imports == self._imports
+        )
+
+    def _bus_generation(self):
+        """Generation of the listening bus connection a sync starts under, if any"""
+        return self.bus.generation if self.bus.listening else None
+
+    def version(self):
+        """Token that changes whenever a missing code may have been created"""
+        return (self._bus_generation(), self._imports, self._added)
+
+    def _on_reconnect(self):
+        # Events were missed while disconnected: anything remembered as missing
+        # may exist by now and the filter must catch up before it is trusted
+        self.negative_cache.clear()
+        self._wakeup.set()
+
+    def _on_import(self, count):
+        # Imported codes arrive only through a refresh that starts after the
+        # import; until then codes remembered or not found may exist
+        with self._lock:
+            self._imports += 1
+        self.negative_cache.clear()
+        self._wakeup.set()
+
+    def start(self):
+        """Load the filter and keep it fresh in a background thread, once per process"""
+        if not self.enabled:
+            return
+        if self._pid != os.getpid():
+            # Forked worker: rebuild rather than trust the parent's copy
+            self._reset()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="short-code-filter", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    if self._needs_rebuild():
+                        self.rebuild()
+                    else:
+                        self.refresh()
+                except Exception:
+                    logger.exception("Failed to refresh the short code filter")
+                finally:
+                    db.session.remove()
+
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def _needs_rebuild(self):
+        bloom = self._bloom
+        if bloom is None:
+            return True
+        # Too many entries or deleted codes push the false positive rate up
+        return bloom.count > bloom.capacity or self._stale > bloom.capacity // 4
+
+    def _row_count(self, shard):
+        count = select(func.count()).select_from(URL.__table__)
+        return shard_connection(shard).execute(count).scalar()
+
+    def _live_codes(self, shard, min_id=None):
+        urls = URL.__table__
+        query = select(urls.c.id, urls.c.short_code).where(
+            or_(
+                urls.c.is_permanent.is_(True),
+                urls.c.expires_at.is_(None),
+                urls.c.expires_at >= datetime.now(timezone.utc),
+            )
+        )
+        if min_id is not None:
+            query = query.where(urls.c.id > min_id)
+        return shard_connection(shard).execute(query.execution_options(yield_per=10000))
+
+    def rebuild(self):
+        """Build a new filter from all live short codes in the database"""
+        started = time.monotonic()
+        shards = self.shard_router.shards
+        rows = sum(self._row_count(shard) for shard in shards)
+        bloom = BloomFilter(max(rows * 2, self.min_capacity), self.error_rate)
+        generation = self._bus_generation()
+        imports = self._imports
+
+        # Codes added while scanning must make it into the new filter too
+        with self._lock:
+            self._added_during_rebuild = []
+
+        max_ids = {}
+        try:
+            for shard in shards:
+                max_id = 0
+                for url_id, short_code in self._live_codes(shard):
+                    bloom.add(short_code)
+                    max_id = max(max_id, url_id)
+                max_ids[shard] = max_id
+        except Exception:
+            with self._lock:
+                self._added_during_rebuild = None
+            raise
+
+        with self._lock:
+            for short_code in self._added_during_rebuild:
+                bloom.add(short_code)
+            self._added_during_rebuild = None
+            self._bloom = bloom
+            self._max_ids = max_ids
+            self._synced_generation = generation
+            self._synced_imports = imports
+            self._stale = 0
+        self.rebuilds += 1
+        logger.info(
+            "Loaded %d short codes into the filter in %.2fs",
+            bloom.count,
+            time.monotonic() - started,
+        )
+
+    def refresh(self):
+        """Add short codes created since the last load or refresh"""
+        generation = self._bus_generation()
+        imports = self._imports
+        for shard in self.shard_router.shards:
+            max_id = self._max_ids.get(shard, 0)
+            min_id = max_id - REFRESH_ID_OVERLAP
+            for url_id, short_code in self._live_codes(shard, min_id):
+                self.add(short_code)
+                max_id = max(max_id, url_id)
+            self._max_ids[shard] = max_id
+        self._synced_generation = generation
+        self._synced_imports = imports
+
+    def _known(self, short_code):
+        if self.negative_cache.get(short_code) is not None:
+            return False
+        bloom = self._bloom
+        return bloom is None or short_code in bloom
+
+    def might_exist(self, short_code):
+        """False only if short_code is certainly not a live short code"""
+        if not self.authoritative or self._known(short_code):
+            return True
+
+        # The code may have been created on another worker a moment ago;
+        # apply the events that already arrived before rejecting it
+        if not self.bus.poll() or not self.authoritative:
+            return True
+        if self._known(short_code):
+            return True
+
+        self.definite_misses += 1
+        return False
+
+    def add(self, short_code):
+        """Record a newly created short code"""
+        with self._lock:
+            self._added += 1
+            self.negative_cache.invalidate(short_code)
+            if self._added_during_rebuild is not None:
+                self._added_during_rebuild.append(short_code)
+            bloom = self._bloom
+        if bloom is not None and short_code not in bloom:
+            bloom.add(short_code)
+
+    def add_many(self, short_codes):
+        """Record newly created short codes"""
+        for short_code in short_codes:
+            self.add(short_code)
+
+    def remember_missing(self, short_code, version=None):
+        """Record a short code that passed the filter but is missing or expired
+
+        Pass the version() taken before the code was looked up: if a code was
+        added, an import arrived or the bus reconnected since, the lookup may
+        predate the code's creation and it is not remembered.
+        """
+        with self._lock:
+            if version is None or version == self.version():
+                self.negative_cache.set(short_code, True)
+
+    def discard(self, count):
+        """Account for deleted short codes, rebuilding once too many piled up"""
+        with self._lock:
+            self._stale += count
+        if self._needs_rebuild():
+            self._wakeup.set()
+
+    def stats(self):
+        """Return filter counters as a dictionary for metrics endpoints"""
+        bloom = self._bloom
+        return {
+            "enabled": self.enabled,
+            "ready": bloom is not None,
+            "authoritative": self.authoritative,
+            "capacity": bloom.capacity if bloom else 0,
+            "count": bloom.count if bloom else 0,
+            "bits": bloom.size if bloom else 0,
+            "hashes": bloom.hashes if bloom else 0,
+            "stale": self._stale,
+            "rebuilds": self.rebuilds,
+            "definite_misses": self.definite_misses,
+            "negative_cache": self.negative_cache.stats(),
+        }
+
+
+def get_short_code_filter():
+    """Get the short code filter of the current application"""
+    return current_app.extensions["short_code_filter"]
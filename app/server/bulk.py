@@ -0,0 +1,85 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from app.server.codes import get_code_allocator
+from app.server.models import URL
+from app.server.shards import get_shard_router, on_shard
+from app.server import db
+
+# Rows per INSERT statement; keeps the bind parameters well below driver limits
+INSERT_BATCH_ROWS = 1000
+
+# Allocated codes are unique among themselves but may hit a legacy random code
+MAX_SHORT_CODE_ATTEMPTS = 5
+
+_urls = URL.__table__
+
+
+def _insert_ignoring_taken_codes():
+    """INSERT into urls that skips rows whose short code is already taken
+
+    Only a plain urls table has a unique index on short_code for ON CONFLICT
+    to use; insert_urls leaves out the codes _taken_codes finds beforehand.
+    """
+    dialect = postgresql if db.engine.dialect.name == "postgresql" else sqlite
+    return (
+        dialect.insert(_urls)
+        .on_conflict_do_nothing()
+        .returning(
+            _urls.c.id,
+            _urls.c.short_code,
+            _urls.c.user_id,
+            _urls.c.created_at,
+            _urls.c.expires_at,
+            _urls.c.is_permanent,
+        )
+    )
+
+
+def _taken_codes(short_codes):
+    """The short_codes already in urls on the current shard"""
+    found = db.session.execute(
+        select(_urls.c.short_code).where(_urls.c.short_code.in_(short_codes))
+    )
+    return set(found.scalars())
+
+
+def insert_urls(rows):
+    """Insert URL rows with newly allocated short codes in multi-row INSERTs
+
+    rows are dictionaries of urls columns without short_code. Each row goes
+    to the shard its code hashes to, in the current session transaction.
+    Returns one inserted row (id, short_code, user_id, created_at,
+    expires_at, is_permanent) or None per input row, None meaning no free
+    short code was found for it.
+    """
+    inserted = [None] * len(rows)
+    pending = list(range(len(rows)))
+    allocator = get_code_allocator()
+    router = get_shard_router()
+    statement = _insert_ignoring_taken_codes()
+
+    for _ in range(MAX_SHORT_CODE_ATTEMPTS):
+        if not pending:
+            break
+        codes = allocator.allocate_many(len(pending))
+        by_code = dict(zip(codes, pending))
+
+        for shard, shard_codes in router.group(codes).items():
+            with on_shard(shard):
+                for start in range(0, len(shard_codes), INSERT_BATCH_ROWS):
+                    batch = shard_codes[start : start + INSERT_BATCH_ROWS]
+                    taken = _taken_codes(batch)
+                    values = [
+                        dict(rows[by_code[code]], short_code=code)
+                        for code in batch
+                        if code not in taken
+                    ]
+                    if not values:
+                        continue
+                    for row in db.session.execute(statement.values(values)):
+                        inserted[by_code[row.short_code]] = row
+
+        # Rows whose code was already taken try again with a fresh one
+        pending = [index for index in pending if inserted[index] is None]
+
+    return inserted
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a time-to-live"""
+
+    def __init__(self, maxsize=1024, ttl=60, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        # Counters used to size the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+
+    def _lookup(self, key):
+        """Return the live value for key or _MISSING; the caller holds the lock"""
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+
+        value, deadline = item
+        if deadline <= self._timer():
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Return the cached value for key, calling loader() to fill a miss
+
+        Concurrent misses on the same key are single-flight: one caller runs
+        the loader while the others wait for and share its result. Loader
+        errors are not cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            # Filled while waiting for another caller's loader
+            with self._lock:
+                value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+
+            try:
+                value = loader()
+                self.loads += 1
+                self.set(key, value, ttl)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds (defaults to the cache TTL)"""
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, self._timer() + ttl)
+            self._data.move_to_end(key)
+
+            # Evict least recently used entries beyond the size limit
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove key from the cache if present"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return cache counters as a dictionary for metrics endpoints"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "loads": self.loads,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,229 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import text
+from app.server.stats import update_counters
+from app.server.shards import get_shard_router, shard_name
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+# One set-based UPDATE for a whole batch of buffered clicks
+FLUSH_STATEMENT = text("""
+    UPDATE urls
+    SET click_count = COALESCE(urls.click_count, 0) + v.delta,
+        last_accessed = GREATEST(urls.last_accessed, v.last_accessed)
+    FROM unnest(
+        CAST(:short_codes AS text[]),
+        CAST(:deltas AS integer[]),
+        CAST(:last_accessed AS timestamptz[])
+    ) AS v(short_code, delta, last_accessed)
+    WHERE urls.short_code = v.short_code
+    RETURNING v.short_code, v.delta
+    """)
+
+
+class ClickAggregator:
+    """Buffers redirect clicks per worker and writes them back in batches
+
+    Clicks are aggregated as short_code -> [delta, latest access time] and
+    flushed every `flush_interval` seconds by a background thread. Reaching
+    `max_pending` buffered clicks forces an inline flush, which bounds how
+    many clicks a crashed worker can lose. While the database is unreachable
+    clicks beyond that bound are dropped instead of buffered. Each shard's
+    clicks are written separately, so one failing shard delays only its own.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.flush_interval = 5
+        self.max_pending = 1000
+        self.flushed_clicks = 0
+        self.dropped_clicks = 0
+        self.failed_flushes = 0
+        self._failing = False
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config["CLICK_FLUSH_INTERVAL"]
+        self.max_pending = app.config["CLICK_FLUSH_MAX_PENDING"]
+        app.extensions["click_aggregator"] = self
+
+        # Flush whatever is buffered when the worker shuts down gracefully
+        atexit.register(self.flush)
+
+    def _reset(self):
+        """Start with an empty buffer and no flusher thread in this process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = {}
+        self._pending = 0
+        self._thread = None
+
+    def _ensure_flusher(self):
+        """Start the background flusher thread once per process"""
+        if self._pid != os.getpid():
+            # Forked worker: the parent's buffer and thread are not ours
+            self._reset()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="click-flusher", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def record(self, short_code, accessed_at=None):
+        """Buffer one click on short_code"""
+        if accessed_at is None:
+            accessed_at = datetime.now(timezone.utc)
+
+        self._ensure_flusher()
+        with self._lock:
+            if self._failing and self._pending >= self.max_pending:
+                self.dropped_clicks += 1
+                return
+
+            entry = self._buffer.get(short_code)
+            if entry is None:
+                self._buffer[short_code] = [1, accessed_at]
+            else:
+                entry[0] += 1
+                if accessed_at > entry[1]:
+                    entry[1] = accessed_at
+            self._pending += 1
+            pending = self._pending
+
+        if pending >= self.max_pending and not self._failing:
+            # Hard cap reached: write back inline rather than risk more loss
+            self.flush()
+        elif pending >= self.max_pending // 2:
+            self._wakeup.set()
+
+    def _drain(self):
+        """Take the buffered clicks, leaving an empty buffer behind"""
+        with self._lock:
+            batch = self._buffer
+            self._buffer = {}
+            self._pending = 0
+        return batch
+
+    def _restore(self, batch):
+        """Put clicks of a failed flush back so the next flush retries them"""
+        with self._lock:
+            for short_code, (delta, accessed_at) in batch.items():
+                entry = self._buffer.get(short_code)
+                if entry is None:
+                    self._buffer[short_code] = [delta, accessed_at]
+                else:
+                    entry[0] += delta
+                    entry[1] = max(entry[1], accessed_at)
+                self._pending += delta
+
+    def _write_to(self, shard, batch):
+        """Apply batch to shard in one statement; returns the part it had no rows for"""
+        short_codes = list(batch)
+        params = {
+            "short_codes": short_codes,
+            "deltas": [batch[code][0] for code in short_codes],
+            "last_accessed": [batch[code][1] for code in short_codes],
+        }
+        if shard is None:
+            with db.engine.begin() as connection:
+                applied = dict(connection.execute(FLUSH_STATEMENT, params).all())
+                update_counters(connection, {"total_clicks": sum(applied.values())})
+        else:
+            with db.engines[shard].begin() as connection:
+                applied = dict(connection.execute(FLUSH_STATEMENT, params).all())
+            clicks = sum(applied.values())
+            try:
+                with db.engine.begin() as connection:
+                    update_counters(connection, {"total_clicks": clicks})
+            except Exception:
+                # The clicks are stored; reconciliation repairs the counter
+                logger.exception("Failed to count %d flushed clicks", clicks)
+        return {code: entry for code, entry in batch.items() if code not in applied}
+
+    def _write(self, batch, shard=None):
+        """Apply a drained batch of one shard's codes to the database
+
+        Clicks on codes deleted in the meantime are not counted. While
+        rebalancing, codes not moved to their shard yet are updated where
+        they still are.
+        """
+        missing = self._write_to(shard, batch)
+        for fallback in get_shard_router().fallbacks(shard):
+            if not missing:
+                break
+            try:
+                missing = self._write_to(fallback, missing)
+            except Exception:
+                # Retrying the whole batch would count its stored clicks twice
+                logger.exception("Failed to flush clicks to %s", shard_name(fallback))
+                break
+
+    def flush(self):
+        """Write all buffered clicks back; returns the number of clicks written"""
+        batch = self._drain()
+        if not batch:
+            return 0
+
+        with self.app.app_context():
+            groups = get_shard_router().group(batch)
+        flushed = 0
+        failed = {}
+        for shard, short_codes in groups.items():
+            shard_batch = {code: batch[code] for code in short_codes}
+            clicks = sum(delta for delta, _ in shard_batch.values())
+            try:
+                with self.app.app_context():
+                    self._write(shard_batch, shard)
+            except Exception:
+                logger.exception(
+                    "Failed to flush %d buffered clicks to %s",
+                    clicks,
+                    shard_name(shard),
+                )
+                failed.update(shard_batch)
+                continue
+            flushed += clicks
+
+        if failed:
+            self.failed_flushes += 1
+            self._failing = True
+            self._restore(failed)
+        else:
+            self._failing = False
+        self.flushed_clicks += flushed
+        return flushed
+
+    def stats(self):
+        """Return aggregator counters as a dictionary for metrics endpoints"""
+        with self._lock:
+            return {
+                "pending_clicks": self._pending,
+                "pending_codes": len(self._buffer),
+                "max_pending": self.max_pending,
+                "flush_interval": self.flush_interval,
+                "flushed_clicks": self.flushed_clicks,
+                "dropped_clicks": self.dropped_clicks,
+                "failed_flushes": self.failed_flushes,
+            }
+
+
+def get_click_aggregator():
+    """Get the click aggregator of the current application"""
+    return current_app.extensions["click_aggregator"]
@@ -0,0 +1,238 @@
+import hashlib
+import hmac
+import logging
+import os
+import string
+import threading
+from flask import current_app
+from sqlalchemy import text
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+# Same base62 alphabet as the random codes issued before the allocator
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+
+# Atomically moves the allocation high-water mark and returns the block start
+RESERVE_BLOCK = text(
+    """
+    UPDATE short_code_allocation
+    SET next_value = next_value + :size
+    WHERE id = 1
+    RETURNING next_value - :size
+    """
+)
+
+
+def encode_base62(number, length):
+    """Encode a non-negative integer as a base62 string of exactly length characters"""
+    if not 0 <= number < BASE**length:
+        raise ValueError(f"{number} does not fit in {length} base62 digits")
+
+    digits = []
+    for _ in range(length):
+        number, remainder = divmod(number, BASE)
+        digits.append(ALPHABET[remainder])
+    return "".join(reversed(digits))
+
+
+def decode_base62(code):
+    """Decode a base62 string back into an integer"""
+    number = 0
+    for character in code:
+        number = number * BASE + ALPHABET.index(character)
+    return number
+
+
+class FeistelPermutation:
+    """Keyed bijection of range(domain) that scrambles consecutive integers
+
+    A balanced Feistel network over the smallest even number of bits that
+    covers the domain is a permutation of that power of two for any round
+    function. Cycle walking (re-applying it until the value falls inside the
+    domain) restricts it to a permutation of range(domain).
+    """
+
+    def __init__(self, key, domain, rounds=4):
+        self.key = key
+        self.domain = domain
+        self.rounds = rounds
+
+        bits = max((domain - 1).bit_length(), 2)
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, index, value):
+        message = bytes([index]) + value.to_bytes(8, "big")
+        digest = hmac.new(self.key, message, hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], "big") & self.half_mask
+
+    def _permute(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(index, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, number):
+        if not 0 <= number < self.domain:
+            raise ValueError(f"{number} is outside the permutation domain")
+
+        value = self._permute(number)
+        while value >= self.domain:
+            value = self._permute(value)
+        return value
+
+
+class CodeAllocator:
+    """Turns unique integers into unique short codes
+
+    Every integer maps to a different code through a keyed Feistel
+    permutation of the base62 code space, so codes never need to be checked
+    for uniqueness and do not reveal how many were issued. The key must stay
+    the same for the lifetime of the database; a different key is a different
+    permutation whose codes may clash with the ones already issued.
+
+    Integers are handed out from blocks that each worker reserves in the
+    short_code_allocation table (hi/lo allocation), so allocating a code
+    normally needs no query. The next block is reserved in the background
+    before the current one runs out. Integers of blocks that are never used
+    up, for example when a worker exits, are simply skipped.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.key = None
+        self.length = 6
+        self.block_size = 1000
+        self.blocks_reserved = 0
+        self._permutations = {}
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        key = app.config["SHORT_CODE_KEY"]
+        if not key:
+            # Derive a stable key so deployments only need to keep SECRET_KEY
+            key = hmac.new(
+                app.config["SECRET_KEY"].encode("utf-8"),
+                b"short-code-permutation",
+                hashlib.sha256,
+            ).hexdigest()
+        self.key = key.encode("utf-8")
+        self.length = app.config["SHORT_CODE_LENGTH"]
+        self.block_size = app.config["SHORT_CODE_BLOCK_SIZE"]
+        app.extensions["code_allocator"] = self
+
+    def _reset(self):
+        """Forget reserved blocks; they must never be shared between processes"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._spare = None
+        self._refilling = False
+
+    def permutation(self, length):
+        permutation = self._permutations.get(length)
+        if permutation is None:
+            permutation = FeistelPermutation(self.key, BASE**length)
+            self._permutations[length] = permutation
+        return permutation
+
+    def code_for(self, number, length=None):
+        """Return the short code of an allocated integer"""
+        if length is None:
+            length = self.length
+        return encode_base62(self.permutation(length)(number), length)
+
+    def _reserve_block(self, size):
+        """Reserve size integers in their own transaction; returns (start, end)"""
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                start = connection.execute(RESERVE_BLOCK, {"size": size}).scalar()
+        if start is None:
+            raise RuntimeError(
+                "short_code_allocation has no row with id 1; "
+                "run 'flask db upgrade' to create and seed it"
+            )
+        self.blocks_reserved += 1
+        return start, start + size
+
+    def _refill(self):
+        try:
+            spare = self._reserve_block(self.block_size)
+        except Exception:
+            logger.exception("Failed to reserve a short code block in the background")
+            spare = None
+        with self._lock:
+            if spare is not None:
+                self._spare = spare
+            self._refilling = False
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # Forked worker: using the parent's block would duplicate codes
+            self._reset()
+
+    def next_id(self):
+        """Take the next unused integer, reserving a new block when needed"""
+        self._check_process()
+        with self._lock:
+            if self._next >= self._end:
+                if self._spare is not None:
+                    self._next, self._end = self._spare
+                    self._spare = None
+                else:
+                    self._next, self._end = self._reserve_block(self.block_size)
+
+            number = self._next
+            self._next += 1
+
+            # Reserve the next block before this one runs out
+            low_watermark = max(self.block_size // 10, 1)
+            if (
+                self._end - self._next <= low_watermark
+                and self._spare is None
+                and not self._refilling
+            ):
+                self._refilling = True
+                threading.Thread(
+                    target=self._refill, name="short-code-refill", daemon=True
+                ).start()
+
+        return number
+
+    def next_ids(self, count):
+        """Take count unused integers for bulk inserts"""
+        if count > self.block_size:
+            # Large batches get a dedicated block instead of draining the shared one
+            self._check_process()
+            start, end = self._reserve_block(count)
+            return list(range(start, end))
+        return [self.next_id() for _ in range(count)]
+
+    def allocate(self, length=None):
+        """Allocate a new, never before issued short code"""
+        return self.code_for(self.next_id(), length)
+
+    def allocate_many(self, count, length=None):
+        """Allocate count new, never before issued short codes"""
+        return [self.code_for(number, length) for number in self.next_ids(count)]
+
+    def stats(self):
+        """Return allocator counters as a dictionary for metrics endpoints"""
+        with self._lock:
+            return {
+                "block_size": self.block_size,
+                "blocks_reserved": self.blocks_reserved,
+                "remaining_in_block": self._end - self._next,
+                "spare_block": self._spare is not None,
+            }
+
+
+def get_code_allocator():
+    """Get the short code allocator of the current application"""
+    return current_app.extensions["code_allocator"]
@@ -29,9 +29,132 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool of each worker process, per engine (primary and replica).
+    # A statement timeout in milliseconds, 0 meaning none, applies to every
+    # statement; leave it off for migrations and bulk imports.
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    if SQLALCHEMY_DATABASE_URI.startswith("postgresql"):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "pool_size": int(os.getenv("DATABASE_POOL_SIZE", 5)),
+            "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", 10)),
+            "pool_timeout": int(os.getenv("DATABASE_POOL_TIMEOUT", 30)),
+            "pool_recycle": int(os.getenv("DATABASE_POOL_RECYCLE", -1)),
+            "pool_pre_ping": os.getenv("DATABASE_POOL_PRE_PING", "false").lower()
+            == "true",
+        }
+        DATABASE_STATEMENT_TIMEOUT = int(os.getenv("DATABASE_STATEMENT_TIMEOUT", 0))
+        if DATABASE_STATEMENT_TIMEOUT > 0:
+            SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {
+                "options": f"-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}"
+            }
+
+    # Read-only replica for redirects, URL stats and listings, if any, and the
+    # seconds it may lag behind; clients that wrote read from the primary as long
+    SQLALCHEMY_BINDS = {}
+    REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+    if REPLICA_DATABASE_URL:
+        SQLALCHEMY_BINDS["replica"] = {
+            "url": REPLICA_DATABASE_URL,
+            **SQLALCHEMY_ENGINE_OPTIONS,
+        }
+    REPLICA_MAX_LAG = int(os.getenv("REPLICA_MAX_LAG", 5))
+
+    # Further databases sharing the urls rows with the primary, by hash of the
+    # short code. Their position names them, so only ever append to the list,
+    # then run rebalance_shards.py with URL_SHARDS_REBALANCING on until done.
+    URL_SHARD_DATABASE_URLS = [
+        url.strip()
+        for url in os.getenv("URL_SHARD_DATABASE_URLS", "").split(",")
+        if url.strip()
+    ]
+    for shard_number, shard_url in enumerate(URL_SHARD_DATABASE_URLS, start=1):
+        SQLALCHEMY_BINDS[f"url_shard_{shard_number}"] = {
+            "url": shard_url,
+            **SQLALCHEMY_ENGINE_OPTIONS,
+        }
+    URL_SHARDS_REBALANCING = (
+        os.getenv("URL_SHARDS_REBALANCING", "false").lower() == "true"
+    )
+
     # Application settings
     DEFAULT_EXPIRATION_MONTHS = int(os.getenv("DEFAULT_EXPIRATION_MONTHS", 6))
     SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", 6))
+    # Key of the short code permutation; derived from SECRET_KEY if unset. Never change it.
+    SHORT_CODE_KEY = os.getenv("SHORT_CODE_KEY")
+    # Integers each worker reserves at once for short code allocation
+    SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", 1000))
+
+    # Whether POST /shorten returns the user's live URL for the same address
+    # instead of creating another one, unless a request says otherwise
+    SHORTEN_DEDUPLICATE = os.getenv("SHORTEN_DEDUPLICATE", "false").lower() == "true"
+
+    # Most URLs one POST /shorten/batch request may create
+    SHORTEN_BATCH_MAX_SIZE = int(os.getenv("SHORTEN_BATCH_MAX_SIZE", 10000))
+
+    # Redirect cache settings (entries per worker, seconds)
+    REDIRECT_CACHE_SIZE = int(os.getenv("REDIRECT_CACHE_SIZE", 10000))
+    REDIRECT_CACHE_TTL = int(os.getenv("REDIRECT_CACHE_TTL", 300))
+
+    # Password hashing (bcrypt cost, hashing threads and queued hashes per worker)
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 1))
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 8))
+
+    # Seconds the admin dashboard statistics are served from cache
+    ADMIN_STATS_CACHE_TTL = int(os.getenv("ADMIN_STATS_CACHE_TTL", 30))
+    # Default total of admin listings: exact, cached or estimated; seconds cached
+    ADMIN_COUNT_STRATEGY = os.getenv("ADMIN_COUNT_STRATEGY", "cached")
+    ADMIN_COUNT_CACHE_TTL = int(os.getenv("ADMIN_COUNT_CACHE_TTL", 60))
+
+    # Background maintenance jobs (run by one worker at a time, PostgreSQL only)
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    # Seconds between rebuilds of the statistics counters from urls and users
+    STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", 86400))
+    # Expired URL deletion (seconds between runs, rows per transaction, seconds per run)
+    REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", 300))
+    REAPER_CHUNK_SIZE = int(os.getenv("REAPER_CHUNK_SIZE", 1000))
+    REAPER_TIME_BUDGET = float(os.getenv("REAPER_TIME_BUDGET", 30))
+    # Month partitions of urls kept ahead of the current month, and seconds
+    # between runs creating them (where urls is partitioned by expiry month)
+    URL_PARTITION_MONTHS_AHEAD = int(os.getenv("URL_PARTITION_MONTHS_AHEAD", 12))
+    URL_PARTITION_INTERVAL = int(os.getenv("URL_PARTITION_INTERVAL", 86400))
+    # Archiving of expired and idle URLs out of urls instead of deleting them
+    # (directory of the archive files, days without a visit before a URL is
+    # idle or 0 to archive expired URLs only, seconds between runs, rows per
+    # transaction, seconds per run)
+    ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", 180))
+    ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+    ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 1000))
+    ARCHIVE_TIME_BUDGET = float(os.getenv("ARCHIVE_TIME_BUDGET", 30))
+
+    # Authenticated principal cache settings (entries per worker, seconds)
+    PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+    PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 30))
+
+    # Click counting settings (seconds between flushes, max buffered clicks per worker)
+    CLICK_FLUSH_INTERVAL = int(os.getenv("CLICK_FLUSH_INTERVAL", 5))
+    CLICK_FLUSH_MAX_PENDING = int(os.getenv("CLICK_FLUSH_MAX_PENDING", 1000))
+
+    # Cross-worker cache invalidation over PostgreSQL LISTEN/NOTIFY
+    EVENT_BUS_ENABLED = os.getenv("EVENT_BUS_ENABLED", "true").lower() == "true"
+
+    # Negative lookup filter for nonexistent and expired short codes
+    SHORT_CODE_FILTER_ENABLED = (
+        os.getenv("SHORT_CODE_FILTER_ENABLED", "true").lower() == "true"
+    )
+    SHORT_CODE_FILTER_MIN_CAPACITY = int(
+        os.getenv("SHORT_CODE_FILTER_MIN_CAPACITY", 100000)
+    )
+    SHORT_CODE_FILTER_ERROR_RATE = float(
+        os.getenv("SHORT_CODE_FILTER_ERROR_RATE", 0.01)
+    )
+    SHORT_CODE_FILTER_REFRESH_INTERVAL = int(
+        os.getenv("SHORT_CODE_FILTER_REFRESH_INTERVAL", 30)
+    )
+    NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", 10000))
+    NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 60))
 
 
 class DevelopmentConfig(Config):
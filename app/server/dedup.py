@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from sqlalchemy import select, text
+from app.server.models import URL
+from app.server.shards import get_shard_router, on_shard, shard_connection
+from app.server import db
+
+# Held until the transaction ends. The two-key form has its own key space,
+# apart from the single-key locks of the scheduler.
+LOCK_URL_DIGEST = text("SELECT pg_advisory_xact_lock(:user_id, :digest_key)")
+
+
+def lock_url_digest(user_id, digest):
+    """Serialize shortening of one URL by one user until the transaction ends
+
+    Another request for the same URL waits here and then finds the URL the
+    first one created. Distinct URLs rarely share a lock key, and sharing one
+    only makes them wait, never deduplicates them.
+
+    The lock is taken on every shard, in shard order, since the new row goes
+    to the shard of a code not allocated yet: each shard's lock lasts until
+    its own connection commits, so a waiting request gets them all only once
+    every shard it then searches has committed the row.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return
+    digest_key = int.from_bytes(digest[:4], "big", signed=True)
+    for shard in get_shard_router().shards:
+        shard_connection(shard).execute(
+            LOCK_URL_DIGEST, {"user_id": user_id, "digest_key": digest_key}
+        )
+
+
+def find_live_url(user_id, digest, is_permanent, now=None):
+    """The newest unexpired URL of a user with this digest and permanence
+
+    The user's URLs are spread over all shards, so each one is asked.
+    Returns a row of the columns a shortened URL response shows, or None.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    statement = select(
+        URL.short_code,
+        URL.original_url,
+        URL.created_at,
+        URL.expires_at,
+        URL.is_permanent,
+    ).where(
+        URL.user_id == user_id,
+        URL.url_digest == digest,
+        URL.is_permanent == is_permanent,
+    )
+    if not is_permanent:
+        statement = statement.where(URL.expires_at > now)
+    statement = statement.order_by(URL.id.desc()).limit(1)
+
+    found = []
+    for shard in get_shard_router().shards:
+        with on_shard(shard):
+            row = db.session.execute(statement).first()
+        if row is not None:
+            found.append(row)
+    return max(found, key=lambda row: row.created_at, default=None)
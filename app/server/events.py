@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import text
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "url_shortener_events"
+
+
+class EventBus:
+    """Delivers cache invalidation events to every worker process
+
+    Events are sent with PostgreSQL NOTIFY inside the publishing transaction,
+    so they are delivered only if it commits. Each worker keeps one dedicated
+    LISTEN connection in a background thread and dispatches incoming events
+    to the handlers subscribed to their topic. Handlers must be idempotent;
+    the publishing worker applies its own change directly and skips the echo.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._handlers = defaultdict(list)
+        self._reconnect_handlers = []
+        self.received = 0
+        self.reconnects = 0
+        self.generation = 0
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["event_bus"] = self
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        self.enabled = app.config["EVENT_BUS_ENABLED"] and dialect == "postgresql"
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._thread = None
+        self._connection = None
+        self.listening = False
+
+    def subscribe(self, topic, handler):
+        """Call handler(data) for every event published on topic by other workers"""
+        self._handlers[topic].append(handler)
+
+    def on_reconnect(self, handler):
+        """Call handler() after the listener reconnected and may have missed events"""
+        self._reconnect_handlers.append(handler)
+
+    def publish(self, topic, data=None):
+        """Send an event to all workers when the current transaction commits"""
+        if not self.enabled:
+            return
+
+        payload = json.dumps({"topic": topic, "data": data, "origin": self._origin})
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": payload},
+        )
+
+    def start(self):
+        """Start the listener thread once per process"""
+        if not self.enabled:
+            return
+        if self._pid != os.getpid():
+            # Forked worker: the parent's listener connection is not ours
+            self._reset()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="event-listener", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        backoff = 1
+        first_connection = True
+        while True:
+            connection = None
+            try:
+                with self.app.app_context():
+                    connection = db.engine.raw_connection()
+                dbapi_connection = connection.driver_connection
+                # The listener keeps its connection for good; take it out of the pool
+                connection.detach()
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+                self._connection = dbapi_connection
+                # Events published before this point may never reach this worker
+                self.generation += 1
+                self.listening = True
+                backoff = 1
+
+                if not first_connection:
+                    self.reconnects += 1
+                    self._notify_reconnect()
+                first_connection = False
+
+                self._listen(dbapi_connection)
+            except Exception:
+                logger.exception("Event listener failed, reconnecting")
+            finally:
+                self.listening = False
+                self._connection = None
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _listen(self, dbapi_connection):
+        while True:
+            if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                continue
+            self._drain(dbapi_connection)
+
+    def _drain(self, dbapi_connection):
+        with self._poll_lock:
+            dbapi_connection.poll()
+            while dbapi_connection.notifies:
+                notification = dbapi_connection.notifies.pop(0)
+                self._dispatch(notification.payload)
+
+    def poll(self):
+        """Dispatch events that already arrived without waiting for the listener
+
+        Returns False if the listener is not connected or the connection
+        failed, in which case events may be outstanding.
+        """
+        dbapi_connection = self._connection
+        if dbapi_connection is None:
+            return False
+        try:
+            self._drain(dbapi_connection)
+        except Exception:
+            logger.exception("Failed to poll the event listener connection")
+            return False
+        return True
+
+    def _dispatch(self, payload):
+        event = json.loads(payload)
+        if event.get("origin") == self._origin:
+            return
+
+        self.received += 1
+        for handler in self._handlers.get(event["topic"], []):
+            try:
+                with self.app.app_context():
+                    handler(event["data"])
+            except Exception:
+                logger.exception("Handler for event %s failed", event["topic"])
+
+    def _notify_reconnect(self):
+        for handler in self._reconnect_handlers:
+            try:
+                with self.app.app_context():
+                    handler()
+            except Exception:
+                logger.exception("Event bus reconnect handler failed")
+
+    def stats(self):
+        """Return listener counters as a dictionary for metrics endpoints"""
+        return {
+            "enabled": self.enabled,
+            "listening": self.listening,
+            "generation": self.generation,
+            "received": self.received,
+            "reconnects": self.reconnects,
+        }
+
+
+def get_event_bus():
+    """Get the event bus of the current application"""
+    return current_app.extensions["event_bus"]
@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy import or_, select
+from app.server.models import URL, URL_LISTING_COLUMNS, User, serialize_url
+from app.server.shards import lookup_usernames, shard_connection
+from app.server import db
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_STATES = ["all", "active", "expired", "permanent"]
+CSV_FIELDS = [
+    "id",
+    "short_code",
+    "original_url",
+    "username",
+    "created_at",
+    "expires_at",
+    "is_permanent",
+    "click_count",
+    "last_accessed",
+]
+
+# Rows fetched per round trip of the server-side cursor, and per chunk sent
+EXPORT_BATCH_SIZE = 1000
+
+# A row of a shard, which holds no users, with the owner looked up on the primary
+ExportRow = namedtuple(
+    "ExportRow", [column.key for column in URL_LISTING_COLUMNS] + ["username"]
+)
+
+
+def export_statement(
+    user_id=None,
+    state="all",
+    created_after=None,
+    created_before=None,
+    after_id=0,
+    sharded=False,
+):
+    """SELECT of the URLs to export, in id order so an export can resume
+
+    The owner's username is joined in, or if sharded left to export_batches.
+    """
+    if sharded:
+        statement = select(*URL_LISTING_COLUMNS, URL.user_id)
+    else:
+        statement = select(*URL_LISTING_COLUMNS, User.username).join(
+            User, URL.user_id == User.id
+        )
+    statement = statement.where(URL.id > after_id).order_by(URL.id)
+    if user_id is not None:
+        statement = statement.where(URL.user_id == user_id)
+    if created_after is not None:
+        statement = statement.where(URL.created_at >= created_after)
+    if created_before is not None:
+        statement = statement.where(URL.created_at < created_before)
+
+    now = datetime.now(timezone.utc)
+    if state == "permanent":
+        statement = statement.where(URL.is_permanent == True)
+    elif state == "expired":
+        statement = statement.where(URL.is_permanent == False, URL.expires_at < now)
+    elif state == "active":
+        statement = statement.where(
+            or_(URL.is_permanent == True, URL.expires_at >= now)
+        )
+    return statement
+
+
+def export_batches(statement, shards=None):
+    """Yield lists of rows, streamed from a server-side cursor
+
+    With shards, a statement made with sharded=True runs on each in turn.
+    """
+    statement = statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+    if shards is None:
+        result = db.session.execute(statement)
+        try:
+            for batch in result.partitions():
+                yield batch
+        finally:
+            result.close()
+        return
+
+    for shard in shards:
+        result = shard_connection(shard).execute(statement)
+        try:
+            for batch in result.partitions():
+                usernames = lookup_usernames(row.user_id for row in batch)
+                yield [
+                    ExportRow(*row[:-1], usernames.get(row.user_id)) for row in batch
+                ]
+        finally:
+            result.close()
+
+
+def _row_dict(row):
+    result = {"id": row.id}
+    result.update(serialize_url(row, row.username))
+    return result
+
+
+def ndjson_chunks(batches):
+    """One JSON object per line, one chunk of text per batch"""
+    for batch in batches:
+        yield "".join(json.dumps(_row_dict(row)) + "\n" for row in batch)
+
+
+def csv_chunks(batches):
+    """CSV with a header row, one chunk of text per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for batch in batches:
+        for row in batch:
+            data = _row_dict(row)
+            writer.writerow(
+                [
+                    row.id,
+                    row.short_code,
+                    row.original_url,
+                    row.username,
+                    data["created_at"],
+                    data["expires_at"],
+                    row.is_permanent,
+                    row.click_count,
+                    data["last_accessed"],
+                ]
+            )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_chunks(chunks, compress=False):
+    """Encode text chunks as UTF-8, gzip-compressed on the fly if compress"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        # Sync flushes keep the client receiving data batch by batch
+        data = compressor.compress(chunk.encode("utf-8"))
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
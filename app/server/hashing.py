@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small bounded thread pool
+
+    bcrypt releases the GIL while hashing, so request threads of the same
+    worker keep serving redirects while a login waits for its hash. At most
+    `workers` hashes run at once per worker process and at most `max_queue`
+    more may wait; anything beyond that raises HasherBusy instead of piling
+    up behind a login burst.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.rounds = 12
+        self.workers = 1
+        self.max_queue = 8
+        self.hashed = 0
+        self.verified = 0
+        self.rejected = 0
+        self.completed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.rounds = app.config["BCRYPT_ROUNDS"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.max_queue = app.config["PASSWORD_HASH_MAX_QUEUE"]
+        self._reset()
+        app.extensions["password_hasher"] = self
+
+    def _reset(self):
+        """Drop the pool; threads do not survive a fork"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._in_flight = 0
+
+    def _get_executor(self):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="password-hasher"
+                    )
+        return self._executor
+
+    def _run(self, function, *args):
+        """Run function on the pool and wait for its result"""
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many password hashes queued")
+
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return executor.submit(function, *args).result()
+        finally:
+            # Latency includes the time spent waiting in the queue
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash a password with the configured cost; returns a str"""
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        hashed = self._run(bcrypt.hashpw, password.encode("utf-8"), salt)
+        with self._lock:
+            self.hashed += 1
+        return hashed.decode("utf-8")
+
+    def verify(self, password, hashed):
+        """Check a password against a stored bcrypt hash"""
+        matches = self._run(
+            bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8")
+        )
+        with self._lock:
+            self.verified += 1
+        return matches
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash uses a different cost than configured"""
+        try:
+            rounds = int(hashed.split("$")[2])
+        except (IndexError, ValueError):
+            return True
+        return rounds != self.rounds
+
+    def stats(self):
+        """Return hasher counters as a dictionary for metrics endpoints"""
+        with self._lock:
+            in_flight = self._in_flight
+            completed = self.completed
+            total_seconds = self.total_seconds
+            max_seconds = self.max_seconds
+            hashed = self.hashed
+            verified = self.verified
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": in_flight,
+            "queued": max(in_flight - self.workers, 0),
+            "hashed": hashed,
+            "verified": verified,
+            "rejected": self.rejected,
+            "latency_avg_ms": (
+                round(total_seconds / completed * 1000, 1) if completed else 0.0
+            ),
+            "latency_max_ms": round(max_seconds * 1000, 1),
+        }
+
+
+def get_password_hasher():
+    """Get the password hasher of the current application"""
+    return current_app.extensions["password_hasher"]
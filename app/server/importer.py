@@ -0,0 +1,522 @@
+import csv
+import io
+import json
+import re
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import islice
+from sqlalchemy import text
+from app.server.codes import get_code_allocator
+from app.server.events import get_event_bus
+from app.server.models import default_expires_at, url_digest
+from app.server.stats import record_urls_created
+from app.server.utils import is_valid_url
+from app.server import db
+
+IMPORT_FORMATS = ["csv", "ndjson"]
+CONFLICT_POLICIES = ["regenerate", "skip"]
+
+# Records parsed, and given short codes, per round trip to the allocator
+PARSE_BATCH_SIZE = 10000
+
+# Staged rows merged into urls per transaction
+MERGE_CHUNK_SIZE = 50000
+
+# Rounds of regenerating codes that are taken before giving the rows up
+MAX_CONFLICT_ROUNDS = 5
+
+# Anything the short_code column and the redirect route can hold
+SHORT_CODE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,10}$")
+
+TRUE_VALUES = {"1", "t", "true", "y", "yes"}
+FALSE_VALUES = {"", "0", "f", "false", "n", "no"}
+
+# Rejected records kept for the summary; the rest are only counted
+REJECTED_SAMPLE_SIZE = 10
+
+STAGING_COLUMNS = (
+    "line, username, original_url, url_digest, short_code, expires_at, "
+    "is_permanent, generated"
+)
+
+
+class InvalidRecord(ValueError):
+    """Raised for an input record that cannot be imported"""
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    normalized = "" if value is None else str(value).strip().lower()
+    if normalized in TRUE_VALUES:
+        return True
+    if normalized in FALSE_VALUES:
+        return False
+    raise InvalidRecord(f"Invalid boolean {value!r}")
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp, naive ones being UTC; empty means None"""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise InvalidRecord(f"Invalid timestamp {value!r}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def parse_record(record, now, validate_urls=True):
+    """Validate one input record
+
+    Returns (username, original_url, short_code, expires_at, is_permanent),
+    short_code being None when one has to be generated. Raises InvalidRecord.
+    """
+    if not isinstance(record, dict):
+        raise InvalidRecord("Not an object")
+
+    username = _text(record.get("username"))
+    if not username:
+        raise InvalidRecord("Missing username")
+
+    original_url = _text(record.get("original_url"))
+    if not original_url:
+        raise InvalidRecord("Missing original_url")
+    if "\x00" in original_url or (validate_urls and not is_valid_url(original_url)):
+        raise InvalidRecord("Invalid URL")
+
+    short_code = _text(record.get("short_code")) or None
+    if short_code is not None and not SHORT_CODE_PATTERN.match(short_code):
+        raise InvalidRecord(f"Invalid short code {short_code!r}")
+
+    is_permanent = parse_bool(record.get("is_permanent"))
+    expires_at = None
+    if not is_permanent:
+        expires_at = parse_timestamp(record.get("expires_at"))
+        if expires_at is None:
+            expires_at = default_expires_at(now)
+    return username, original_url, short_code, expires_at, is_permanent
+
+
+def detect_format(path):
+    """Input format from a file name such as links.csv or links.ndjson.gz"""
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[: -len(".gz")]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return None
+
+
+def read_records(lines, format):
+    """Iterate over (line number, record) for every record of an input file
+
+    Records are dictionaries, or None for NDJSON lines that are not JSON.
+    Raises ValueError right away for a CSV header without the required columns.
+    """
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        missing = {"username", "original_url"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"CSV header lacks {', '.join(sorted(missing))}")
+        return ((reader.line_num, record) for record in reader)
+    return _ndjson_records(lines)
+
+
+def _ndjson_records(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+class CopyStream:
+    """Read-only file object over an iterator of text chunks, for COPY FROM STDIN"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = ""
+        self._offset = 0
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self._offset >= len(self._chunk):
+                self._chunk, self._offset = next(self._chunks, None), 0
+                if self._chunk is None:
+                    self._chunk = ""
+                    break
+                continue
+            end = len(self._chunk) if size < 0 else self._offset + size
+            piece = self._chunk[self._offset : end]
+            self._offset += len(piece)
+            pieces.append(piece)
+            if size > 0:
+                size -= len(piece)
+        return "".join(pieces)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Importer:
+    """Loads URLs in bulk: COPY into a staging table, then merge into urls
+
+    Records stream from the input through a bounded buffer, so memory does
+    not grow with the file. Short code conflicts with existing URLs or within
+    the file are resolved set-based in the staging table: codes from the file
+    win over generated ones, and the losers get new codes (or are skipped).
+    The merge runs in chunks that each commit with their counter updates, so
+    live traffic is never blocked behind one long transaction.
+
+    The staging table is an UNLOGGED table rather than a temporary one, since
+    the session may use a different connection after every commit.
+    """
+
+    def __init__(
+        self,
+        on_conflict="regenerate",
+        validate_urls=True,
+        chunk_size=MERGE_CHUNK_SIZE,
+        report=None,
+    ):
+        self.on_conflict = on_conflict
+        self.validate_urls = validate_urls
+        self.chunk_size = chunk_size
+        self.report = report or (lambda message: None)
+        self.staging = f"url_import_{secrets.token_hex(4)}"
+        self.counts = Counter()
+        self.rejected = []
+        self.unknown_users = []
+
+    def _sql(self, statement):
+        return text(statement.format(staging=self.staging))
+
+    def _reject(self, line, reason):
+        self.counts["rejected"] += 1
+        if len(self.rejected) < REJECTED_SAMPLE_SIZE:
+            self.rejected.append({"line": line, "reason": reason})
+
+    def _staged_chunks(self, records, now):
+        """CSV text for COPY, one chunk per parsed batch"""
+        allocator = get_code_allocator()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        started = time.monotonic()
+        for batch in _batched(records, PARSE_BATCH_SIZE):
+            parsed = []
+            for line, record in batch:
+                try:
+                    record = parse_record(record, now, self.validate_urls)
+                    parsed.append((line,) + record)
+                except InvalidRecord as e:
+                    self._reject(line, str(e))
+
+            missing = sum(1 for row in parsed if row[3] is None)
+            codes = iter(allocator.allocate_many(missing) if missing else ())
+            for line, username, url, short_code, expires_at, permanent in parsed:
+                writer.writerow(
+                    [
+                        line,
+                        username,
+                        url,
+                        "\\x" + url_digest(url).hex(),
+                        short_code or next(codes),
+                        expires_at.isoformat() if expires_at else None,
+                        "t" if permanent else "f",
+                        "f" if short_code else "t",
+                    ]
+                )
+            self.counts["read"] += len(batch)
+            self.counts["staged"] += len(parsed)
+            self.counts["generated"] += missing
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+            if self.counts["read"] % (PARSE_BATCH_SIZE * 10) < len(batch):
+                elapsed = time.monotonic() - started
+                self.report(
+                    f"Staged {self.counts['staged']:,} of {self.counts['read']:,} "
+                    f"records ({self.counts['read'] / max(elapsed, 1e-6):,.0f}/s)"
+                )
+
+    def stage(self, records, now):
+        """Create the staging table and COPY the parsed records into it"""
+        db.session.execute(
+            self._sql(
+                """
+                CREATE UNLOGGED TABLE {staging} (
+                    line bigint NOT NULL,
+                    username text NOT NULL,
+                    original_url text NOT NULL,
+                    url_digest bytea NOT NULL,
+                    short_code text NOT NULL,
+                    expires_at timestamptz,
+                    is_permanent boolean NOT NULL,
+                    generated boolean NOT NULL
+                );
+                CREATE UNLOGGED TABLE {staging}_conflicts (
+                    line bigint PRIMARY KEY,
+                    generated boolean NOT NULL
+                );
+                CREATE UNLOGGED TABLE {staging}_codes (
+                    line bigint PRIMARY KEY,
+                    short_code text NOT NULL
+                )
+                """
+            )
+        )
+        db.session.commit()
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {self.staging} ({STAGING_COLUMNS}) FROM STDIN WITH (FORMAT csv)",
+            CopyStream(self._staged_chunks(records, now)),
+        )
+        # Indexed after loading, which is much faster than while copying
+        db.session.execute(self._sql("CREATE INDEX ON {staging} (line)"))
+        db.session.execute(self._sql("ANALYZE {staging}"))
+        db.session.commit()
+
+    def drop_unknown_users(self):
+        """Remove staged rows of users that do not exist; users are not created"""
+        rows = db.session.execute(
+            self._sql(
+                """
+                SELECT s.username, COUNT(*) AS records
+                FROM {staging} s
+                WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.username = s.username)
+                GROUP BY s.username
+                ORDER BY records DESC, s.username
+                """
+            )
+        )
+        for username, records in rows:
+            self.counts["unknown_user"] += records
+            if len(self.unknown_users) < REJECTED_SAMPLE_SIZE:
+                self.unknown_users.append(username)
+        if self.counts["unknown_user"]:
+            db.session.execute(
+                self._sql(
+                    """
+                    DELETE FROM {staging} s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM users u WHERE u.username = s.username
+                    )
+                    """
+                )
+            )
+        db.session.commit()
+
+    def _find_conflicts(self):
+        """Collect rows whose code is taken by a URL or by an earlier staged row"""
+        return db.session.execute(
+            self._sql(
+                """
+                INSERT INTO {staging}_conflicts (line, generated)
+                SELECT line, generated
+                FROM (
+                    SELECT line, generated, short_code,
+                           row_number() OVER (
+                               PARTITION BY short_code ORDER BY generated, line
+                           ) AS position
+                    FROM {staging}
+                ) ranked
+                WHERE position > 1
+                   OR EXISTS (
+                       SELECT 1 FROM urls WHERE urls.short_code = ranked.short_code
+                   )
+                """
+            )
+        ).rowcount
+
+    def _drop_conflicts(self, condition):
+        deleted = db.session.execute(
+            self._sql(
+                "DELETE FROM {staging} WHERE line IN "
+                "(SELECT line FROM {staging}_conflicts WHERE " + condition + ")"
+            )
+        ).rowcount
+        db.session.execute(
+            self._sql("DELETE FROM {staging}_conflicts WHERE " + condition)
+        )
+        self.counts["skipped"] += deleted
+
+    def _regenerate_conflicts(self):
+        """Give every collected conflict a newly allocated code"""
+        allocator = get_code_allocator()
+        after = 0
+        while True:
+            lines = (
+                db.session.execute(
+                    self._sql(
+                        "SELECT line FROM {staging}_conflicts WHERE line > :after "
+                        "ORDER BY line LIMIT :limit"
+                    ),
+                    {"after": after, "limit": PARSE_BATCH_SIZE},
+                )
+                .scalars()
+                .all()
+            )
+            if not lines:
+                break
+            db.session.execute(
+                self._sql(
+                    "INSERT INTO {staging}_codes (line, short_code) "
+                    "SELECT * FROM unnest(CAST(:lines AS bigint[]), "
+                    "CAST(:codes AS text[]))"
+                ),
+                {"lines": lines, "codes": allocator.allocate_many(len(lines))},
+            )
+            after = lines[-1]
+
+        regenerated = db.session.execute(
+            self._sql(
+                """
+                UPDATE {staging} s
+                SET short_code = c.short_code, generated = true
+                FROM {staging}_codes c
+                WHERE s.line = c.line
+                """
+            )
+        ).rowcount
+        self.counts["regenerated"] += regenerated
+
+    def resolve_conflicts(self):
+        """Regenerate or skip rows whose short code is already taken
+
+        Codes from the file keep priority over generated codes, so links of
+        the previous shortener keep working wherever possible. Generated codes
+        are always regenerated; codes from the file only with "regenerate".
+        """
+        for _ in range(MAX_CONFLICT_ROUNDS):
+            conflicts = self._find_conflicts()
+            if not conflicts:
+                break
+            self.report(f"Resolving {conflicts:,} short code conflicts")
+            if self.on_conflict == "skip":
+                self._drop_conflicts("NOT generated")
+            self._regenerate_conflicts()
+            db.session.execute(
+                self._sql("TRUNCATE {staging}_conflicts, {staging}_codes")
+            )
+            db.session.commit()
+        else:
+            # Still taken after every round: give these rows up
+            if self._find_conflicts():
+                self._drop_conflicts("true")
+            db.session.commit()
+
+    def _merge_chunk(self, after, now):
+        bounds = db.session.execute(
+            self._sql(
+                """
+                SELECT MAX(line), COUNT(*)
+                FROM (
+                    SELECT line FROM {staging}
+                    WHERE line > :after ORDER BY line LIMIT :limit
+                ) chunk
+                """
+            ),
+            {"after": after, "limit": self.chunk_size},
+        ).one()
+        until, staged = bounds
+        if not staged:
+            return None
+
+        rows = db.session.execute(
+            self._sql(
+                """
+                INSERT INTO urls (original_url, url_digest, short_code, user_id,
+                                  created_at, expires_at, is_permanent, click_count)
+                SELECT s.original_url, s.url_digest, s.short_code, u.id, :now,
+                       s.expires_at, s.is_permanent, 0
+                FROM {staging} s
+                JOIN users u ON u.username = s.username
+                WHERE s.line > :after AND s.line <= :until
+                ORDER BY s.line
+                ON CONFLICT DO NOTHING
+                RETURNING user_id, is_permanent, expires_at
+                """
+            ),
+            {"after": after, "until": until, "now": now},
+        ).all()
+        if rows:
+            record_urls_created(db.session, rows)
+            get_event_bus().publish("urls_imported", len(rows))
+        db.session.commit()
+
+        self.counts["imported"] += len(rows)
+        # Codes taken by live traffic since conflicts were resolved, or users
+        # deleted meanwhile
+        self.counts["skipped"] += staged - len(rows)
+        return until
+
+    def merge(self, now):
+        """Insert the staged rows into urls, chunk by chunk"""
+        total = self.counts["staged"] - self.counts["unknown_user"]
+        total -= self.counts["skipped"]
+        started = time.monotonic()
+        after = 0
+        while (after := self._merge_chunk(after, now)) is not None:
+            elapsed = time.monotonic() - started
+            self.report(
+                f"Imported {self.counts['imported']:,} of {total:,} URLs "
+                f"({self.counts['imported'] / max(elapsed, 1e-6):,.0f}/s)"
+            )
+
+    def drop_staging(self):
+        db.session.rollback()
+        db.session.execute(
+            self._sql(
+                "DROP TABLE IF EXISTS {staging}, {staging}_conflicts, {staging}_codes"
+            )
+        )
+        db.session.commit()
+
+    def run(self, records, now=None):
+        """Import an iterable of (line number, record) pairs
+
+        Returns a summary of the import.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        started = time.monotonic()
+        try:
+            self.stage(records, now)
+            self.report(f"Staged {self.counts['staged']:,} records")
+            self.drop_unknown_users()
+            self.resolve_conflicts()
+            self.merge(now)
+        finally:
+            self.drop_staging()
+
+        return {
+            "read": self.counts["read"],
+            "imported": self.counts["imported"],
+            "generated_codes": self.counts["generated"],
+            "regenerated_codes": self.counts["regenerated"],
+            "rejected": self.counts["rejected"],
+            "rejected_sample": self.rejected,
+            "unknown_user": self.counts["unknown_user"],
+            "unknown_users_sample": self.unknown_users,
+            "skipped": self.counts["skipped"],
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }
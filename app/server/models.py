@@ -1,10 +1,15 @@
+import hashlib
 from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlunsplit
 from app.server import db
 import os
 
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
 
 class User(db.Model):
     __tablename__ = "users"
+    __table_args__ = (db.Index("ix_users_created_at", "created_at", "id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -14,6 +19,8 @@ class User(db.Model):
         db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
     )
     is_active = db.Column(db.Boolean, default=True)
+    # Number of URLs of the user, maintained with every insert and delete
+    url_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # Relationship with URLs
     urls = db.relationship(
@@ -39,11 +46,116 @@ class Admin(db.Model):
         return f"<Admin {self.username}>"
 
 
+class ShortCodeAllocation(db.Model):
+    """Single-row high-water mark of the integers turned into short codes"""
+
+    __tablename__ = "short_code_allocation"
+
+    id = db.Column(db.Integer, primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
+
+
+class StatCounter(db.Model):
+    """One shard of a system-wide counter; the counter is the sum of its shards"""
+
+    __tablename__ = "stat_counters"
+
+    name = db.Column(db.String(32), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ExpiryBucket(db.Model):
+    """Number of non-permanent URLs expiring within one hour, per shard"""
+
+    __tablename__ = "url_expiry_buckets"
+
+    bucket_start = db.Column(db.DateTime(timezone=True), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True)
+    url_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ScheduledJob(db.Model):
+    """Last run of a background job, shared by all workers"""
+
+    __tablename__ = "scheduled_jobs"
+
+    name = db.Column(db.String(64), primary_key=True)
+    last_run_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+
+def default_expires_at(now=None):
+    """Expiry of a new non-permanent URL, 6 months from now by default"""
+    if now is None:
+        now = datetime.now(timezone.utc)
+    expiration_months = int(os.getenv("DEFAULT_EXPIRATION_MONTHS", 6))
+    return now + timedelta(days=30 * expiration_months)
+
+
+def normalize_url(url):
+    """Canonical form of a URL for finding duplicates
+
+    Lowercases the scheme and host and drops a default port and an empty
+    path, which never change the resource. Path, query and fragment are
+    kept as they are.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return urlunsplit(parts._replace(scheme=scheme))
+    if host is None:
+        return urlunsplit(parts._replace(scheme=scheme))
+
+    netloc = f"[{host}]" if ":" in host else host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def url_digest(url):
+    """Fixed-width SHA-256 digest of the normalized URL, for indexed lookups"""
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).digest()
+
+
+def _default_url_digest(context):
+    return url_digest(context.get_current_parameters()["original_url"])
+
+
 class URL(db.Model):
     __tablename__ = "urls"
+    __table_args__ = (
+        # A user's URLs in each sort order of /my-urls; id breaks ties
+        db.Index("ix_urls_user_id_created_at", "user_id", "created_at", "id"),
+        db.Index("ix_urls_user_id_expires_at", "user_id", "expires_at", "id"),
+        db.Index("ix_urls_user_id_click_count", "user_id", "click_count", "id"),
+        db.Index("ix_urls_user_id_short_code", "user_id", "short_code"),
+        # A user's URLs by destination, for deduplicated shortening
+        db.Index("ix_urls_user_id_url_digest", "user_id", "url_digest"),
+        # All URLs in each sort order of /admin/urls
+        db.Index("ix_urls_created_at", "created_at", "id"),
+        db.Index("ix_urls_expires_at", "expires_at", "id"),
+        db.Index("ix_urls_click_count", "click_count", "id"),
+        # URLs that can expire, for the reaper and the statistics
+        db.Index(
+            "ix_urls_expiring",
+            "expires_at",
+            "id",
+            postgresql_where=db.text("NOT is_permanent"),
+        ),
+        # Rows are spread over the shard databases, see app.server.shards
+        {"info": {"sharded": True}},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     original_url = db.Column(db.Text, nullable=False)
+    url_digest = db.Column(
+        db.LargeBinary(32), nullable=False, default=_default_url_digest
+    )
     short_code = db.Column(db.String(10), unique=True, nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     created_at = db.Column(
@@ -57,11 +169,7 @@ class URL(db.Model):
     def __init__(self, **kwargs):
         super(URL, self).__init__(**kwargs)
         if not self.is_permanent and not self.expires_at:
-            # Set default expiration to 6 months from now
-            expiration_months = int(os.getenv("DEFAULT_EXPIRATION_MONTHS", 6))
-            self.expires_at = datetime.now(timezone.utc) + timedelta(
-                days=30 * expiration_months
-            )
+            self.expires_at = default_expires_at()
 
     @property
     def is_expired(self):
@@ -70,30 +178,66 @@ class URL(db.Model):
             return False
         return self.expires_at and datetime.now(timezone.utc) > self.expires_at
 
-    def increment_click_count(self):
-        """Increment click count and update last accessed time"""
-        self.click_count += 1
-        self.last_accessed = datetime.now(timezone.utc)
-        db.session.commit()
-
     def to_dict(self, include_user=False):
         """Convert URL object to dictionary for JSON responses"""
-        result = {
-            "original_url": self.original_url,
-            "short_code": self.short_code,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "expires_at": self.expires_at.isoformat() if self.expires_at else None,
-            "is_permanent": self.is_permanent,
-            "click_count": self.click_count,
-            "last_accessed": (
-                self.last_accessed.isoformat() if self.last_accessed else None
-            ),
-        }
-
-        if include_user and self.user:
-            result["user"] = {"username": self.user.username}
-
-        return result
+        username = self.user.username if include_user and self.user else None
+        return serialize_url(self, username)
 
     def __repr__(self):
         return f"<URL {self.short_code}: {self.original_url}>"
+
+
+class ArchivedURL(db.Model):
+    """A URL moved out of urls for being expired or idle, see app.server.archive
+
+    Holds what /stats and restoring need, without the indexes of urls. The
+    owner is not a foreign key, so archived URLs never block deleting users.
+    """
+
+    __tablename__ = "url_archive"
+
+    short_code = db.Column(db.String(10), primary_key=True)
+    original_url = db.Column(db.Text, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True))
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    is_permanent = db.Column(db.Boolean, default=False)
+    click_count = db.Column(db.Integer, default=0)
+    last_accessed = db.Column(db.DateTime(timezone=True), nullable=True)
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    # "expired" or "idle"
+    reason = db.Column(db.String(16), nullable=False)
+
+    def __repr__(self):
+        return f"<ArchivedURL {self.short_code}: {self.original_url}>"
+
+
+# URL columns of listings, selected as plain rows rather than URL objects
+URL_LISTING_COLUMNS = (
+    URL.id,
+    URL.original_url,
+    URL.short_code,
+    URL.created_at,
+    URL.expires_at,
+    URL.is_permanent,
+    URL.click_count,
+    URL.last_accessed,
+)
+
+
+def serialize_url(url, username=None):
+    """Convert a URL object or listing row to a dictionary for JSON responses"""
+    result = {
+        "original_url": url.original_url,
+        "short_code": url.short_code,
+        "created_at": url.created_at.isoformat() if url.created_at else None,
+        "expires_at": url.expires_at.isoformat() if url.expires_at else None,
+        "is_permanent": url.is_permanent,
+        "click_count": url.click_count,
+        "last_accessed": url.last_accessed.isoformat() if url.last_accessed else None,
+    }
+
+    if username is not None:
+        result["user"] = {"username": username}
+
+    return result
@@ -0,0 +1,282 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import DateTime, text, tuple_
+from app.server.shards import on_shard, shard_connection
+from app.server import db
+
+# One page of rows with opaque cursors to the neighbouring pages (None at the ends)
+KeysetPage = namedtuple("KeysetPage", "items next_cursor prev_cursor")
+
+
+# How listings compute pagination.total: a COUNT(*) per request, a COUNT(*)
+# shared for the count cache TTL, or the planner's row estimate
+COUNT_STRATEGIES = ["exact", "cached", "estimated"]
+
+# A partitioned table's own estimate is never updated by autovacuum; its
+# partitions' are summed, ignoring the ones never analyzed, e.g. empty ones
+ESTIMATED_ROWS = text("""
+    SELECT CASE WHEN c.relkind = 'p' THEN (
+               SELECT CASE WHEN max(p.reltuples) < 0 THEN -1
+                           ELSE sum(GREATEST(p.reltuples, 0)) END
+               FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+               WHERE i.inhparent = c.oid
+           ) ELSE c.reltuples END
+    FROM pg_class c
+    WHERE c.oid = CAST(:table AS regclass)
+    """)
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that is malformed or belongs to another sort order"""
+
+
+def encode_cursor(sort_by, order, direction, value, row_id):
+    """Opaque cursor pointing just past (value, row_id) in the given direction
+
+    row_id is the tie-breaking key, an id or, across shards, a short code.
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort_by, order, direction, value, row_id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort_by, order, column):
+    """Return (direction, value, id) of a cursor made for this sort order"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        cursor_sort_by, cursor_order, direction, value, row_id = payload
+        if isinstance(column.type, DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if (cursor_sort_by, cursor_order) != (sort_by, order):
+        raise InvalidCursor("Cursor belongs to a different sort order")
+    if direction not in ("next", "prev") or not isinstance(row_id, (int, str)):
+        raise InvalidCursor("Malformed cursor")
+    return direction, value, row_id
+
+
+def _segments(ascending):
+    """The sort order as (is_null_segment, ascending) runs, PostgreSQL style
+
+    NULLs sort after every value ascending and before every value descending.
+    Each run is read separately so both stay index range scans.
+    """
+    if ascending:
+        return [(False, True), (True, True)]
+    return [(True, False), (False, False)]
+
+
+def _segment_query(query, column, id_column, is_null, ascending, after):
+    if is_null:
+        query = query.filter(column.is_(None))
+        if after is not None:
+            bound = after[1]
+            query = query.filter(id_column > bound if ascending else id_column < bound)
+        return query.order_by(id_column.asc() if ascending else id_column.desc())
+
+    query = query.filter(column.isnot(None))
+    if after is not None:
+        position = tuple_(column, id_column)
+        bound = tuple_(*after)
+        query = query.filter(position > bound if ascending else position < bound)
+    if ascending:
+        return query.order_by(column.asc(), id_column.asc())
+    return query.order_by(column.desc(), id_column.desc())
+
+
+def _fetch(query, column, id_column, ascending, after, limit):
+    """Up to limit rows following position after, or from the start if None"""
+    segments = _segments(ascending)
+    if after is not None:
+        # Skip the runs that lie entirely before the cursor
+        start = next(
+            i
+            for i, (is_null, _) in enumerate(segments)
+            if is_null == (after[0] is None)
+        )
+        segments = segments[start:]
+
+    rows = []
+    for is_null, segment_ascending in segments:
+        segment = _segment_query(
+            query, column, id_column, is_null, segment_ascending, after
+        )
+        rows.extend(segment.limit(limit - len(rows)).all())
+        if len(rows) >= limit:
+            break
+        after = None
+    return rows
+
+
+def sort_key(column_key, id_key):
+    """Python sort key ordering rows like ascending SQL, NULLs last as in PostgreSQL
+
+    Sorting with reverse=True gives the descending order, NULLs first.
+    """
+
+    def key(row):
+        value = getattr(row, column_key)
+        return (value is None, value, getattr(row, id_key))
+
+    return key
+
+
+def keyset_paginate(
+    query, column, id_column, sort_by, order, cursor, per_page, shards=(None,)
+):
+    """Fetch one page of query sorted by (column, id) without OFFSET or COUNT
+
+    cursor is None or empty for the first page, otherwise a next_cursor or
+    prev_cursor of an earlier page with the same sort_by and order. Raises
+    InvalidCursor for anything else. With several shards the query runs on
+    each and the pages are merged, so id_column must be unique across them.
+    """
+    per_page = max(per_page, 1)
+    ascending = order == "asc"
+    direction, after = "next", None
+    if cursor:
+        direction, value, row_id = decode_cursor(cursor, sort_by, order, column)
+        if not isinstance(row_id, id_column.type.python_type):
+            # Made before the tie-breaking column changed, e.g. by sharding
+            raise InvalidCursor("Malformed cursor")
+        after = (value, row_id)
+
+    forward = direction == "next"
+    fetch_ascending = ascending == forward
+    rows = []
+    for shard in shards:
+        with on_shard(shard):
+            rows.extend(
+                _fetch(query, column, id_column, fetch_ascending, after, per_page + 1)
+            )
+    if len(shards) > 1:
+        rows.sort(key=sort_key(column.key, id_column.key), reverse=not fetch_ascending)
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    has_next = has_more if forward else after is not None
+    has_prev = after is not None if forward else has_more
+
+    def cursor_for(row, to):
+        return encode_cursor(
+            sort_by, order, to, getattr(row, column.key), getattr(row, id_column.key)
+        )
+
+    return KeysetPage(
+        items=rows,
+        next_cursor=cursor_for(rows[-1], "next") if rows and has_next else None,
+        prev_cursor=cursor_for(rows[0], "prev") if rows and has_prev else None,
+    )
+
+
+class ShardedPagination(Pagination):
+    """OFFSET pagination of a query run on every shard, merged in Python
+
+    Every shard returns its rows up to the end of the page, so deep pages
+    cost more than on a single database; keyset pagination does not.
+    """
+
+    def _query_items(self):
+        end = self._query_offset + self.per_page
+        rows = []
+        for shard in self._query_args["shards"]:
+            with on_shard(shard):
+                rows.extend(self._query_args["query"].limit(end).all())
+        rows.sort(key=self._query_args["key"], reverse=self._query_args["reverse"])
+        return rows[self._query_offset : end]
+
+    def _query_count(self):
+        total = 0
+        for shard in self._query_args["shards"]:
+            with on_shard(shard):
+                total += self._query_args["query"].order_by(None).count()
+        return total
+
+
+def paginate(query, column, id_column, order, page, per_page, shards=(None,)):
+    """OFFSET page of query sorted by column, without a total
+
+    With several shards the rows of all of them are merged, ties broken by
+    id_column, which must then be unique across them.
+    """
+    if len(shards) == 1:
+        with on_shard(shards[0]):
+            ordered = query.order_by(column.asc() if order == "asc" else column.desc())
+            return ordered.paginate(
+                page=page, per_page=per_page, error_out=False, count=False
+            )
+
+    if order == "asc":
+        ordered = query.order_by(column.asc(), id_column.asc())
+    else:
+        ordered = query.order_by(column.desc(), id_column.desc())
+    return ShardedPagination(
+        page=page,
+        per_page=per_page,
+        max_per_page=None,
+        error_out=False,
+        count=False,
+        query=ordered,
+        shards=shards,
+        key=sort_key(column.key, id_column.key),
+        reverse=order != "asc",
+    )
+
+
+def get_count_cache():
+    """Get the listing total cache of the current application"""
+    return current_app.extensions["count_cache"]
+
+
+def estimated_count(table_name, shards=(None,)):
+    """Row count of a table on all shards from planner statistics, or None if unknown"""
+    if db.engine.dialect.name != "postgresql":
+        return None
+    total = 0
+    for shard in shards:
+        reltuples = (
+            shard_connection(shard)
+            .execute(ESTIMATED_ROWS, {"table": table_name})
+            .scalar()
+        )
+        if reltuples is None or reltuples < 0:
+            # Never analyzed
+            return None
+        total += int(reltuples)
+    return total
+
+
+def count_rows(query, table_name, strategy, shards=(None,)):
+    """Total rows of an unfiltered listing of table_name, summed over shards
+
+    Returns (total, is_approximate). Estimates fall back to a cached count
+    when the table has no statistics yet.
+    """
+
+    def count():
+        total = 0
+        for shard in shards:
+            with on_shard(shard):
+                total += query.count()
+        return total
+
+    if strategy == "estimated":
+        total = estimated_count(table_name, shards)
+        if total is not None:
+            return total, True
+        strategy = "cached"
+    if strategy == "cached":
+        return get_count_cache().get_or_load(table_name, count), True
+    return count(), False
@@ -0,0 +1,355 @@
+import logging
+import re
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+from app.server.models import URL
+from app.server.shards import get_shard_router, shard_name
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+# Non-permanent URLs live in one partition per month of expires_at (UTC),
+# urls_p<year>_<month>; permanent URLs sort after every expiry, into their own
+PARTITION_KEY = (
+    "(CASE WHEN is_permanent THEN CAST('infinity' AS timestamptz) ELSE expires_at END)"
+)
+PARTITION_NAME = re.compile(r"^urls_p(\d{4})_(\d{2})$")
+PERMANENT_PARTITION = "urls_permanent"
+# URLs without a month partition: no expiry, or beyond the months created ahead
+DEFAULT_PARTITION = "urls_default"
+
+# Indexes of a partitioned urls standing in for its primary key and unique
+# short_code, which would have to include the partition key
+PARTITIONED_INDEXES = {
+    "ix_urls_id": "CREATE INDEX ix_urls_id ON urls (id)",
+    "ix_urls_short_code": "CREATE INDEX ix_urls_short_code ON urls (short_code)",
+}
+
+# Longest wait for the lock on urls when attaching or detaching a partition;
+# queueing behind a long query would block every redirect meanwhile
+PARTITION_LOCK_TIMEOUT = "5s"
+
+IS_PARTITIONED = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+    "WHERE partrelid = to_regclass('urls'))"
+)
+ATTACHED_PARTITIONS = text(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = to_regclass('urls')"
+)
+DETACHED_PARTITIONS = text(
+    "SELECT relname FROM pg_class "
+    "WHERE relkind = 'r' AND NOT relispartition "
+    "AND relnamespace = to_regnamespace(current_schema()) "
+    "AND relname LIKE 'urls\\_p%'"
+)
+
+# Short codes stay unique across partitions: a unique index of a partitioned
+# table must include the partition key, so inserts check all partitions, one
+# insert per code at a time. Raises what the unique index would have.
+UNIQUE_SHORT_CODE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION urls_unique_short_code() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(
+            hashtext('urls.short_code'), hashtext(NEW.short_code)
+        );
+        IF EXISTS (SELECT 1 FROM urls WHERE short_code = NEW.short_code) THEN
+            RAISE unique_violation USING
+                MESSAGE = format('duplicate short code %L in urls', NEW.short_code),
+                CONSTRAINT = 'ix_urls_short_code';
+        END IF;
+        RETURN NEW;
+    END
+    $$
+"""
+UNIQUE_SHORT_CODE_TRIGGER = (
+    "CREATE TRIGGER urls_unique_short_code BEFORE INSERT ON urls "
+    "FOR EACH ROW EXECUTE FUNCTION urls_unique_short_code()"
+)
+
+_COLUMNS = ", ".join(column.name for column in URL.__table__.c)
+
+
+def month_start(moment):
+    """First instant of the UTC month of moment"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, months):
+    """Start of the month months after the month starting at month"""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"urls_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name):
+    """Start of the month of a month partition, None for any other table"""
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+
+
+def is_partition(name):
+    """Whether name is one of the partitions of a partitioned urls"""
+    return name in (PERMANENT_PARTITION, DEFAULT_PARTITION) or bool(
+        PARTITION_NAME.match(name)
+    )
+
+
+def _literal(moment):
+    return f"'{moment.isoformat()}'"
+
+
+def urls_partitioned(connection):
+    """Whether urls is a partitioned table on the connection's database"""
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(IS_PARTITIONED).scalar()
+
+
+def attached_months(connection):
+    """Starts of the months with a partition attached to urls, oldest first"""
+    names = connection.execute(ATTACHED_PARTITIONS).scalars()
+    return sorted(filter(None, map(partition_month, names)))
+
+
+def create_partition(connection, month):
+    """Create and attach the partition of month, unless it exists
+
+    Rows of the month waiting in the default partition are moved into the new
+    one first, since attaching fails while the default still holds any.
+    Returns whether the partition was created.
+    """
+    if month in attached_months(connection):
+        return False
+
+    name = partition_name(month)
+    start, end = _literal(month), _literal(add_months(month, 1))
+    connection.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+    connection.execute(text(f"CREATE TABLE {name} (LIKE urls INCLUDING DEFAULTS)"))
+    connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE expires_at >= {start} AND expires_at < {end} "
+            f"RETURNING {_COLUMNS}) "
+            f"INSERT INTO {name} ({_COLUMNS}) SELECT {_COLUMNS} FROM moved"
+        )
+    )
+    connection.execute(
+        text(
+            f"ALTER TABLE urls ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({start}) TO ({end})"
+        )
+    )
+    return True
+
+
+def partition_urls(connection, months_ahead, foreign_keys=True, now=None):
+    """Turn a plain urls table into one partitioned by expiry month
+
+    Copies every row, so it is meant for small or new tables; the migration
+    to the partitioned layout does the same. Creates the partitions of the
+    current month and months_ahead months after it. Without foreign_keys,
+    e.g. on a shard, user_id does not reference users.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    sequence = connection.execute(
+        text("SELECT pg_get_serial_sequence('urls', 'id')")
+    ).scalar()
+
+    connection.execute(text("ALTER TABLE urls RENAME TO urls_unpartitioned"))
+    connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    connection.execute(
+        text(
+            "CREATE TABLE urls (LIKE urls_unpartitioned INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE ({PARTITION_KEY})"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE TABLE {PERMANENT_PARTITION} PARTITION OF urls "
+            "FOR VALUES FROM ('infinity') TO (MAXVALUE)"
+        )
+    )
+    connection.execute(
+        text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF urls DEFAULT")
+    )
+    month = month_start(now)
+    for months in range(months_ahead + 1):
+        create_partition(connection, add_months(month, months))
+
+    connection.execute(
+        text(f"INSERT INTO urls ({_COLUMNS}) SELECT {_COLUMNS} FROM urls_unpartitioned")
+    )
+    connection.execute(text("DROP TABLE urls_unpartitioned"))
+    connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY urls.id"))
+    if foreign_keys:
+        connection.execute(
+            text(
+                "ALTER TABLE urls ADD CONSTRAINT urls_user_id_fkey "
+                "FOREIGN KEY (user_id) REFERENCES users (id)"
+            )
+        )
+
+    # Indexes are built after loading, on all partitions at once
+    for index in URL.__table__.indexes:
+        if index.name not in PARTITIONED_INDEXES:
+            connection.execute(CreateIndex(index))
+    for statement in PARTITIONED_INDEXES.values():
+        connection.execute(text(statement))
+    connection.execute(text(UNIQUE_SHORT_CODE_FUNCTION))
+    connection.execute(text(UNIQUE_SHORT_CODE_TRIGGER))
+
+
+def row_cutoff(connection, now):
+    """Expiry before which expired URLs are removed row by row
+
+    Where urls is partitioned, URLs of a month partition are left to go with
+    it once the month is over, so only those older than every month
+    partition are removed one by one.
+    """
+    if not urls_partitioned(connection):
+        return now
+    return min([now] + attached_months(connection)[:1])
+
+
+def detach_expired_partitions(connection, now):
+    """Detach the month partitions whose every URL expired before now
+
+    Detaching hides all their rows at once; drop_detached_partition then
+    removes them. Returns the names of the detached partitions.
+    """
+    connection.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+    detached = []
+    for month in attached_months(connection):
+        if add_months(month, 1) > now:
+            break
+        name = partition_name(month)
+        connection.execute(text(f"ALTER TABLE urls DETACH PARTITION {name}"))
+        detached.append(name)
+    return detached
+
+
+def detached_partitions(connection, now):
+    """Month partitions of expired URLs detached from urls but not dropped yet"""
+    names = connection.execute(DETACHED_PARTITIONS).scalars()
+    return sorted(
+        name
+        for name in names
+        if partition_month(name) is not None
+        and add_months(partition_month(name), 1) <= now
+    )
+
+
+def detached_partition_rows(connection, name, after, limit):
+    """Up to limit rows of a detached partition with an id above after, by id"""
+    return connection.execute(
+        text(
+            f"SELECT {_COLUMNS} FROM {name} WHERE id > :after ORDER BY id LIMIT :limit"
+        ),
+        {"after": after, "limit": limit},
+    ).all()
+
+
+def drop_detached_partition(connection, name):
+    """Drop a detached partition; returns its URLs grouped for uncounting
+
+    The groups are rows of user_id, is_permanent, expires_at (the start of
+    its hour), url_count and click_count, see record_url_groups_deleted.
+    """
+    groups = connection.execute(
+        text(
+            "SELECT user_id, is_permanent, "
+            "date_trunc('hour', expires_at, 'UTC') AS expires_at, "
+            "count(*) AS url_count, "
+            "COALESCE(sum(click_count), 0) AS click_count "
+            f"FROM {name} GROUP BY 1, 2, 3"
+        )
+    ).all()
+    connection.execute(text(f"DROP TABLE {name}"))
+    return groups
+
+
+class PartitionManager:
+    """Creates the month partitions of urls ahead of the expiries written
+
+    Runs on every shard where urls is partitioned, see partition_urls; plain
+    tables are left alone. New URLs expiring in a month without a partition
+    go to the default partition until it is created. Dropping the expired
+    partitions is up to the reaper.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.months_ahead = 12
+        self.created_total = 0
+        self.last_run = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.months_ahead = app.config["URL_PARTITION_MONTHS_AHEAD"]
+        app.extensions["partition_manager"] = self
+
+    def create_ahead(self, now=None):
+        """Create the missing partitions up to months_ahead months from now
+
+        Returns a summary of the run.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        first = month_start(now)
+        created = []
+        for shard in get_shard_router().shards:
+            engine = db.engines[shard]
+            with engine.connect() as connection:
+                if not urls_partitioned(connection):
+                    continue
+            for months in range(self.months_ahead + 1):
+                month = add_months(first, months)
+                try:
+                    with engine.begin() as connection:
+                        if create_partition(connection, month):
+                            created.append(
+                                f"{shard_name(shard)}.{partition_name(month)}"
+                            )
+                except OperationalError:
+                    # Lock timeout; the next run tries again
+                    logger.exception(
+                        "Failed to create %s on %s",
+                        partition_name(month),
+                        shard_name(shard),
+                    )
+                    break
+
+        self.created_total += len(created)
+        self.last_run = {"created": created, "at": now.isoformat()}
+        if created:
+            logger.info("Created URL partitions %s", ", ".join(created))
+        return self.last_run
+
+    def stats(self):
+        """Return partition counters as a dictionary for metrics endpoints"""
+        return {
+            "months_ahead": self.months_ahead,
+            "created_total": self.created_total,
+            "last_run": self.last_run,
+        }
+
+
+def get_partition_manager():
+    """Get the URL partition manager of the current application"""
+    return current_app.extensions["partition_manager"]
@@ -0,0 +1,255 @@
+import logging
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.exc import OperationalError
+from app.server.models import URL
+from app.server.redirects import get_redirect_cache
+from app.server.bloom import get_short_code_filter
+from app.server.events import get_event_bus
+from app.server.stats import record_url_groups_deleted, record_urls_deleted
+from app.server.shards import get_shard_router, on_shard, shard_connection, shard_name
+from app.server.archive import get_url_archiver
+from app.server.partitions import (
+    detach_expired_partitions,
+    detached_partition_rows,
+    detached_partitions,
+    drop_detached_partition,
+    row_cutoff,
+    urls_partitioned,
+)
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+_urls = URL.__table__
+
+
+def expired_chunk(now, chunk_size, after=None):
+    """DELETE of the next chunk of expired URLs, oldest expiry first
+
+    Rows locked by a concurrent reaper are skipped rather than waited for.
+    after is the (expires_at, id) of the last row already handled.
+    """
+    candidates = select(_urls.c.id).where(
+        _urls.c.is_permanent == False, _urls.c.expires_at < now
+    )
+    if after is not None:
+        candidates = candidates.where(
+            tuple_(_urls.c.expires_at, _urls.c.id) > tuple_(*after)
+        )
+    candidates = (
+        candidates.order_by(_urls.c.expires_at, _urls.c.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True)
+    )
+    return (
+        delete(_urls)
+        .where(_urls.c.id.in_(candidates.scalar_subquery()))
+        .returning(*_urls.c)
+    )
+
+
+class Reaper:
+    """Deletes expired URLs in chunks of bounded size and time
+
+    Every chunk is its own short transaction, so locks are held briefly and
+    memory does not grow with the number of expired rows. A run stops once
+    its time budget is used up; the next run resumes after the last deleted
+    row, and starts over from the oldest expiry after a complete pass.
+    Shards are reaped one after the other, so a pass covers them all.
+
+    Where urls is partitioned by expiry month, the partitions of months
+    that are over are detached and dropped whole instead, leaving no dead
+    rows behind. Only URLs older than every month partition, which wait in
+    the default partition, are still deleted row by row; the expired URLs
+    of the current month go with its partition once the month is over.
+
+    With ARCHIVE_ENABLED, expired URLs are archived as they are deleted or
+    before their partition is dropped, see app.server.archive.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.chunk_size = 1000
+        self.time_budget = 30
+        self.archive = False
+        self.runs = 0
+        self.deleted_total = 0
+        self.dropped_partitions = 0
+        self.progress = None
+        self.last_run = None
+        self._cursor = None
+        self._shard_index = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.chunk_size = app.config["REAPER_CHUNK_SIZE"]
+        self.time_budget = app.config["REAPER_TIME_BUDGET"]
+        self.archive = app.config["ARCHIVE_ENABLED"]
+        app.extensions["reaper"] = self
+
+    def _delete_chunk(self, shard, cutoff, now, chunk_size, after):
+        archiver = get_url_archiver() if self.archive else None
+        with archiver.files() if archiver else nullcontext([]) as files:
+            with on_shard(shard):
+                rows = db.session.execute(
+                    expired_chunk(cutoff, chunk_size, after)
+                ).all()
+            if rows:
+                if archiver:
+                    files.append(archiver.store(rows, shard, now))
+                record_urls_deleted(db.session, rows)
+                get_event_bus().publish("urls_deleted", len(rows))
+            db.session.commit()
+
+        # Expired links are never served from cache; this only frees memory
+        redirect_cache = get_redirect_cache()
+        for row in rows:
+            redirect_cache.invalidate(row.short_code)
+        if rows:
+            get_short_code_filter().discard(len(rows))
+        return rows
+
+    def _archive_partition(self, shard, name, now):
+        """Archive every URL of the detached partition name before it is dropped"""
+        archiver = get_url_archiver()
+        after = 0
+        while True:
+            rows = detached_partition_rows(
+                shard_connection(shard), name, after, self.chunk_size
+            )
+            if not rows:
+                return
+            with archiver.files() as files:
+                files.append(archiver.store(rows, shard, now))
+                db.session.commit()
+            after = rows[-1].id
+
+    def _drop_partitions(self, shard, now, progress):
+        """Drop the expired month partitions of shard, if urls is partitioned
+
+        Returns the cutoff for deleting the remaining expired rows one by one.
+        """
+        if not urls_partitioned(shard_connection(shard)):
+            return now
+        try:
+            detach_expired_partitions(shard_connection(shard), now)
+            db.session.commit()
+        except OperationalError:
+            # Lock timeout; partitions not detached yet are dropped next run
+            db.session.rollback()
+            logger.exception("Failed to detach URL partitions of %s", shard_name(shard))
+
+        for name in detached_partitions(shard_connection(shard), now):
+            if self.archive:
+                self._archive_partition(shard, name, now)
+            groups = drop_detached_partition(shard_connection(shard), name)
+            record_url_groups_deleted(db.session, groups)
+            deleted = sum(group.url_count for group in groups)
+            if deleted:
+                get_event_bus().publish("urls_deleted", deleted)
+            db.session.commit()
+
+            # Expired links are never served from cache, so none is invalidated
+            if deleted:
+                get_short_code_filter().discard(deleted)
+            progress["deleted_count"] += deleted
+            progress["dropped_partitions"].append(name)
+            self.deleted_total += deleted
+            self.dropped_partitions += 1
+
+        return row_cutoff(shard_connection(shard), now)
+
+    def run(self, time_budget=None, chunk_size=None, now=None):
+        """Delete expired URLs until none are left or the time budget is used
+
+        Returns a summary of the run.
+        """
+        if time_budget is None:
+            time_budget = self.time_budget
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        started = time.monotonic()
+        shards = get_shard_router().shards
+        index = self._shard_index if self._shard_index < len(shards) else 0
+        cursor = self._cursor
+        progress = {
+            "deleted_count": 0,
+            "chunks": 0,
+            "dropped_partitions": [],
+            "complete": False,
+        }
+        self.progress = progress
+        cutoff = None
+        try:
+            while True:
+                if cutoff is None:
+                    cutoff = self._drop_partitions(shards[index], now, progress)
+                rows = self._delete_chunk(
+                    shards[index], cutoff, now, chunk_size, cursor
+                )
+                progress["chunks"] += 1
+                progress["deleted_count"] += len(rows)
+                self.deleted_total += len(rows)
+                if rows:
+                    last = max(rows, key=lambda row: (row.expires_at, row.id))
+                    cursor = (last.expires_at, last.id)
+
+                if len(rows) < chunk_size:
+                    # Done with this shard, go on with the next one
+                    cursor = None
+                    cutoff = None
+                    index += 1
+                    if index == len(shards):
+                        progress["complete"] = True
+                        index = 0
+                        break
+                if time.monotonic() - started >= time_budget:
+                    break
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self._cursor = cursor
+            self._shard_index = index
+            self.progress = None
+
+        self.runs += 1
+        summary = dict(
+            progress,
+            cutoff=now.isoformat(),
+            elapsed_seconds=round(time.monotonic() - started, 3),
+        )
+        self.last_run = summary
+        logger.info(
+            "Deleted %d expired URLs in %d chunks (%s)",
+            summary["deleted_count"],
+            summary["chunks"],
+            "complete" if summary["complete"] else "time budget used, will resume",
+        )
+        return summary
+
+    def stats(self):
+        """Return reaper counters as a dictionary for metrics endpoints"""
+        return {
+            "chunk_size": self.chunk_size,
+            "time_budget": self.time_budget,
+            "runs": self.runs,
+            "deleted_total": self.deleted_total,
+            "dropped_partitions": self.dropped_partitions,
+            "running": dict(self.progress) if self.progress else None,
+            "last_run": self.last_run,
+        }
+
+
+def get_reaper():
+    """Get the expired URL reaper of the current application"""
+    return current_app.extensions["reaper"]
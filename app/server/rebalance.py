@@ -0,0 +1,187 @@
+import time
+from collections import Counter
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from app.server.models import URL
+from app.server.shards import get_shard_router, shard_name
+from app.server import db
+
+# Rows read from a shard per chunk
+REBALANCE_CHUNK_SIZE = 1000
+
+# Short codes taken on their shard by another URL, kept for the summary
+CONFLICT_SAMPLE_SIZE = 10
+
+_urls = URL.__table__
+
+# Every column but the id, which the target shard assigns
+_COPIED_COLUMNS = [column for column in _urls.c if column.key != "id"]
+
+# Columns telling a copy made by an earlier, interrupted run from another URL
+_IDENTITY_COLUMNS = ("user_id", "original_url", "created_at")
+
+
+def _insert_copies(engine):
+    """INSERT into urls that skips rows conflicting with a unique index
+
+    A partitioned urls has none on short_code; taken codes are looked up first.
+    """
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(_urls).on_conflict_do_nothing().returning(_urls.c.short_code)
+
+
+class Rebalancer:
+    """Moves urls rows to the shard their short code hashes to
+
+    Run after adding a shard, while every worker has URL_SHARDS_REBALANCING
+    on so codes that were not moved yet are still found. Each shard is read
+    in id order, chunk by chunk. Misplaced rows are copied to their shard,
+    then deleted from the source, and clicks the source counted in between
+    are added to the copy. Rows keep their short code but get a new id.
+
+    Copies and deletions commit separately, so an interrupted run leaves
+    some rows on both shards. Running it again finishes those moves: a copy
+    with the same owner, URL and creation time counts as already made. A
+    code taken on its shard by a different URL is left alone and reported.
+    """
+
+    def __init__(self, chunk_size=REBALANCE_CHUNK_SIZE, dry_run=False, report=None):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.report = report or (lambda message: None)
+        self.counts = Counter()
+        self.moved = Counter()
+        self.conflicts = []
+
+    def _misplaced_chunks(self, router, source):
+        """Yield the misplaced rows of each chunk of source, by target shard"""
+        after_id = 0
+        while True:
+            with db.engines[source].connect() as connection:
+                rows = connection.execute(
+                    select(_urls)
+                    .where(_urls.c.id > after_id)
+                    .order_by(_urls.c.id)
+                    .limit(self.chunk_size)
+                ).all()
+            if not rows:
+                return
+            self.counts["scanned"] += len(rows)
+            after_id = rows[-1].id
+
+            by_target = {}
+            for row in rows:
+                target = router.shard_for(row.short_code)
+                if target != source:
+                    by_target.setdefault(target, []).append(row)
+            yield by_target
+
+    def _copy(self, target, rows):
+        """Copy rows to target; returns the short codes that are on it now"""
+        engine = db.engines[target]
+        with engine.begin() as connection:
+            # Copies of an earlier run, or different URLs with the same code
+            existing = {
+                found.short_code: found
+                for found in connection.execute(
+                    select(_urls).where(
+                        _urls.c.short_code.in_([row.short_code for row in rows])
+                    )
+                )
+            }
+            values = [
+                {column.key: row._mapping[column] for column in _COPIED_COLUMNS}
+                for row in rows
+                if row.short_code not in existing
+            ]
+            copied = set()
+            if values:
+                copied.update(
+                    connection.execute(_insert_copies(engine).values(values)).scalars()
+                )
+            for row in rows:
+                found = existing.get(row.short_code)
+                if found is None:
+                    continue
+                if all(
+                    getattr(found, name) == getattr(row, name)
+                    for name in _IDENTITY_COLUMNS
+                ):
+                    copied.add(row.short_code)
+                else:
+                    self._conflict(row.short_code, target)
+        return copied
+
+    def _conflict(self, short_code, target):
+        self.counts["conflicts"] += 1
+        if len(self.conflicts) < CONFLICT_SAMPLE_SIZE:
+            self.conflicts.append(
+                {"short_code": short_code, "shard": shard_name(target)}
+            )
+
+    def _move(self, source, target, rows):
+        copied = self._copy(target, rows)
+        if not copied:
+            return
+
+        with db.engines[source].begin() as connection:
+            deleted = dict(
+                connection.execute(
+                    delete(_urls)
+                    .where(_urls.c.short_code.in_(copied))
+                    .returning(_urls.c.short_code, _urls.c.click_count)
+                ).all()
+            )
+
+        # Clicks flushed to the source since it was read, and copies of rows
+        # deleted from the source meanwhile, e.g. by the reaper
+        read = {row.short_code: row.click_count or 0 for row in rows}
+        deltas = [
+            {"code": code, "delta": (click_count or 0) - read[code]}
+            for code, click_count in deleted.items()
+            if (click_count or 0) > read[code]
+        ]
+        gone = [code for code in copied if code not in deleted]
+        with db.engines[target].begin() as connection:
+            if deltas:
+                connection.execute(
+                    update(_urls)
+                    .where(_urls.c.short_code == bindparam("code"))
+                    .values(click_count=_urls.c.click_count + bindparam("delta")),
+                    deltas,
+                )
+            if gone:
+                connection.execute(delete(_urls).where(_urls.c.short_code.in_(gone)))
+
+        self.counts["moved"] += len(deleted)
+        self.moved[shard_name(target)] += len(deleted)
+
+    def run(self):
+        """Move every misplaced row to its shard
+
+        Returns a summary of the run.
+        """
+        started = time.monotonic()
+        router = get_shard_router()
+        for source in router.shards:
+            for by_target in self._misplaced_chunks(router, source):
+                for target, rows in by_target.items():
+                    self.counts["misplaced"] += len(rows)
+                    if not self.dry_run:
+                        self._move(source, target, rows)
+            self.report(
+                f"Scanned {shard_name(source)}; {self.counts['scanned']:,} rows "
+                f"and {self.counts['misplaced']:,} misplaced so far"
+            )
+
+        return {
+            "shards": [shard_name(shard) for shard in router.shards],
+            "scanned": self.counts["scanned"],
+            "misplaced": self.counts["misplaced"],
+            "moved": self.counts["moved"],
+            "moved_to": dict(self.moved),
+            "conflicts": self.counts["conflicts"],
+            "conflicts_sample": self.conflicts,
+            "dry_run": self.dry_run,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }
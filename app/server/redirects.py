@@ -0,0 +1,98 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import bindparam, or_, select
+from app.server.models import URL
+from app.server.bloom import get_short_code_filter
+from app.server.replica import reading_from_replica
+from app.server.shards import get_shard_router, shard_connection
+from app.server import db
+
+# Immutable record of everything the redirect endpoint needs about a URL
+RedirectEntry = namedtuple(
+    "RedirectEntry", ["original_url", "expires_at", "is_permanent"]
+)
+
+# Column-projected lookup of a live URL, built once and reused by every redirect
+_urls = URL.__table__
+REDIRECT_LOOKUP = select(
+    _urls.c.original_url, _urls.c.expires_at, _urls.c.is_permanent
+).where(
+    _urls.c.short_code == bindparam("short_code"),
+    or_(
+        _urls.c.is_permanent.is_(True),
+        _urls.c.expires_at.is_(None),
+        _urls.c.expires_at >= bindparam("now"),
+    ),
+)
+
+
+def get_redirect_cache():
+    """Get the redirect cache of the current application"""
+    return current_app.extensions["redirect_cache"]
+
+
+def cache_ttl_for(entry, now=None):
+    """Seconds an entry may be cached without outliving the link itself"""
+    ttl = get_redirect_cache().ttl
+    if entry.is_permanent or entry.expires_at is None:
+        return ttl
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return min(ttl, (entry.expires_at - now).total_seconds())
+
+
+def lookup_redirect(short_code, now=None):
+    """Fetch the RedirectEntry of a live short code from the database, or None
+
+    Selects only the columns a redirect needs and checks expiry in SQL, so no
+    ORM entity is built. The row is read from the shard holding the code. A
+    code missing on the read replica is looked up on the primary too, since
+    it may have been created a moment ago.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    parameters = {"short_code": short_code, "now": now}
+    router = get_shard_router()
+    shard = router.shard_for(short_code)
+    if shard is None:
+        connection = db.session.connection(bind_arguments={"clause": REDIRECT_LOOKUP})
+        row = connection.execute(REDIRECT_LOOKUP, parameters).first()
+        if row is None and reading_from_replica():
+            row = db.session.connection().execute(REDIRECT_LOOKUP, parameters).first()
+    else:
+        row = shard_connection(shard).execute(REDIRECT_LOOKUP, parameters).first()
+
+    if row is None:
+        # Not moved to its shard yet while rebalancing?
+        for other in router.fallbacks(shard):
+            row = shard_connection(other).execute(REDIRECT_LOOKUP, parameters).first()
+            if row is not None:
+                break
+    return RedirectEntry._make(row) if row else None
+
+
+def resolve_redirect(short_code):
+    """Return the RedirectEntry for a live short code, or None"""
+    cache = get_redirect_cache()
+
+    entry = cache.get(short_code)
+    if entry is not None:
+        return entry
+
+    # Scanners and typos are answered without a database round trip
+    short_code_filter = get_short_code_filter()
+    if not short_code_filter.might_exist(short_code):
+        return None
+
+    # A url_created event handled during the lookup must win over its miss
+    version = short_code_filter.version()
+    entry = lookup_redirect(short_code)
+    if entry is None:
+        short_code_filter.remember_missing(short_code, version)
+        return None
+
+    cache.set(short_code, entry, ttl=cache_ttl_for(entry))
+    return entry
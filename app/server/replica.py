@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.sql.dml import UpdateBase
+
+# Bind key of the read-only replica in SQLALCHEMY_BINDS
+REPLICA_BIND = "replica"
+
+# Set on responses to requests that wrote, so the client's next reads see them
+READ_PRIMARY_COOKIE = "read_primary"
+
+
+class RoutingSession(Session):
+    """Session that routes statements on urls to shards and reads to the replica
+
+    Statements on urls go to the shard selected with shards.on_shard, if
+    any. Otherwise plain SELECTs go to the read replica when switched on for
+    the current session; even then flushes, INSERT/UPDATE/DELETE, locking
+    reads and textual SQL use the primary. Writes are recorded in
+    session.info["wrote"].
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            writing = self._flushing or isinstance(clause, UpdateBase)
+            if writing:
+                self.info["wrote"] = True
+
+            shard = self.info.get("url_shard")
+            if shard is not None and _on_sharded_table(mapper, clause):
+                return self._db.engines[shard]
+
+            if (
+                not writing
+                and self.info.get("read_replica")
+                and isinstance(clause, Select)
+                and clause._for_update_arg is None
+            ):
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _on_sharded_table(mapper, clause):
+    """Whether a mapper or statement works on a table marked as sharded"""
+    if mapper is not None:
+        return inspect(mapper).local_table.info.get("sharded", False)
+    if clause is None:
+        return False
+    return any(
+        table.info.get("sharded", False)
+        for table in find_tables(clause, include_crud=True)
+    )
+
+
+# app.server imports RoutingSession to create db, so db is imported lazily below
+
+
+def reading_from_replica():
+    """Whether plain SELECTs of the current session go to the read replica"""
+    from app.server import db
+
+    return bool(db.session.info.get("read_replica")) and REPLICA_BIND in db.engines
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Switch replica reads of the current session on or off within a block"""
+    from app.server import db
+
+    info = db.session.info
+    previous = info.get("read_replica", False)
+    info["read_replica"] = enabled
+    try:
+        yield
+    finally:
+        info["read_replica"] = previous
+
+
+def reads_from_replica(f):
+    """Decorator running a read-only view's SELECTs on the read replica
+
+    Clients that wrote within the replica's maximum lag keep reading from the
+    primary, so they see their own writes. Apply it below the authentication
+    decorators, whose principal lookups must stay on the primary.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.cookies.get(READ_PRIMARY_COOKIE):
+            return f(*args, **kwargs)
+        with replica_reads():
+            return f(*args, **kwargs)
+
+    return decorated_function
+
+
+class ReadReplica:
+    """Routes read-only views to an optional replica bind, see reads_from_replica"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_lag = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_lag = app.config["REPLICA_MAX_LAG"]
+        app.extensions["read_replica"] = self
+        if REPLICA_BIND in app.config.get("SQLALCHEMY_BINDS", {}):
+            app.after_request(self._remember_writes)
+
+    def _remember_writes(self, response):
+        from app.server import db
+
+        if db.session.info.get("wrote"):
+            response.set_cookie(
+                READ_PRIMARY_COOKIE,
+                "1",
+                httponly=True,
+                samesite="Lax",
+                max_age=self.max_lag,
+            )
+        return response
+
+    def stats(self):
+        """Return connection pool states as a dictionary for metrics endpoints"""
+        from app.server import db
+
+        return {
+            "replica_enabled": REPLICA_BIND in db.engines,
+            "max_lag": self.max_lag,
+            "pools": {
+                bind or "primary": engine.pool.status()
+                for bind, engine in db.engines.items()
+            },
+        }
+
+
+def get_read_replica():
+    """Get the read replica router of the current application"""
+    return current_app.extensions["read_replica"]
@@ -1,7 +1,44 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime
-from app.server.models import URL, User
-from app.server.auth import require_admin_auth
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    request,
+    jsonify,
+    stream_with_context,
+)
+from datetime import datetime, timezone
+from app.server.models import URL, URL_LISTING_COLUMNS, User, serialize_url
+from app.server.auth import require_admin_auth, get_principal_cache
+from app.server.redirects import get_redirect_cache
+from app.server.clicks import get_click_aggregator
+from app.server.bloom import get_short_code_filter
+from app.server.events import get_event_bus
+from app.server.codes import get_code_allocator
+from app.server.hashing import get_password_hasher
+from app.server.stats import cached_system_stats, get_stats_cache
+from app.server.scheduler import get_scheduler
+from app.server.reaper import get_reaper
+from app.server.partitions import get_partition_manager
+from app.server.archive import RestoreConflict, get_url_archiver
+from app.server.startup import get_startup_timer
+from app.server.replica import get_read_replica, reads_from_replica
+from app.server.export import (
+    EXPORT_FORMATS,
+    EXPORT_STATES,
+    csv_chunks,
+    encode_chunks,
+    export_batches,
+    export_statement,
+    ndjson_chunks,
+)
+from app.server.pagination import (
+    COUNT_STRATEGIES,
+    InvalidCursor,
+    count_rows,
+    keyset_paginate,
+    paginate,
+)
+from app.server.shards import get_shard_router, lookup_usernames
 from app.server import db
 
 admin_bp = Blueprint("admin", __name__)
@@ -10,90 +47,131 @@ admin_bp = Blueprint("admin", __name__)
 @admin_bp.route("/cleanup", methods=["DELETE"])
 @require_admin_auth
 def cleanup_expired_urls():
-    """Remove expired URLs from the database (admin only)"""
-    try:
-        current_time = datetime.utcnow()
-
-        # Find all expired URLs (non-permanent URLs that have passed their expiration date)
-        expired_urls = URL.query.filter(
-            URL.is_permanent == False, URL.expires_at < current_time
-        ).all()
-
-        # Count expired URLs before deletion
-        expired_count = len(expired_urls)
+    """Remove expired URLs from the database in chunks (admin only)
 
-        # Delete expired URLs
-        for url in expired_urls:
-            db.session.delete(url)
-
-        # Commit the changes
-        db.session.commit()
+    Stops after `time_budget` seconds; calling again resumes where it stopped.
+    """
+    try:
+        time_budget = request.args.get("time_budget", type=float)
+        summary = get_reaper().run(time_budget=time_budget)
+        expired_count = summary["deleted_count"]
 
         return jsonify(
             {
                 "message": f"Successfully cleaned up {expired_count} expired URLs",
                 "deleted_count": expired_count,
-                "cleanup_time": current_time.isoformat(),
+                "cleanup_time": summary["cutoff"],
+                "complete": summary["complete"],
+                "chunks": summary["chunks"],
+                "elapsed_seconds": summary["elapsed_seconds"],
             }
         )
 
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": "Internal server error during cleanup"}), 500
 
 
-@admin_bp.route("/stats", methods=["GET"])
+@admin_bp.route("/urls/<short_code>/restore", methods=["POST"])
 @require_admin_auth
-def get_system_stats():
-    """Get system-wide statistics (admin only)"""
-    try:
-        current_time = datetime.utcnow()
-
-        # Total URLs
-        total_urls = URL.query.count()
-
-        # Active URLs (non-expired)
-        active_urls = URL.query.filter(
-            db.or_(URL.is_permanent == True, URL.expires_at > current_time)
-        ).count()
+def restore_archived_url(short_code):
+    """Put an archived URL back into service (admin only)
+
+    Optional JSON: "permanent" (true or false) to change its permanence,
+    "expires_at" (ISO 8601, in the future) for a new expiry; an expired URL
+    otherwise gets the default one.
+    """
+    data = request.get_json(silent=True) or {}
+    permanent = data.get("permanent")
+    if permanent is not None and not isinstance(permanent, bool):
+        return jsonify({"error": "Invalid permanent, must be true or false"}), 400
+    expires_at = None
+    if data.get("expires_at"):
+        try:
+            expires_at = datetime.fromisoformat(data["expires_at"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid expires_at"}), 400
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            return jsonify({"error": "Invalid expires_at, must be in the future"}), 400
 
-        # Expired URLs
-        expired_urls = URL.query.filter(
-            URL.is_permanent == False, URL.expires_at < current_time
-        ).count()
+    try:
+        url = get_url_archiver().restore(
+            short_code, expires_at=expires_at, is_permanent=permanent
+        )
+        if url is None:
+            db.session.rollback()
+            return jsonify({"error": "Archived URL not found"}), 404
 
-        # Permanent URLs
-        permanent_urls = URL.query.filter_by(is_permanent=True).count()
+        # Described before commit, like a new URL, see shorten_url
+        response_data = serialize_url(url)
+        response_data["restored"] = True
+        db.session.commit()
+        get_short_code_filter().add(short_code)
+        return jsonify(response_data)
 
-        # Total clicks
-        total_clicks = db.session.query(db.func.sum(URL.click_count)).scalar() or 0
+    except RestoreConflict as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 409
 
-        # Total users
-        total_users = User.query.count()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Internal server error"}), 500
 
-        # Active users (users with at least one URL)
-        active_users = db.session.query(User.id).join(URL).distinct().count()
 
-        return jsonify(
-            {
-                "urls": {
-                    "total": total_urls,
-                    "active": active_urls,
-                    "expired": expired_urls,
-                    "permanent": permanent_urls,
-                },
-                "clicks": {"total": total_clicks},
-                "users": {"total": total_users, "active": active_users},
-                "generated_at": current_time.isoformat(),
-            }
+@admin_bp.route("/stats", methods=["GET"])
+@require_admin_auth
+def get_system_stats():
+    """Get system-wide statistics (admin only)"""
+    try:
+        stats = dict(cached_system_stats())
+        generated_at = stats["generated_at"]
+        stats["generated_at"] = generated_at.isoformat()
+        stats["age_seconds"] = round(
+            (datetime.now(timezone.utc) - generated_at).total_seconds(), 1
         )
+        return jsonify(stats)
 
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
 
+@admin_bp.route("/metrics", methods=["GET"])
+@require_admin_auth
+def get_metrics():
+    """Get in-process cache metrics of the serving worker (admin only)"""
+    return jsonify(
+        {
+            "redirect_cache": get_redirect_cache().stats(),
+            "principal_cache": get_principal_cache().stats(),
+            "clicks": get_click_aggregator().stats(),
+            "short_code_filter": get_short_code_filter().stats(),
+            "event_bus": get_event_bus().stats(),
+            "code_allocator": get_code_allocator().stats(),
+            "password_hasher": get_password_hasher().stats(),
+            "stats_cache": get_stats_cache().stats(),
+            "scheduler": get_scheduler().stats(),
+            "reaper": get_reaper().stats(),
+            "partitions": get_partition_manager().stats(),
+            "archive": get_url_archiver().stats(),
+            "startup": get_startup_timer().stats(),
+            "database": get_read_replica().stats(),
+            "shards": get_shard_router().stats(),
+        }
+    )
+
+
+def serialize_listing(rows, sharded):
+    """Serialize URL listing rows with their owner's username"""
+    if not sharded:
+        return [serialize_url(row, row.username) for row in rows]
+    usernames = lookup_usernames(row.user_id for row in rows)
+    return [serialize_url(row, usernames.get(row.user_id)) for row in rows]
+
+
 @admin_bp.route("/urls", methods=["GET"])
 @require_admin_auth
+@reads_from_replica
 def list_all_urls():
     """List all URLs with pagination and sorting"""
     try:
@@ -121,21 +199,74 @@ def list_all_urls():
         if order not in ["asc", "desc"]:
             return jsonify({"error": "Invalid order. Valid options: asc, desc"}), 400
 
-        # Build query
-        query = URL.query
+        # Validate count parameter
+        count_strategy = request.args.get(
+            "count", current_app.config["ADMIN_COUNT_STRATEGY"]
+        )
+        if count_strategy not in COUNT_STRATEGIES:
+            return (
+                jsonify({"error": f"Invalid count. Valid options: {COUNT_STRATEGIES}"}),
+                400,
+            )
 
-        # Apply sorting
-        sort_column = getattr(URL, sort_by)
-        if order == "desc":
-            query = query.order_by(sort_column.desc())
+        # Build query: URL columns and the owner's username in one joined select,
+        # or, since shards hold no users, the owner's id to look up afterwards
+        router = get_shard_router()
+        if router.sharded:
+            query = db.session.query(*URL_LISTING_COLUMNS, URL.user_id)
         else:
-            query = query.order_by(sort_column.asc())
+            query = db.session.query(*URL_LISTING_COLUMNS, User.username).join(
+                User, URL.user_id == User.id
+            )
+        sort_column = getattr(URL, sort_by)
 
-        # Apply pagination
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Cursor mode: ?cursor= for the first page, then next_cursor/prev_cursor
+        if "cursor" in request.args:
+            try:
+                keyset_page = keyset_paginate(
+                    query,
+                    sort_column,
+                    router.tiebreak_column,
+                    sort_by,
+                    order,
+                    request.args["cursor"],
+                    per_page,
+                    shards=router.shards,
+                )
+            except InvalidCursor as e:
+                return jsonify({"error": f"Invalid cursor: {e}"}), 400
+
+            return jsonify(
+                {
+                    "urls": serialize_listing(keyset_page.items, router.sharded),
+                    "pagination": {
+                        "per_page": per_page,
+                        "next_cursor": keyset_page.next_cursor,
+                        "prev_cursor": keyset_page.prev_cursor,
+                        "has_next": keyset_page.next_cursor is not None,
+                        "has_prev": keyset_page.prev_cursor is not None,
+                    },
+                    "sort": {"sort_by": sort_by, "order": order},
+                }
+            )
 
-        # Convert URLs to dictionaries with user information
-        urls = [url.to_dict(include_user=True) for url in pagination.items]
+        # Apply sorting and pagination, counting all URLs with the requested strategy
+        total, total_is_approximate = count_rows(
+            URL.query, "urls", count_strategy, shards=router.shards
+        )
+        pagination = paginate(
+            query,
+            sort_column,
+            router.tiebreak_column,
+            order,
+            page,
+            per_page,
+            shards=router.shards,
+        )
+        pagination.total = total
+
+        # Convert rows to dictionaries with user information
+        urls = serialize_listing(pagination.items, router.sharded)
 
         return jsonify(
             {
@@ -147,6 +278,7 @@ def list_all_urls():
                     "pages": pagination.pages,
                     "has_next": pagination.has_next,
                     "has_prev": pagination.has_prev,
+                    "total_is_approximate": total_is_approximate,
                 },
                 "sort": {"sort_by": sort_by, "order": order},
             }
@@ -158,6 +290,7 @@ def list_all_urls():
 
 @admin_bp.route("/users", methods=["GET"])
 @require_admin_auth
+@reads_from_replica
 def list_users():
     """List all users with their URL counts (admin only)"""
     try:
@@ -165,27 +298,36 @@ def list_users():
         page = request.args.get("page", 1, type=int)
         per_page = min(request.args.get("per_page", 20, type=int), 100)
 
-        # Build query with URL counts
-        query = (
-            db.session.query(User, db.func.count(URL.id).label("url_count"))
-            .outerjoin(URL)
-            .group_by(User.id)
-            .order_by(User.created_at.desc())
+        # Validate count parameter
+        count_strategy = request.args.get(
+            "count", current_app.config["ADMIN_COUNT_STRATEGY"]
         )
+        if count_strategy not in COUNT_STRATEGIES:
+            return (
+                jsonify({"error": f"Invalid count. Valid options: {COUNT_STRATEGIES}"}),
+                400,
+            )
 
-        # Apply pagination
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Build query; URL counts are maintained on the users themselves
+        query = User.query.order_by(User.created_at.desc())
+
+        # Apply pagination, counting all users with the requested strategy
+        total, total_is_approximate = count_rows(User.query, "users", count_strategy)
+        pagination = query.paginate(
+            page=page, per_page=per_page, error_out=False, count=False
+        )
+        pagination.total = total
 
         # Convert to response format
         users = []
-        for user, url_count in pagination.items:
+        for user in pagination.items:
             users.append(
                 {
                     "id": user.id,
                     "username": user.username,
                     "created_at": user.created_at.isoformat(),
                     "is_active": user.is_active,
-                    "url_count": url_count,
+                    "url_count": user.url_count,
                 }
             )
 
@@ -199,9 +341,99 @@ def list_users():
                     "pages": pagination.pages,
                     "has_next": pagination.has_next,
                     "has_prev": pagination.has_prev,
+                    "total_is_approximate": total_is_approximate,
                 },
             }
         )
 
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
+
+
+@admin_bp.route("/export", methods=["GET"])
+@require_admin_auth
+def export_urls():
+    """Stream every URL as NDJSON or CSV (admin only)
+
+    Optionally filtered by user, state and created_after/created_before.
+    Rows come in id order, shard by shard if sharded; after_id resumes an
+    interrupted export of an unsharded database. The response is
+    gzip-compressed when the client accepts gzip.
+    """
+    try:
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return (
+                jsonify(
+                    {"error": f"Invalid format. Valid options: {list(EXPORT_FORMATS)}"}
+                ),
+                400,
+            )
+
+        state = request.args.get("state", "all")
+        if state not in EXPORT_STATES:
+            return (
+                jsonify({"error": f"Invalid state. Valid options: {EXPORT_STATES}"}),
+                400,
+            )
+
+        after_id = request.args.get("after_id", 0, type=int)
+        router = get_shard_router()
+        if after_id and router.sharded:
+            # Ids repeat across shards, so they cannot mark a position
+            return (
+                jsonify({"error": "after_id is not supported with sharded URLs"}),
+                400,
+            )
+
+        # Created range, ISO 8601; times without an offset are UTC
+        created_range = {}
+        for name in ["created_after", "created_before"]:
+            value = request.args.get(name)
+            if value is None:
+                continue
+            try:
+                moment = datetime.fromisoformat(value)
+            except ValueError:
+                return jsonify({"error": f"Invalid {name}, expected ISO 8601"}), 400
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            created_range[name] = moment
+
+        user_id = None
+        username = request.args.get("user")
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if not user:
+                return jsonify({"error": "User not found"}), 404
+            user_id = user.id
+
+        statement = export_statement(
+            user_id=user_id,
+            state=state,
+            after_id=after_id,
+            sharded=router.sharded,
+            **created_range,
+        )
+
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+    batches = export_batches(statement, router.shards if router.sharded else None)
+    if export_format == "csv":
+        chunks = csv_chunks(batches)
+    else:
+        chunks = ndjson_chunks(batches)
+    compress = "gzip" in request.accept_encodings
+
+    response = Response(
+        stream_with_context(encode_chunks(chunks, compress)),
+        mimetype=EXPORT_FORMATS[export_format],
+    )
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="urls.{export_format}"'
+    )
+    response.headers["Vary"] = "Accept-Encoding"
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -1,15 +1,36 @@
 from flask import Blueprint, redirect, jsonify, abort, request, make_response
-from app.server.models import User, URL
+from app.server.models import User
 from app.server import db
-from app.server.auth import generate_jwt, require_user_auth, get_current_user
+from app.server.auth import (
+    generate_jwt,
+    require_user_auth,
+    get_current_user,
+    forget_principal,
+)
 from app.server.validators import validate_credentials
-import bcrypt
+from app.server.redirects import resolve_redirect
+from app.server.replica import reading_from_replica, reads_from_replica, replica_reads
+from app.server.shards import find_url
+from app.server.archive import find_archived_url
+from app.server.clicks import get_click_aggregator
+from app.server.events import get_event_bus
+from app.server.hashing import HasherBusy, get_password_hasher
+from app.server.stats import update_counters
 import secrets
 
 public_bp = Blueprint("public", __name__)
 
 
+def hasher_busy_response():
+    """503 telling the client to retry once the password hashing queue drains"""
+    response = jsonify({"error": "Too many login attempts in progress, retry shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
 @public_bp.route("/<short_code>")
+@reads_from_replica
 def redirect_url(short_code):
     """Redirect to the original URL using the short code"""
     # Skip if this looks like a static file (has file extension)
@@ -19,31 +40,32 @@ def redirect_url(short_code):
 
         return current_app.send_static_file(short_code)
 
-    # Find the URL by short code
-    url = URL.query.filter_by(short_code=short_code).first()
-
-    if not url:
-        abort(404)
+    # Find the live URL by short code (served from the redirect cache when possible)
+    entry = resolve_redirect(short_code)
 
-    # Check if URL has expired
-    if url.is_expired:
+    if not entry:
         abort(404)
 
-    # Increment click count and update last accessed time
-    url.increment_click_count()
+    # Buffer the click; click count and last accessed time are written back in batches
+    get_click_aggregator().record(short_code)
 
     # Redirect to the original URL
-    return redirect(url.original_url, code=302)
+    return redirect(entry.original_url, code=302)
 
 
 @public_bp.route("/stats/<short_code>")
+@reads_from_replica
 def get_url_stats(short_code):
     """Get statistics for a shortened URL"""
-    # Find the URL by short code
-    url = URL.query.filter_by(short_code=short_code).first()
+    # Find the URL by short code on the shard holding it
+    url = find_url(short_code)
+    if not url and reading_from_replica():
+        # Created a moment ago and not replicated yet?
+        with replica_reads(False):
+            url = find_url(short_code)
 
     if not url:
-        return jsonify({"error": "Short URL not found"}), 404
+        return archived_url_stats(short_code)
 
     # Check if URL has expired
     if url.is_expired:
@@ -65,6 +87,33 @@ def get_url_stats(short_code):
     )
 
 
+def archived_url_stats(short_code):
+    """Statistics of a URL archived for being idle; 404 for any other code"""
+    url = find_archived_url(short_code)
+    if not url:
+        return jsonify({"error": "Short URL not found"}), 404
+    if url.reason == "expired":
+        return jsonify({"error": "Short URL has expired"}), 404
+
+    # Archived links do not redirect until an admin restores them
+    return jsonify(
+        {
+            "short_code": url.short_code,
+            "original_url": url.original_url,
+            "created_at": url.created_at.isoformat() if url.created_at else None,
+            "expires_at": url.expires_at.isoformat() if url.expires_at else None,
+            "is_permanent": url.is_permanent,
+            "click_count": url.click_count,
+            "last_accessed": (
+                url.last_accessed.isoformat() if url.last_accessed else None
+            ),
+            "archived": True,
+            "archived_at": url.archived_at.isoformat(),
+            "archive_reason": url.reason,
+        }
+    )
+
+
 @public_bp.route("/register", methods=["POST"])
 def register():
     """Register a new user"""
@@ -82,15 +131,19 @@ def register():
     if User.query.filter_by(username=username).first():
         return jsonify({"error": "Username already exists"}), 409
 
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    try:
+        hashed_password = get_password_hasher().hash(password)
+    except HasherBusy:
+        return hasher_busy_response()
     access_token = secrets.token_hex(16)
 
     new_user = User(
         username=username,
-        password=hashed_password.decode("utf-8"),
+        password=hashed_password,
         access_token=access_token,
     )
     db.session.add(new_user)
+    update_counters(db.session, {"total_users": 1})
     db.session.commit()
 
     jwt_token = generate_jwt(username, "user", access_token)
@@ -118,14 +171,25 @@ def login():
     password = data["password"]
 
     user = User.query.filter_by(username=username).first()
-    if not user or not bcrypt.checkpw(
-        password.encode("utf-8"), user.password.encode("utf-8")
-    ):
-        return jsonify({"error": "Invalid username or password"}), 401
-
-    # Generate a new access token for the user
+    hasher = get_password_hasher()
+    try:
+        if not user or not hasher.verify(password, user.password):
+            return jsonify({"error": "Invalid username or password"}), 401
+
+        # Upgrade the stored hash when the configured cost changed
+        if hasher.needs_rehash(user.password):
+            user.password = hasher.hash(password)
+    except HasherBusy:
+        return hasher_busy_response()
+
+    # Generate a new access token for the user; the old one stops working on every worker
+    revoked = ["user", user.username, user.access_token]
     user.access_token = secrets.token_hex(16)
+    if revoked[2]:
+        get_event_bus().publish("auth_revoked", revoked)
     db.session.commit()
+    if revoked[2]:
+        forget_principal(revoked)
 
     jwt_token = generate_jwt(username, "user", user.access_token)
 
@@ -148,8 +212,11 @@ def logout():
     current_user = get_current_user()
 
     if current_user:
-        current_user.access_token = None
+        revoked = ["user", current_user.username, current_user.access_token]
+        User.query.filter_by(id=current_user.id).update({"access_token": None})
+        get_event_bus().publish("auth_revoked", revoked)
         db.session.commit()
+        forget_principal(revoked)
 
     response = make_response(jsonify({}), 200)
     response.set_cookie(
@@ -1,11 +1,31 @@
-from flask import Blueprint, request, jsonify
-from app.server.models import URL
+from flask import Blueprint, current_app, request, jsonify
+from datetime import datetime, timezone
+from sqlalchemy.exc import IntegrityError
+from app.server.models import (
+    URL,
+    URL_LISTING_COLUMNS,
+    User,
+    default_expires_at,
+    serialize_url,
+    url_digest,
+)
 from app.server.auth import require_user_auth, get_current_user
 from app.server.utils import generate_short_code, is_valid_url, build_short_url
+from app.server.bloom import get_short_code_filter
+from app.server.events import get_event_bus
+from app.server.stats import record_url_created, record_urls_created
+from app.server.bulk import MAX_SHORT_CODE_ATTEMPTS, insert_urls
+from app.server.dedup import find_live_url, lock_url_digest
+from app.server.pagination import InvalidCursor, keyset_paginate, paginate
+from app.server.replica import reads_from_replica
+from app.server.shards import get_shard_router, on_shard
 from app.server import db
 
 user_bp = Blueprint("user", __name__)
 
+# Short codes per urls_created event; NOTIFY payloads are limited to 8000 bytes
+CODES_PER_EVENT = 500
+
 
 @user_bp.route("/auth-status", methods=["GET"])
 @require_user_auth
@@ -20,10 +40,32 @@ def auth_status():
     )
 
 
+def shortened_url_response(url):
+    """Response body describing a shortened URL, from a URL object or row"""
+    response_data = {
+        "short_url": build_short_url(url.short_code, request),
+        "short_code": url.short_code,
+        "original_url": url.original_url,
+        "created_at": url.created_at.isoformat(),
+        "is_permanent": url.is_permanent,
+    }
+
+    # Add expiration info if not permanent
+    if not url.is_permanent:
+        response_data["expires_at"] = url.expires_at.isoformat()
+
+    return response_data
+
+
 @user_bp.route("/shorten", methods=["POST"])
 @require_user_auth
 def shorten_url():
-    """Create a shortened URL (requires user authentication)"""
+    """Create a shortened URL (requires user authentication)
+
+    With "deduplicate" (default SHORTEN_DEDUPLICATE), a live URL of the user
+    with the same normalized original URL and permanence is returned with
+    status 200 instead of creating another one.
+    """
     try:
         data = request.get_json()
 
@@ -32,6 +74,7 @@ def shorten_url():
 
         original_url = data.get("url")
         is_permanent = data.get("permanent", False)
+        deduplicate = data.get("deduplicate", current_app.config["SHORTEN_DEDUPLICATE"])
 
         # Validate required fields
         if not original_url:
@@ -44,40 +87,149 @@ def shorten_url():
         # Get current user
         current_user = get_current_user()
 
-        # Generate unique short code
-        try:
+        if deduplicate:
+            # Concurrent requests for the same URL wait until this one commits
+            digest = url_digest(original_url)
+            lock_url_digest(current_user.id, digest)
+            url = find_live_url(current_user.id, digest, bool(is_permanent))
+            if url is not None:
+                db.session.commit()
+                response_data = shortened_url_response(url)
+                response_data["deduplicated"] = True
+                return jsonify(response_data), 200
+
+        # Allocate a short code and save the new URL entry on its shard
+        router = get_shard_router()
+        for _ in range(MAX_SHORT_CODE_ATTEMPTS):
             short_code = generate_short_code()
-        except Exception as e:
+            url = URL(
+                original_url=original_url,
+                short_code=short_code,
+                user_id=current_user.id,
+                is_permanent=is_permanent,
+            )
+            try:
+                with on_shard(router.shard_for(short_code)):
+                    with db.session.begin_nested():
+                        db.session.add(url)
+                break
+            except IntegrityError:
+                continue
+        else:
             return jsonify({"error": "Could not generate unique short code"}), 500
 
-        # Create new URL entry
-        url = URL(
-            original_url=original_url,
-            short_code=short_code,
-            user_id=current_user.id,
-            is_permanent=is_permanent,
-        )
-
-        # Save to database
-        db.session.add(url)
+        # Save to database, telling other workers about the new code on commit.
+        # Described first: reloading it after commit would not find its shard.
+        response_data = shortened_url_response(url)
+        record_url_created(db.session, url)
+        get_event_bus().publish("url_created", short_code)
         db.session.commit()
+        get_short_code_filter().add(short_code)
+
+        return jsonify(response_data), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Internal server error"}), 500
 
-        # Build response
-        short_url = build_short_url(short_code, request)
 
-        response_data = {
-            "short_url": short_url,
-            "short_code": short_code,
-            "original_url": original_url,
-            "created_at": url.created_at.isoformat(),
-            "is_permanent": url.is_permanent,
-        }
+@user_bp.route("/shorten/batch", methods=["POST"])
+@require_user_auth
+def shorten_urls_batch():
+    """Create many shortened URLs at once (requires user authentication)
 
-        # Add expiration info if not permanent
-        if not url.is_permanent:
-            response_data["expires_at"] = url.expires_at.isoformat()
+    Accepts {"urls": [{"url": ..., "permanent": false}, ...]}; plain strings
+    are accepted as items too. Every item gets a result with its index, and
+    invalid items an error rather than failing the whole batch.
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data.get("urls") if isinstance(data, dict) else None
 
-        return jsonify(response_data), 201
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "A non-empty list of urls is required"}), 400
+
+        max_size = current_app.config["SHORTEN_BATCH_MAX_SIZE"]
+        if len(items) > max_size:
+            return (
+                jsonify({"error": f"At most {max_size} URLs per batch are allowed"}),
+                400,
+            )
+
+        current_user = get_current_user()
+        now = datetime.now(timezone.utc)
+
+        # Validate every item, keeping the valid ones as rows to insert
+        results = [None] * len(items)
+        indexes, rows = [], []
+        for index, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"url": item}
+            original_url = item.get("url") if isinstance(item, dict) else None
+
+            if not original_url:
+                results[index] = {"index": index, "error": "URL is required"}
+                continue
+            if not is_valid_url(original_url):
+                results[index] = {"index": index, "error": "Invalid URL format"}
+                continue
+
+            is_permanent = bool(item.get("permanent", False))
+            indexes.append(index)
+            rows.append(
+                {
+                    "original_url": original_url,
+                    "user_id": current_user.id,
+                    "created_at": now,
+                    "expires_at": None if is_permanent else default_expires_at(now),
+                    "is_permanent": is_permanent,
+                    "click_count": 0,
+                }
+            )
+
+        # Insert all valid items with allocated codes in multi-row statements
+        inserted = insert_urls(rows)
+        created = [row for row in inserted if row is not None]
+        record_urls_created(db.session, created)
+        short_codes = [row.short_code for row in created]
+        for start in range(0, len(short_codes), CODES_PER_EVENT):
+            get_event_bus().publish(
+                "urls_created", short_codes[start : start + CODES_PER_EVENT]
+            )
+        db.session.commit()
+        get_short_code_filter().add_many(short_codes)
+
+        # Build per-item results in request order
+        for index, values, row in zip(indexes, rows, inserted):
+            if row is None:
+                results[index] = {
+                    "index": index,
+                    "error": "Could not generate unique short code",
+                }
+                continue
+            result = {
+                "index": index,
+                "short_url": build_short_url(row.short_code, request),
+                "short_code": row.short_code,
+                "original_url": values["original_url"],
+                "created_at": row.created_at.isoformat(),
+                "is_permanent": row.is_permanent,
+            }
+            if not row.is_permanent:
+                result["expires_at"] = row.expires_at.isoformat()
+            results[index] = result
+
+        failed = sum(1 for result in results if "error" in result)
+        if not created:
+            status = 400
+        elif failed:
+            status = 207
+        else:
+            status = 201
+        return (
+            jsonify({"created": len(created), "failed": failed, "results": results}),
+            status,
+        )
 
     except Exception as e:
         db.session.rollback()
@@ -86,6 +238,7 @@ def shorten_url():
 
 @user_bp.route("/my-urls", methods=["GET"])
 @require_user_auth
+@reads_from_replica
 def get_my_urls():
     """Get all URLs created by the current user"""
     try:
@@ -115,21 +268,59 @@ def get_my_urls():
         if order not in ["asc", "desc"]:
             return jsonify({"error": "Invalid order. Valid options: asc, desc"}), 400
 
-        # Build query
-        query = URL.query.filter_by(user_id=current_user.id)
-
-        # Apply sorting
+        # Build query: plain rows, since ids repeat across shards
+        router = get_shard_router()
+        query = db.session.query(*URL_LISTING_COLUMNS).filter(
+            URL.user_id == current_user.id
+        )
         sort_column = getattr(URL, sort_by)
-        if order == "desc":
-            query = query.order_by(sort_column.desc())
-        else:
-            query = query.order_by(sort_column.asc())
 
-        # Apply pagination
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Cursor mode: ?cursor= for the first page, then next_cursor/prev_cursor
+        if "cursor" in request.args:
+            try:
+                keyset_page = keyset_paginate(
+                    query,
+                    sort_column,
+                    router.tiebreak_column,
+                    sort_by,
+                    order,
+                    request.args["cursor"],
+                    per_page,
+                    shards=router.shards,
+                )
+            except InvalidCursor as e:
+                return jsonify({"error": f"Invalid cursor: {e}"}), 400
+
+            return jsonify(
+                {
+                    "urls": [serialize_url(row) for row in keyset_page.items],
+                    "pagination": {
+                        "per_page": per_page,
+                        "next_cursor": keyset_page.next_cursor,
+                        "prev_cursor": keyset_page.prev_cursor,
+                        "has_next": keyset_page.next_cursor is not None,
+                        "has_prev": keyset_page.prev_cursor is not None,
+                    },
+                    "sort": {"sort_by": sort_by, "order": order},
+                }
+            )
+
+        # Apply sorting and pagination; the user's maintained URL count is the total
+        pagination = paginate(
+            query,
+            sort_column,
+            router.tiebreak_column,
+            order,
+            page,
+            per_page,
+            shards=router.shards,
+        )
+        pagination.total = (
+            db.session.query(User.url_count).filter_by(id=current_user.id).scalar()
+        )
 
         # Convert URLs to dictionaries
-        urls = [url.to_dict() for url in pagination.items]
+        urls = [serialize_url(row) for row in pagination.items]
 
         return jsonify(
             {
@@ -141,6 +332,7 @@ def get_my_urls():
                     "pages": pagination.pages,
                     "has_next": pagination.has_next,
                     "has_prev": pagination.has_prev,
+                    "total_is_approximate": False,
                 },
                 "sort": {"sort_by": sort_by, "order": order},
             }
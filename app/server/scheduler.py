@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import text
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+CLAIM_JOB = text(
+    """
+    INSERT INTO scheduled_jobs (name, last_run_at)
+    VALUES (:name, :now)
+    ON CONFLICT (name) DO UPDATE SET last_run_at = EXCLUDED.last_run_at
+    WHERE scheduled_jobs.last_run_at IS NULL
+       OR scheduled_jobs.last_run_at <= :due_before
+    RETURNING name
+    """
+)
+
+
+class Job:
+    def __init__(self, name, function, interval):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        # Stable across processes, unlike hash()
+        self.lock_key = zlib.crc32(f"scheduler:{name}".encode("utf-8"))
+        self.next_check = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_result = None
+
+
+class Scheduler:
+    """Runs periodic maintenance jobs on one worker at a time
+
+    Every worker runs the same scheduler thread. A job runs under a
+    PostgreSQL advisory lock, so only one worker executes it at a time, and
+    its last run is recorded in scheduled_jobs, so it runs once per interval
+    across all workers rather than once per worker.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.tick = 5
+        self._jobs = {}
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["scheduler"] = self
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        self.enabled = app.config["SCHEDULER_ENABLED"] and dialect == "postgresql"
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_job(self, name, function, interval):
+        """Run function() in an app context every interval seconds"""
+        if interval and interval > 0:
+            self._jobs[name] = Job(name, function, interval)
+
+    def start(self):
+        """Start the scheduler thread once per process"""
+        if not self.enabled or not self._jobs:
+            return
+        if self._pid != os.getpid():
+            # Forked worker: the parent's thread did not survive the fork
+            self._reset()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="scheduler", daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            for job in list(self._jobs.values()):
+                if job.next_check <= time.monotonic():
+                    self.run_job(job.name)
+            time.sleep(self.tick)
+
+    def run_job(self, name, force=False):
+        """Run a job now if it is due and no other worker is running it
+
+        Returns True if this call ran the job.
+        """
+        job = self._jobs[name]
+        job.next_check = time.monotonic() + min(job.interval, 60)
+
+        with self.app.app_context():
+            connection = db.engine.connect()
+            try:
+                acquired = connection.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": job.lock_key}
+                ).scalar()
+                connection.commit()
+                if not acquired:
+                    return False
+                try:
+                    if not self._claim(connection, job, force):
+                        return False
+                    self._execute(job)
+                    return True
+                finally:
+                    connection.execute(
+                        text("SELECT pg_advisory_unlock(:key)"), {"key": job.lock_key}
+                    )
+                    connection.commit()
+            except Exception:
+                logger.exception("Scheduled job %s could not be run", name)
+                return False
+            finally:
+                connection.close()
+                db.session.remove()
+
+    def _claim(self, connection, job, force):
+        """Record the start of a due run; False if another worker ran it recently"""
+        now = datetime.now(timezone.utc)
+        due_before = now if force else now - timedelta(seconds=job.interval)
+        claimed = connection.execute(
+            CLAIM_JOB, {"name": job.name, "now": now, "due_before": due_before}
+        ).first()
+        connection.commit()
+        return claimed is not None
+
+    def _execute(self, job):
+        started = time.monotonic()
+        try:
+            job.last_result = job.function()
+        except Exception:
+            job.failures += 1
+            db.session.rollback()
+            logger.exception("Scheduled job %s failed", job.name)
+        finally:
+            job.runs += 1
+            job.last_run_at = datetime.now(timezone.utc)
+            job.last_duration = time.monotonic() - started
+
+    def stats(self):
+        """Return per-job counters as a dictionary for metrics endpoints"""
+        return {
+            "enabled": self.enabled,
+            "jobs": {
+                job.name: {
+                    "interval": job.interval,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "last_run_at": (
+                        job.last_run_at.isoformat() if job.last_run_at else None
+                    ),
+                    "last_duration": (
+                        round(job.last_duration, 3)
+                        if job.last_duration is not None
+                        else None
+                    ),
+                    "last_result": job.last_result,
+                }
+                for job in self._jobs.values()
+            },
+        }
+
+
+def get_scheduler():
+    """Get the background job scheduler of the current application"""
+    return current_app.extensions["scheduler"]
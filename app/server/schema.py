@@ -0,0 +1,28 @@
+import os
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask import current_app
+from app.server import db
+
+
+def head_revisions(directory=None):
+    """Revisions at the head of the migrations, in flask db's directory by default"""
+    if directory is None:
+        directory = current_app.extensions["migrate"].directory
+    config = Config(os.path.join(directory, "alembic.ini"))
+    config.set_main_option("script_location", directory)
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+def schema_at_head(directory=None):
+    """Whether the primary database is migrated to the latest revision
+
+    Reads the revision without running the migration environment, as flask
+    db upgrade does, so in a process that has the app loaded the check costs
+    a query rather than a start of the application.
+    """
+    heads = head_revisions(directory)
+    with db.engine.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_heads()
+    return set(current) == heads
@@ -0,0 +1,160 @@
+import hashlib
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy.schema import CreateIndex, CreateTable
+from app.server.models import URL, User
+from app.server import db
+
+# Bind keys of the databases holding urls besides the primary: url_shard_1, ...
+SHARD_BIND_PREFIX = "url_shard_"
+
+# Name of the primary database in shard hashing and reports
+PRIMARY_SHARD = "primary"
+
+
+def shard_name(shard):
+    """Printable name of a shard, the primary for None"""
+    return PRIMARY_SHARD if shard is None else shard
+
+
+class ShardRouter:
+    """Maps short codes to the database holding their urls row
+
+    The primary database is always a shard; every url_shard_<n> bind adds
+    one. A code belongs to the shard with the highest keyed hash of the code
+    (rendezvous hashing), so redirects find it without a directory, and
+    adding a shard only moves the codes that now hash to it, about 1/N of
+    them. rebalance_shards.py moves those rows.
+
+    While rebalancing, codes missing on their shard are looked up on the
+    others, since their rows may not have been moved yet.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.shards = [None]
+        self.rebalancing = False
+        self._keys = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        binds = app.config.get("SQLALCHEMY_BINDS", {})
+        self.shards = [None] + sorted(
+            (key for key in binds if key.startswith(SHARD_BIND_PREFIX)),
+            key=lambda key: int(key[len(SHARD_BIND_PREFIX) :]),
+        )
+        self.rebalancing = app.config["URL_SHARDS_REBALANCING"]
+        self._keys = [
+            (shard, shard_name(shard).encode("utf-8")) for shard in self.shards
+        ]
+        app.extensions["shard_router"] = self
+
+    @property
+    def sharded(self):
+        return len(self.shards) > 1
+
+    def shard_for(self, short_code):
+        """Bind key of the shard holding short_code, None for the primary"""
+        if len(self._keys) == 1:
+            return None
+
+        data = short_code.encode("utf-8")
+        shard, _ = max(
+            self._keys,
+            key=lambda item: hashlib.blake2b(data, digest_size=8, key=item[1]).digest(),
+        )
+        return shard
+
+    @property
+    def tiebreak_column(self):
+        """Column ordering urls rows with equal sort values across all shards
+
+        Ids are only unique within a database, short codes across all of them.
+        """
+        return URL.short_code if self.sharded else URL.id
+
+    def group(self, short_codes):
+        """Short codes by the shard holding them, {shard: [short_code, ...]}"""
+        groups = {}
+        for short_code in short_codes:
+            groups.setdefault(self.shard_for(short_code), []).append(short_code)
+        return groups
+
+    def fallbacks(self, shard):
+        """Shards to look for a code missing on shard, none unless rebalancing"""
+        if not self.rebalancing:
+            return []
+        return [other for other in self.shards if other != shard]
+
+    def stats(self):
+        """Return the shard layout as a dictionary for metrics endpoints"""
+        return {
+            "shards": [shard_name(shard) for shard in self.shards],
+            "rebalancing": self.rebalancing,
+        }
+
+
+def get_shard_router():
+    """Get the shard router of the current application"""
+    return current_app.extensions["shard_router"]
+
+
+@contextmanager
+def on_shard(shard):
+    """Run the current session's statements on urls against shard within a block
+
+    Statements on other tables keep going to the primary, so counters and
+    users are updated alongside. Textual SQL cannot be routed; run it on
+    shard_connection(shard) instead.
+    """
+    info = db.session.info
+    previous = info.get("url_shard")
+    info["url_shard"] = shard
+    try:
+        yield
+    finally:
+        info["url_shard"] = previous
+
+
+def shard_connection(shard):
+    """Connection of the current session transaction to shard"""
+    return db.session.connection(bind_arguments={"bind": db.engines[shard]})
+
+
+def find_url(short_code):
+    """The URL with short_code from the shard holding it, or None"""
+    router = get_shard_router()
+    shard = router.shard_for(short_code)
+    for shard in [shard] + router.fallbacks(shard):
+        with on_shard(shard):
+            url = URL.query.filter_by(short_code=short_code).first()
+        if url is not None:
+            return url
+    return None
+
+
+def lookup_usernames(user_ids):
+    """Usernames by user id from the primary, for urls rows read from shards"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.session.query(User.id, User.username).filter(User.id.in_(user_ids))
+    return dict(rows.all())
+
+
+def create_shard_tables(engine):
+    """Create urls and its indexes on a shard database that lacks them
+
+    users stays on the primary, so the copy has no foreign key to it.
+    Returns whether the table was created.
+    """
+    table = URL.__table__
+    with engine.begin() as connection:
+        if engine.dialect.has_table(connection, table.name):
+            return False
+        connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+        for index in table.indexes:
+            connection.execute(CreateIndex(index))
+    return True
@@ -0,0 +1,96 @@
+import logging
+import os
+import threading
+import time
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Times how long a worker takes to get from import to its first response
+
+    Records the seconds spent importing the app.server package, in the app
+    factory and serving the first request, and logs them once that request
+    is done. Under gunicorn's preload_app the first two are spent once in the
+    master, before forking; every worker still times its own first request.
+    """
+
+    def __init__(self, app=None, import_seconds=None):
+        self.app = None
+        self.import_seconds = import_seconds
+        self.factory_seconds = None
+        self.factory_pid = os.getpid()
+        self._factory_started = time.perf_counter()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["startup_timer"] = self
+        app.before_request(self._request_started)
+        app.after_request(self._request_finished)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._first_request_started = None
+        self.first_request_seconds = None
+
+    def factory_done(self):
+        """Record the end of the app factory"""
+        self.factory_seconds = time.perf_counter() - self._factory_started
+
+    def _request_started(self):
+        if self.first_request_seconds is not None:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: time its own first request
+                self._reset()
+            if self._first_request_started is None:
+                self._first_request_started = time.perf_counter()
+
+    def _request_finished(self, response):
+        if self.first_request_seconds is not None:
+            return response
+        with self._lock:
+            if self.first_request_seconds is None and self._first_request_started:
+                self.first_request_seconds = (
+                    time.perf_counter() - self._first_request_started
+                )
+                logger.info(
+                    "Startup of process %d: imports %.3fs, app factory %.3fs%s, "
+                    "first request %.3fs",
+                    os.getpid(),
+                    self.import_seconds or 0,
+                    self.factory_seconds or 0,
+                    " (preloaded)" if self.preloaded else "",
+                    self.first_request_seconds,
+                )
+        return response
+
+    @property
+    def preloaded(self):
+        """Whether the app was created in another process, then forked"""
+        return self.factory_pid != os.getpid()
+
+    def stats(self):
+        """Return startup timings as a dictionary for metrics endpoints"""
+
+        def rounded(seconds):
+            return None if seconds is None else round(seconds, 3)
+
+        return {
+            "pid": os.getpid(),
+            "preloaded": self.preloaded,
+            "import_seconds": rounded(self.import_seconds),
+            "factory_seconds": rounded(self.factory_seconds),
+            "first_request_seconds": rounded(self.first_request_seconds),
+        }
+
+
+def get_startup_timer():
+    """Get the startup timer of the current application"""
+    return current_app.extensions["startup_timer"]
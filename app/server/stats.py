@@ -0,0 +1,505 @@
+import heapq
+import logging
+import random
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+from itertools import groupby
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import (
+    DateTime,
+    bindparam,
+    case,
+    distinct,
+    func,
+    or_,
+    select,
+    text,
+    update,
+)
+from app.server.models import URL, User
+from app.server.shards import get_shard_router, shard_connection
+from app.server import db
+
+logger = logging.getLogger(__name__)
+
+# Counters are spread over shards so concurrent writers rarely touch the same row.
+# The expiry histogram counts non-permanent URLs per hour of expires_at.
+COUNTER_SHARDS = 8
+COUNTERS = [
+    "total_urls",
+    "permanent_urls",
+    "total_clicks",
+    "total_users",
+    "active_users",
+]
+
+# URLs deleted together, by user, permanence and expiry bucket
+DeletedURLs = namedtuple(
+    "DeletedURLs", "user_id is_permanent expires_at url_count click_count"
+)
+
+# All system-wide metrics in one scan of urls, using conditional aggregates
+_urls = URL.__table__
+_URL_STATS_COLUMNS = (
+    func.count().label("total_urls"),
+    func.count()
+    .filter(or_(_urls.c.is_permanent.is_(True), _urls.c.expires_at > bindparam("now")))
+    .label("active_urls"),
+    func.count()
+    .filter(_urls.c.is_permanent.is_(False), _urls.c.expires_at < bindparam("now"))
+    .label("expired_urls"),
+    func.count().filter(_urls.c.is_permanent.is_(True)).label("permanent_urls"),
+    func.coalesce(func.sum(_urls.c.click_count), 0).label("total_clicks"),
+)
+SYSTEM_STATS = select(
+    *_URL_STATS_COLUMNS,
+    func.count(distinct(_urls.c.user_id)).label("active_users"),
+    select(func.count())
+    .select_from(User.__table__)
+    .scalar_subquery()
+    .label("total_users"),
+).select_from(_urls)
+
+# The metrics of urls alone, for shards other than the primary, which has users
+URL_STATS = select(*_URL_STATS_COLUMNS).select_from(_urls)
+
+# Owners of URLs in id order, merged across shards to count them once each
+URL_OWNERS = (
+    select(_urls.c.user_id)
+    .distinct()
+    .order_by(_urls.c.user_id)
+    .execution_options(yield_per=10000)
+)
+
+INCREMENT_COUNTER = text(
+    """
+    INSERT INTO stat_counters (name, shard, value)
+    VALUES (:name, :shard, :delta)
+    ON CONFLICT (name, shard)
+    DO UPDATE SET value = stat_counters.value + EXCLUDED.value
+    """
+)
+
+INCREMENT_EXPIRY_BUCKET = text(
+    """
+    INSERT INTO url_expiry_buckets (bucket_start, shard, url_count)
+    VALUES (:bucket_start, :shard, :delta)
+    ON CONFLICT (bucket_start, shard)
+    DO UPDATE SET url_count = url_expiry_buckets.url_count + EXCLUDED.url_count
+    """
+).bindparams(bindparam("bucket_start", type_=DateTime(timezone=True)))
+
+# Every counter plus the expiry histogram in one round trip. Only URLs of the
+# current, partially expired bucket are counted in urls itself.
+READ_COUNTERS = text(
+    """
+    SELECT
+        CAST(COALESCE(SUM(value) FILTER (WHERE name = 'total_urls'), 0) AS BIGINT)
+            AS total_urls,
+        CAST(COALESCE(SUM(value) FILTER (WHERE name = 'permanent_urls'), 0) AS BIGINT)
+            AS permanent_urls,
+        CAST(COALESCE(SUM(value) FILTER (WHERE name = 'total_clicks'), 0) AS BIGINT)
+            AS total_clicks,
+        CAST(COALESCE(SUM(value) FILTER (WHERE name = 'total_users'), 0) AS BIGINT)
+            AS total_users,
+        CAST(COALESCE(SUM(value) FILTER (WHERE name = 'active_users'), 0) AS BIGINT)
+            AS active_users,
+        (SELECT CAST(COALESCE(SUM(url_count), 0) AS BIGINT)
+         FROM url_expiry_buckets) AS expiring_urls,
+        (SELECT CAST(COALESCE(SUM(url_count), 0) AS BIGINT)
+         FROM url_expiry_buckets
+         WHERE bucket_start < :current_bucket) AS expired_before_bucket,
+        (SELECT COUNT(*) FROM urls
+         WHERE NOT is_permanent
+           AND expires_at >= :current_bucket
+           AND expires_at < :now) AS expired_in_bucket
+    FROM stat_counters
+    """
+).bindparams(
+    bindparam("now", type_=DateTime(timezone=True)),
+    bindparam("current_bucket", type_=DateTime(timezone=True)),
+)
+
+# READ_COUNTERS' expired_in_bucket for the urls of another shard
+EXPIRED_IN_BUCKET = text(
+    """
+    SELECT COUNT(*) FROM urls
+    WHERE NOT is_permanent
+      AND expires_at >= :current_bucket
+      AND expires_at < :now
+    """
+).bindparams(
+    bindparam("now", type_=DateTime(timezone=True)),
+    bindparam("current_bucket", type_=DateTime(timezone=True)),
+)
+
+# Blocks counter updates, but not reads, until the reconciling transaction ends
+LOCK_COUNTERS = text("LOCK TABLE stat_counters, url_expiry_buckets IN EXCLUSIVE MODE")
+
+REBUILD_EXPIRY_BUCKETS = text(
+    """
+    INSERT INTO url_expiry_buckets (bucket_start, shard, url_count)
+    SELECT date_trunc('hour', expires_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+           0, COUNT(*)
+    FROM urls
+    WHERE is_permanent IS false AND expires_at IS NOT NULL
+    GROUP BY 1
+    """
+)
+
+# REBUILD_EXPIRY_BUCKETS' histogram of another shard, added on the primary
+SHARD_EXPIRY_BUCKETS = text(
+    """
+    SELECT date_trunc('hour', expires_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+               AS bucket_start,
+           COUNT(*) AS delta
+    FROM urls
+    WHERE is_permanent IS false AND expires_at IS NOT NULL
+    GROUP BY 1
+    """
+).columns(bucket_start=DateTime(timezone=True))
+
+
+def expiry_bucket(expires_at):
+    """Start of the histogram bucket that expires_at falls into"""
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+
+
+def update_counters(executor, counts=None, expiries=None):
+    """Add deltas to the system counters and the expiry histogram
+
+    Runs on executor, a session or connection, so the counters change in the
+    same transaction as the rows they count. counts maps counter names to
+    deltas and expiries is an iterable of (expires_at, delta) pairs. Rows are
+    always updated in the same order, so concurrent updates cannot deadlock.
+    """
+    shard = random.randrange(COUNTER_SHARDS)
+
+    counter_params = [
+        {"name": name, "shard": shard, "delta": delta}
+        for name, delta in sorted((counts or {}).items())
+        if delta
+    ]
+    if counter_params:
+        executor.execute(INCREMENT_COUNTER, counter_params)
+
+    buckets = Counter()
+    for expires_at, delta in expiries or ():
+        if expires_at is not None:
+            buckets[expiry_bucket(expires_at)] += delta
+    bucket_params = [
+        {"bucket_start": bucket_start, "shard": shard, "delta": delta}
+        for bucket_start, delta in sorted(buckets.items())
+        if delta
+    ]
+    if bucket_params:
+        executor.execute(INCREMENT_EXPIRY_BUCKET, bucket_params)
+
+
+def update_user_url_counts(executor, deltas):
+    """Add deltas, a mapping of user id to delta, to users.url_count
+
+    Returns the new counts by user id. The user rows are locked in id order
+    first, so concurrent updates cannot deadlock. The lock is the one UPDATE
+    takes itself, which does not block inserting URLs of these users.
+    """
+    users = User.__table__
+    user_ids = sorted(user_id for user_id, delta in deltas.items() if delta)
+    if not user_ids:
+        return {}
+    if len(user_ids) > 1:
+        executor.execute(
+            select(users.c.id)
+            .where(users.c.id.in_(user_ids))
+            .order_by(users.c.id)
+            .with_for_update(key_share=True)
+        )
+    rows = executor.execute(
+        update(users)
+        .where(users.c.id.in_(user_ids))
+        .values(url_count=users.c.url_count + case(deltas, value=users.c.id))
+        .returning(users.c.id, users.c.url_count)
+    )
+    return dict(rows.all())
+
+
+def record_url_created(executor, url):
+    """Count a newly inserted URL, for the system and for its user"""
+    record_urls_created(executor, [url])
+
+
+def record_urls_created(executor, created):
+    """Count newly inserted URLs, for the system and for their users
+
+    created holds objects or rows with user_id, is_permanent and expires_at.
+    """
+    created = list(created)
+    if not created:
+        return
+
+    deltas = Counter(url.user_id for url in created)
+    url_counts = update_user_url_counts(executor, deltas)
+    first_urls = sum(
+        1 for user_id, delta in deltas.items() if url_counts[user_id] == delta
+    )
+
+    counts = {
+        "total_urls": len(created),
+        "permanent_urls": sum(1 for url in created if url.is_permanent),
+        "active_users": first_urls,
+    }
+    expiries = [(url.expires_at, 1) for url in created if not url.is_permanent]
+    update_counters(executor, counts, expiries)
+
+
+def record_urls_deleted(executor, deleted):
+    """Uncount deleted URLs, for the system and for their users
+
+    deleted holds objects or rows with user_id, is_permanent, expires_at and
+    click_count. Must run in the transaction that deletes them.
+    """
+    record_url_groups_deleted(
+        executor,
+        [
+            DeletedURLs(
+                url.user_id, url.is_permanent, url.expires_at, 1, url.click_count
+            )
+            for url in deleted
+        ],
+    )
+
+
+def record_url_groups_deleted(executor, groups):
+    """Uncount deleted URLs given as groups rather than one by one
+
+    groups holds rows with user_id, is_permanent, expires_at, url_count and
+    click_count, each standing for url_count URLs of one user with that
+    permanence and expiry bucket and click_count clicks in total.
+    """
+    groups = list(groups)
+    if not groups:
+        return
+
+    deltas = Counter()
+    for group in groups:
+        deltas[group.user_id] -= group.url_count
+    url_counts = update_user_url_counts(executor, deltas)
+    emptied_users = sum(1 for url_count in url_counts.values() if url_count == 0)
+
+    counts = {
+        "total_urls": -sum(group.url_count for group in groups),
+        "permanent_urls": -sum(
+            group.url_count for group in groups if group.is_permanent
+        ),
+        "total_clicks": -sum(group.click_count or 0 for group in groups),
+        "active_users": -emptied_users,
+    }
+    expiries = [
+        (group.expires_at, -group.url_count)
+        for group in groups
+        if not group.is_permanent
+    ]
+    update_counters(executor, counts, expiries)
+
+
+def get_stats_cache():
+    """Get the system stats cache of the current application"""
+    return current_app.extensions["stats_cache"]
+
+
+def _stats_response(
+    total_urls,
+    active_urls,
+    expired_urls,
+    permanent_urls,
+    total_clicks,
+    total_users,
+    active_users,
+    now,
+):
+    return {
+        "urls": {
+            "total": total_urls,
+            "active": active_urls,
+            "expired": expired_urls,
+            "permanent": permanent_urls,
+        },
+        "clicks": {"total": total_clicks},
+        "users": {"total": total_users, "active": active_users},
+        "generated_at": now,
+    }
+
+
+def count_url_owners(connections):
+    """Users owning URLs on any of the shards behind connections"""
+    with ExitStack() as stack:
+        owners = [
+            stack.enter_context(connection.execute(URL_OWNERS)).scalars()
+            for connection in connections
+        ]
+        return sum(1 for _ in groupby(heapq.merge(*owners)))
+
+
+def _add_shard_stats(stats, connections, now):
+    """Add the urls of the other shards to SYSTEM_STATS of the primary
+
+    connections are those of every shard, the primary's first.
+    """
+    stats = dict(stats)
+    for connection in connections[1:]:
+        row = connection.execute(URL_STATS, {"now": now}).one()
+        for name, value in row._asdict().items():
+            stats[name] += value
+    stats["active_users"] = count_url_owners(connections)
+    return stats
+
+
+def scan_system_stats(now=None):
+    """Compute the system-wide statistics exactly with a scan of urls"""
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    stats = db.session.execute(SYSTEM_STATS, {"now": now}).one()._asdict()
+    shards = get_shard_router().shards
+    if len(shards) > 1:
+        connections = [shard_connection(shard) for shard in shards]
+        stats = _add_shard_stats(stats, connections, now)
+    return _stats_response(**stats, now=now)
+
+
+def load_system_stats(now=None):
+    """Read the system-wide statistics from the maintained counters
+
+    Cost does not depend on the number of URLs: only the URLs expiring in
+    the current hour are counted directly.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    params = {"now": now, "current_bucket": expiry_bucket(now)}
+    row = db.session.execute(READ_COUNTERS, params).one()
+    expired_in_bucket = row.expired_in_bucket
+    for shard in get_shard_router().shards[1:]:
+        expired_in_bucket += (
+            shard_connection(shard).execute(EXPIRED_IN_BUCKET, params).scalar()
+        )
+    expired_urls = row.expired_before_bucket + expired_in_bucket
+    return _stats_response(
+        total_urls=row.total_urls,
+        active_urls=row.permanent_urls + row.expiring_urls - expired_urls,
+        expired_urls=expired_urls,
+        permanent_urls=row.permanent_urls,
+        total_clicks=row.total_clicks,
+        total_users=row.total_users,
+        active_users=row.active_users,
+        now=now,
+    )
+
+
+def cached_system_stats():
+    """System-wide statistics, recomputed at most once per cache TTL
+
+    Concurrent dashboard polls share a single computation.
+    """
+    return get_stats_cache().get_or_load("system", load_system_stats)
+
+
+def reconcile_counters(now=None):
+    """Recompute the counters and expiry histogram from urls and users
+
+    Repairs drift from failed or unaccounted writes. Counter updates wait
+    until the rebuild commits, so nothing is lost or counted twice; the full
+    scan makes this a job for quiet periods. Other shards are not locked, so
+    their writes during the scan may leave a little drift. Returns the
+    repaired drift per counter.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    shards = get_shard_router().shards
+    with db.engine.begin() as connection, ExitStack() as stack:
+        connection.execute(LOCK_COUNTERS)
+        counted = connection.execute(
+            READ_COUNTERS, {"now": now, "current_bucket": expiry_bucket(now)}
+        ).one()
+        exact = connection.execute(SYSTEM_STATS, {"now": now}).one()._asdict()
+        shard_connections = [
+            stack.enter_context(db.engines[shard].connect()) for shard in shards[1:]
+        ]
+        if shard_connections:
+            exact = _add_shard_stats(exact, [connection] + shard_connections, now)
+
+        connection.execute(text("DELETE FROM stat_counters"))
+        connection.execute(
+            INCREMENT_COUNTER,
+            [{"name": name, "shard": 0, "delta": exact[name]} for name in COUNTERS],
+        )
+        connection.execute(text("DELETE FROM url_expiry_buckets"))
+        connection.execute(REBUILD_EXPIRY_BUCKETS)
+        for other in shard_connections:
+            buckets = other.execute(SHARD_EXPIRY_BUCKETS).all()
+            if buckets:
+                connection.execute(
+                    INCREMENT_EXPIRY_BUCKET,
+                    [{"shard": 0, **bucket._asdict()} for bucket in buckets],
+                )
+        expiring = connection.execute(
+            text("SELECT COALESCE(SUM(url_count), 0) FROM url_expiry_buckets")
+        ).scalar()
+
+    drift = {name: exact[name] - getattr(counted, name) for name in COUNTERS}
+    drift["expiring_urls"] = int(expiring) - counted.expiring_urls
+    if any(drift.values()):
+        logger.warning("Repaired statistics counter drift: %s", drift)
+    return drift
+
+
+def reconcile_user_url_counts(batch_size=1000):
+    """Recompute users.url_count from urls, batch_size users at a time
+
+    Each batch locks its users first, so URL inserts and deletes of those
+    users wait for it rather than being counted twice or not at all. URLs
+    are counted on every shard. Returns the number of users whose count
+    was repaired.
+    """
+    users = User.__table__
+    shards = get_shard_router().shards
+    repaired = 0
+    after_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            stored = dict(
+                connection.execute(
+                    select(users.c.id, users.c.url_count)
+                    .where(users.c.id > after_id)
+                    .order_by(users.c.id)
+                    .limit(batch_size)
+                    .with_for_update()
+                ).all()
+            )
+            if not stored:
+                break
+            count = (
+                select(_urls.c.user_id, func.count())
+                .where(_urls.c.user_id.in_(list(stored)))
+                .group_by(_urls.c.user_id)
+            )
+            counted = Counter(dict(connection.execute(count).all()))
+            for shard in shards[1:]:
+                with db.engines[shard].connect() as other:
+                    counted.update(dict(other.execute(count).all()))
+            deltas = {
+                user_id: counted.get(user_id, 0) - url_count
+                for user_id, url_count in stored.items()
+            }
+            repaired += len(update_user_url_counts(connection, deltas))
+        after_id = max(stored)
+
+    if repaired:
+        logger.warning("Repaired URL counts of %d users", repaired)
+    return repaired
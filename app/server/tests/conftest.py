@@ -0,0 +1,39 @@
+import os
+import pytest
+from flask import Flask
+from app.server import db
+from app.server.cache import TTLCache
+from app.server.shards import ShardRouter
+
+
+@pytest.fixture(scope="module")
+def pg_app():
+    """Create a Flask app on a scratch PostgreSQL database.
+
+    Tests using it are skipped unless TEST_DATABASE_URL points at a database
+    that may be emptied, e.g. postgresql://postgres@localhost/url_shortener_test.
+    """
+    database_url = os.getenv("TEST_DATABASE_URL")
+    if not database_url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    from app.server.routes.user import user_bp
+    from app.server.routes.admin import admin_bp
+
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["ADMIN_COUNT_STRATEGY"] = "exact"
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.extensions["count_cache"] = TTLCache(maxsize=8, ttl=60)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,164 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.cache import TTLCache
+from app.server.models import Admin, URL, User
+from app.server.routes.admin import admin_bp
+from app.server.shards import ShardRouter
+from app.server.stats import record_url_created
+
+
+@pytest.fixture
+def client():
+    """Create an admin test client on SQLite with URLs of several users."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["ADMIN_COUNT_STRATEGY"] = "exact"
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.extensions["count_cache"] = TTLCache(maxsize=8, ttl=60)
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    with app.app_context():
+        db.create_all()
+        db.session.add(Admin(username="admin", access_token="admin-token"))
+        users = [User(username=f"user{i}", password="x") for i in range(5)]
+        db.session.add_all(users)
+        db.session.flush()
+        now = datetime.now(timezone.utc)
+        for i in range(30):
+            url = URL(
+                original_url=f"https://{i}.example",
+                short_code=f"code{i:02d}",
+                user_id=users[i % 5].id,
+                expires_at=now + timedelta(days=i),
+                click_count=i,
+            )
+            db.session.add(url)
+            db.session.flush()
+            record_url_created(db.session, url)
+        db.session.commit()
+        client = app.test_client()
+        client.set_cookie("auth_token", generate_jwt("admin", "admin", "admin-token"))
+        yield client
+        db.session.remove()
+
+
+def get_counting_queries(client, path):
+    """Request path and return the response and the number of statements run"""
+    statements = []
+
+    def count(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    return response, len(statements)
+
+
+@pytest.mark.parametrize("per_page", [5, 25])
+def test_url_listing_query_count(client, per_page):
+    """Test that a page of URLs costs the same few queries whatever its size."""
+    response, queries = get_counting_queries(
+        client, f"/admin/urls?per_page={per_page}&sort_by=click_count&order=asc"
+    )
+
+    assert response.status_code == 200
+    urls = response.json["urls"]
+    assert len(urls) == per_page
+    assert urls[1]["short_code"] == "code01"
+    assert urls[1]["user"] == {"username": "user1"}
+    # Admin lookup, total and page
+    assert queries == 3
+
+
+def test_url_listing_cursor_query_count(client):
+    """Test that a cursor page of URLs runs no per-row queries."""
+    response, queries = get_counting_queries(
+        client, "/admin/urls?cursor=&per_page=25&sort_by=click_count&order=desc"
+    )
+
+    assert response.status_code == 200
+    assert response.json["urls"][0]["user"] == {"username": "user4"}
+    # Admin lookup, then the NULL and the non-NULL click counts
+    assert queries == 3
+
+
+def test_url_listing_matches_to_dict(client):
+    """Test that listing rows serialize exactly like URL objects do."""
+    response = client.get("/admin/urls?per_page=30&sort_by=short_code&order=asc")
+
+    expected = [
+        url.to_dict(include_user=True)
+        for url in URL.query.order_by(URL.short_code).all()
+    ]
+    assert response.json["urls"] == expected
+
+
+def test_user_listing_query_count(client):
+    """Test that listing users reads maintained counts instead of joining urls."""
+    response, queries = get_counting_queries(client, "/admin/users?per_page=5")
+
+    assert response.status_code == 200
+    assert {user["url_count"] for user in response.json["users"]} == {6}
+    # Admin lookup, total and page
+    assert queries == 3
+
+
+def test_export_ndjson(client):
+    """Test that the export streams every URL as one JSON object per line."""
+    response = client.get("/admin/export")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row["id"] for row in rows] == list(range(1, 31))
+    assert rows[0]["short_code"] == "code00"
+    assert rows[0]["user"] == {"username": "user0"}
+
+
+def test_export_csv_gzip(client):
+    """Test that the CSV export is compressed for clients accepting gzip."""
+    response = client.get(
+        "/admin/export?format=csv", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    text = gzip.decompress(response.data).decode()
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert len(rows) == 30
+    assert rows[1]["short_code"] == "code01"
+    assert rows[1]["username"] == "user1"
+
+
+def test_export_filters_and_resumes(client):
+    """Test that user filters and after_id select the remaining rows."""
+    response = client.get("/admin/export?user=user2&after_id=10")
+
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row["short_code"] for row in rows] == [
+        "code12",
+        "code17",
+        "code22",
+        "code27",
+    ]
+
+
+def test_export_rejects_bad_filters(client):
+    """Test that unknown formats, states and dates are rejected up front."""
+    assert client.get("/admin/export?format=xml").status_code == 400
+    assert client.get("/admin/export?state=stale").status_code == 400
+    assert client.get("/admin/export?created_after=yesterday").status_code == 400
+    assert client.get("/admin/export?user=nobody").status_code == 404
@@ -0,0 +1,245 @@
+import gzip
+import json
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from app.server import db
+from app.server.archive import URLArchiver
+from app.server.auth import generate_jwt
+from app.server.cache import TTLCache
+from app.server.models import Admin, ArchivedURL, URL, User
+from app.server.reaper import Reaper
+from app.server.routes.admin import admin_bp
+from app.server.routes.public import public_bp
+from app.server.shards import ShardRouter
+from app.server.stats import (
+    load_system_stats,
+    record_url_created,
+    scan_system_stats,
+    update_counters,
+)
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Create a Flask app on SQLite archiving URLs idle for 30 days."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["URL_SHARDS_REBALANCING"] = False
+    app.config["REAPER_CHUNK_SIZE"] = 2
+    app.config["REAPER_TIME_BUDGET"] = 30
+    app.config["ARCHIVE_ENABLED"] = True
+    app.config["ARCHIVE_DIR"] = str(tmp_path)
+    app.config["ARCHIVE_IDLE_DAYS"] = 30
+    app.config["ARCHIVE_CHUNK_SIZE"] = 2
+    app.config["ARCHIVE_TIME_BUDGET"] = 30
+    db.init_app(app)
+    ShardRouter(app)
+    URLArchiver(app)
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["event_bus"] = MagicMock()
+    app.register_blueprint(public_bp)
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def admin_client(app):
+    """Test client signed in as an admin."""
+    db.session.add(Admin(username="admin", access_token="admin-token"))
+    db.session.commit()
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("admin", "admin", "admin-token"))
+    return client
+
+
+def add_urls():
+    """Add one user with an expired, an idle, a live and a permanent idle URL.
+
+    Returns the user; every URL is counted.
+    """
+    user = User(username="alice", password="x")
+    db.session.add(user)
+    db.session.flush()
+    update_counters(db.session, {"total_users": 1})
+    urls = [
+        # Expired yesterday
+        dict(expires_at=NOW - timedelta(days=1), last_accessed=NOW),
+        # Not visited for 60 days
+        dict(
+            expires_at=NOW + timedelta(days=10), last_accessed=NOW - timedelta(days=60)
+        ),
+        # Visited today
+        dict(expires_at=NOW + timedelta(days=10), last_accessed=NOW),
+        # Permanent, never visited since its creation 90 days ago
+        dict(is_permanent=True, created_at=NOW - timedelta(days=90)),
+    ]
+    for i, fields in enumerate(urls):
+        url = URL(
+            original_url=f"https://{i}.example",
+            short_code=f"code{i:02d}",
+            user_id=user.id,
+            click_count=i,
+            **fields,
+        )
+        db.session.add(url)
+        db.session.flush()
+        record_url_created(db.session, url)
+        update_counters(db.session, {"total_clicks": i})
+    db.session.commit()
+    return user
+
+
+def read_archive_files(directory):
+    """Records of every archive file in directory, by short code"""
+    records = {}
+    for name in os.listdir(directory):
+        assert name.endswith(".ndjson.gz")
+        with gzip.open(os.path.join(directory, name), "rt") as archive:
+            for line in archive:
+                record = json.loads(line)
+                records[record["short_code"]] = record
+    return records
+
+
+def test_archiver_moves_expired_and_idle_urls(app, tmp_path):
+    """Test that a run archives expired and idle URLs and keeps counters exact."""
+    user = add_urls()
+
+    summary = app.extensions["url_archiver"].run(now=NOW)
+
+    assert summary["archived_count"] == 3
+    assert summary["complete"]
+    assert [url.short_code for url in URL.query.all()] == ["code02"]
+    reasons = {url.short_code: url.reason for url in ArchivedURL.query.all()}
+    assert reasons == {"code00": "expired", "code01": "idle", "code03": "idle"}
+    records = read_archive_files(tmp_path)
+    assert sorted(records) == ["code00", "code01", "code03"]
+    assert records["code03"]["is_permanent"]
+    assert records["code01"]["original_url"] == "https://1.example"
+    assert load_system_stats(NOW) == scan_system_stats(NOW)
+    assert db.session.get(User, user.id).url_count == 1
+
+
+def test_archive_files_of_failed_commits_are_removed(app, tmp_path):
+    """Test that a chunk whose commit fails leaves neither rows nor files."""
+    add_urls()
+    archiver = app.extensions["url_archiver"]
+
+    with patch.object(db.session, "commit", side_effect=RuntimeError("lost")):
+        with pytest.raises(RuntimeError):
+            archiver.run(now=NOW)
+
+    assert os.listdir(tmp_path) == []
+    assert archiver.files_written == 0
+    assert URL.query.count() == 4
+    assert ArchivedURL.query.count() == 0
+
+    archiver.run(now=NOW)
+    assert sorted(read_archive_files(tmp_path)) == ["code00", "code01", "code03"]
+    assert archiver.files_written == len(os.listdir(tmp_path))
+
+
+def test_archiver_without_idle_days_takes_expired_urls_only(app):
+    """Test that ARCHIVE_IDLE_DAYS 0 leaves idle URLs alone."""
+    add_urls()
+    archiver = app.extensions["url_archiver"]
+    archiver.idle_days = 0
+
+    summary = archiver.run(now=NOW)
+
+    assert summary["archived_count"] == 1
+    assert [url.short_code for url in ArchivedURL.query.all()] == ["code00"]
+
+
+def test_reaper_archives_what_it_deletes(app, tmp_path):
+    """Test that with archiving on, expired URLs are archived by the reaper."""
+    add_urls()
+
+    summary = Reaper(app).run(now=NOW)
+
+    assert summary["deleted_count"] == 1
+    assert [url.short_code for url in ArchivedURL.query.all()] == ["code00"]
+    assert sorted(read_archive_files(tmp_path)) == ["code00"]
+
+
+def test_stats_of_archived_urls(app):
+    """Test that /stats reports idle archived URLs and hides expired ones."""
+    add_urls()
+    app.extensions["url_archiver"].run(now=NOW)
+    client = app.test_client()
+
+    response = client.get("/stats/code01")
+    assert response.status_code == 200
+    assert response.json["archived"]
+    assert response.json["archive_reason"] == "idle"
+    assert response.json["click_count"] == 1
+    assert client.get("/stats/code00").status_code == 404
+    assert client.get("/stats/nocode").status_code == 404
+
+
+def test_restore_archived_url(app, admin_client):
+    """Test that a restored URL is live again and counted."""
+    user = add_urls()
+    app.extensions["url_archiver"].run(now=NOW)
+
+    response = admin_client.post("/admin/urls/code00/restore")
+
+    assert response.status_code == 200
+    assert response.json["restored"]
+    assert response.json["click_count"] == 0
+    url = URL.query.filter_by(short_code="code00").one()
+    assert url.expires_at.replace(tzinfo=timezone.utc) > NOW
+    assert db.session.get(ArchivedURL, "code00") is None
+    assert db.session.get(User, user.id).url_count == 2
+    now = datetime.now(timezone.utc)
+    assert load_system_stats(now) == scan_system_stats(now)
+    app.extensions["short_code_filter"].add.assert_called_with("code00")
+
+
+def test_restore_keeps_permanence_unless_told(app, admin_client):
+    """Test that restoring can make a URL expire and checks the expiry."""
+    add_urls()
+    app.extensions["url_archiver"].run(now=NOW)
+    expires_at = (NOW + timedelta(days=3)).isoformat()
+
+    for invalid in (
+        {"expires_at": "soon"},
+        {"expires_at": (NOW - timedelta(days=1)).isoformat()},
+        {"permanent": "false"},
+        {"permanent": 0},
+    ):
+        response = admin_client.post("/admin/urls/code03/restore", json=invalid)
+        assert response.status_code == 400
+    assert db.session.get(ArchivedURL, "code03") is not None
+    response = admin_client.post(
+        "/admin/urls/code03/restore", json={"expires_at": expires_at}
+    )
+    assert response.status_code == 200
+    assert not response.json["is_permanent"]
+    assert response.json["expires_at"].startswith(expires_at[:19])
+
+
+def test_restore_conflicts(app, admin_client):
+    """Test that unknown codes are 404 and taken codes 409."""
+    user = add_urls()
+    app.extensions["url_archiver"].run(now=NOW)
+    db.session.add(
+        URL(original_url="https://new.example", short_code="code01", user_id=user.id)
+    )
+    db.session.commit()
+
+    assert admin_client.post("/admin/urls/nocode/restore").status_code == 404
+    response = admin_client.post("/admin/urls/code01/restore")
+    assert response.status_code == 409
+    assert db.session.get(ArchivedURL, "code01") is not None
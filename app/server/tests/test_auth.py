@@ -1,12 +1,14 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from flask import g, Flask
+from flask import g, Flask, current_app
 from app.server.auth import (
     generate_jwt,
     require_user_auth,
     require_admin_auth,
     get_current_user,
     get_current_admin,
+    forget_principal,
+    PrincipalCache,
 )
 import jwt
 import os
@@ -271,3 +273,139 @@ def test_require_admin_auth_invalid_token(app):
         response, status_code = dummy_route()
         assert status_code == 401
         assert response.json["error"] == "Invalid token"
+
+
+@pytest.fixture
+def cached_app(app):
+    """Add a principal cache and event bus to the test app."""
+    bus = MagicMock(enabled=True, listening=True, generation=1)
+    app.extensions["principal_cache"] = PrincipalCache(maxsize=100, ttl=30, bus=bus)
+    app.extensions["event_bus"] = bus
+    return app
+
+
+def call_user_route(token):
+    @require_user_auth
+    def dummy_route():
+        return get_current_user(), 200
+
+    with current_app.test_request_context(headers={"Cookie": f"auth_token={token}"}):
+        return dummy_route()
+
+
+@patch("app.server.auth.User")
+def test_principal_is_cached(mock_user, cached_app):
+    """Test that repeated requests with the same token skip the account query."""
+    mock_user.query.filter_by.return_value.first.return_value = MagicMock(
+        id=7, username="testuser", is_active=True
+    )
+    token = generate_jwt("testuser", "user", "test_token")
+
+    first, _ = call_user_route(token)
+    second, _ = call_user_route(token)
+
+    assert first == second
+    assert (first.id, first.username, first.access_token) == (
+        7,
+        "testuser",
+        "test_token",
+    )
+    mock_user.query.filter_by.assert_called_once()
+    assert cached_app.extensions["principal_cache"].stats()["hits"] == 1
+
+
+@patch("app.server.auth.User")
+def test_rotated_token_is_not_served_from_cache(mock_user, cached_app):
+    """Test that a forgotten principal is looked up and rejected again."""
+    mock_user.query.filter_by.return_value.first.return_value = MagicMock(
+        id=7, username="testuser", is_active=True
+    )
+    token = generate_jwt("testuser", "user", "test_token")
+    call_user_route(token)
+
+    forget_principal(["user", "testuser", "test_token"])
+    mock_user.query.filter_by.return_value.first.return_value = None
+    response, status_code = call_user_route(token)
+
+    assert status_code == 401
+    assert response.json["error"] == "Invalid or inactive user token"
+
+
+@patch("app.server.auth.User")
+def test_failed_lookups_are_not_cached(mock_user, cached_app):
+    """Test that invalid tokens are never cached."""
+    mock_user.query.filter_by.return_value.first.return_value = None
+    token = generate_jwt("testuser", "user", "test_token")
+    call_user_route(token)
+    call_user_route(token)
+    assert mock_user.query.filter_by.call_count == 2
+    assert len(cached_app.extensions["principal_cache"]) == 0
+
+
+@patch("app.server.routes.public.get_password_hasher")
+@patch("app.server.routes.public.db")
+@patch("app.server.routes.public.User")
+def test_login_revokes_previous_token(mock_user, mock_db, mock_hasher, cached_app):
+    """Test that login evicts the old token locally and on other workers."""
+    from app.server.routes.public import login
+
+    user = MagicMock(username="testuser", access_token="old_token")
+    mock_user.query.filter_by.return_value.first.return_value = user
+    mock_hasher.return_value.verify.return_value = True
+    mock_hasher.return_value.needs_rehash.return_value = False
+    cache = cached_app.extensions["principal_cache"]
+    cache.set(("user", "testuser", "old_token"), MagicMock())
+
+    with cached_app.test_request_context(
+        json={"username": "testuser", "password": "secret"}
+    ):
+        response = login()
+
+    assert response.status_code == 200
+    assert user.access_token != "old_token"
+    assert len(cache) == 0
+    cached_app.extensions["event_bus"].publish.assert_called_once_with(
+        "auth_revoked", ["user", "testuser", "old_token"]
+    )
+
+
+@patch("app.server.auth.User")
+def test_principal_read_before_a_revocation_is_not_cached(mock_user, cached_app):
+    """Test that a lookup racing a revocation does not cache the revoked token."""
+    token = generate_jwt("testuser", "user", "test_token")
+
+    def revoke_during_lookup():
+        # The logout commits and its event arrives while the query runs
+        forget_principal(["user", "testuser", "test_token"])
+        return MagicMock(id=7, username="testuser", is_active=True)
+
+    mock_user.query.filter_by.return_value.first.side_effect = revoke_during_lookup
+    call_user_route(token)
+
+    assert len(cached_app.extensions["principal_cache"]) == 0
+
+
+@patch("app.server.auth.User")
+def test_principals_are_not_cached_while_the_bus_is_down(mock_user, cached_app):
+    """Test that the cache is bypassed without a listener, and cleared after it."""
+    mock_user.query.filter_by.return_value.first.return_value = MagicMock(
+        id=7, username="testuser", is_active=True
+    )
+    token = generate_jwt("testuser", "user", "test_token")
+    cache = cached_app.extensions["principal_cache"]
+    call_user_route(token)
+    assert len(cache) == 1
+
+    cache.bus.listening = False
+    call_user_route(token)
+    call_user_route(token)
+    assert mock_user.query.filter_by.call_count == 3
+
+    # Reconnected: revocations may have been missed meanwhile
+    cache.bus.listening = True
+    cache.bus.generation = 2
+    cache.clear()
+    assert len(cache) == 0
+    call_user_route(token)
+    assert mock_user.query.filter_by.call_count == 4
+    assert len(cache) == 1
@@ -0,0 +1,107 @@
+import pytest
+from unittest.mock import MagicMock
+from flask import Flask
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.codes import CodeAllocator
+from app.server.models import URL, User
+from app.server.routes.user import user_bp
+from app.server.shards import ShardRouter
+from app.server.stats import load_system_stats
+
+
+@pytest.fixture
+def app():
+    """Create a user test client on SQLite with a real code allocator."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SHORT_CODE_KEY"] = "testing-code-key"
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 100
+    app.config["SHORTEN_BATCH_MAX_SIZE"] = 50
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    CodeAllocator(app)
+    app.extensions["event_bus"] = MagicMock()
+    app.extensions["short_code_filter"] = MagicMock()
+    app.register_blueprint(user_bp)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            db.text("INSERT INTO short_code_allocation (id, next_value) VALUES (1, 1)")
+        )
+        db.session.add(User(username="alice", password="x", access_token="token"))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("alice", "user", "token"))
+    return client
+
+
+def test_batch_creates_every_url(app, client):
+    """Test that a valid batch is inserted and counted in full."""
+    urls = [{"url": f"https://{i}.example"} for i in range(40)]
+    urls.append({"url": "https://permanent.example", "permanent": True})
+
+    response = client.post("/shorten/batch", json={"urls": urls})
+
+    assert response.status_code == 201
+    assert response.json["created"] == 41
+    results = response.json["results"]
+    assert [result["index"] for result in results] == list(range(41))
+    assert results[3]["original_url"] == "https://3.example"
+    assert "expires_at" not in results[40]
+    stored = {url.short_code: url.original_url for url in URL.query.all()}
+    assert stored[results[3]["short_code"]] == "https://3.example"
+    assert load_system_stats()["urls"]["total"] == 41
+    assert User.query.one().url_count == 41
+    app.extensions["short_code_filter"].add_many.assert_called_once()
+
+
+def test_batch_reports_partial_failures(client):
+    """Test that invalid items are reported while the valid ones are created."""
+    response = client.post(
+        "/shorten/batch",
+        json={"urls": ["https://ok.example", "not a url", {"permanent": True}]},
+    )
+
+    assert response.status_code == 207
+    assert response.json["created"] == 1
+    assert response.json["failed"] == 2
+    results = response.json["results"]
+    assert results[0]["short_code"]
+    assert results[1] == {"index": 1, "error": "Invalid URL format"}
+    assert results[2] == {"index": 2, "error": "URL is required"}
+
+
+def test_batch_retries_taken_codes(app, client):
+    """Test that items whose code was already taken get a fresh code."""
+    with app.app_context():
+        taken = app.extensions["code_allocator"].code_for(1)
+        db.session.add(
+            URL(original_url="https://old.example", short_code=taken, user_id=1)
+        )
+        db.session.commit()
+
+    response = client.post("/shorten/batch", json={"urls": ["https://new.example"]})
+
+    assert response.status_code == 201
+    assert response.json["results"][0]["short_code"] != taken
+    assert URL.query.count() == 2
+
+
+@pytest.mark.parametrize(
+    "body",
+    [{}, {"urls": []}, {"urls": "https://a.example"}, {"urls": ["x"] * 51}],
+)
+def test_batch_rejects_bad_requests(client, body):
+    """Test that malformed, empty and oversized batches are rejected."""
+    assert client.post("/shorten/batch", json=body).status_code == 400
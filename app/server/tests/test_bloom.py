@@ -0,0 +1,227 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from flask import Flask
+from app.server.bloom import BloomFilter, ShortCodeFilter
+from app.server.cache import TTLCache
+from app.server.events import EventBus
+from app.server.redirects import RedirectEntry, resolve_redirect
+from app.server.shards import ShardRouter
+
+
+def make_filter(bus):
+    """Create a short code filter bound to a minimal Flask app and event bus."""
+    app = Flask(__name__)
+    app.config["SHORT_CODE_FILTER_ENABLED"] = True
+    app.config["SHORT_CODE_FILTER_MIN_CAPACITY"] = 1000
+    app.config["SHORT_CODE_FILTER_ERROR_RATE"] = 0.01
+    app.config["SHORT_CODE_FILTER_REFRESH_INTERVAL"] = 30
+    app.config["NEGATIVE_CACHE_SIZE"] = 100
+    app.config["NEGATIVE_CACHE_TTL"] = 60
+    app.config["URL_SHARDS_REBALANCING"] = False
+    app.extensions["event_bus"] = bus
+    ShardRouter(app)
+    return ShortCodeFilter(app)
+
+
+def load(short_code_filter, *short_codes):
+    """Load the filter as if a sync completed on the current bus connection."""
+    short_code_filter._bloom = BloomFilter(capacity=1000)
+    short_code_filter._synced_generation = short_code_filter.bus.generation
+    for short_code in short_codes:
+        short_code_filter.add(short_code)
+
+
+@pytest.fixture
+def short_code_filter():
+    """Create a short code filter with a connected event bus."""
+    bus = MagicMock(enabled=True, listening=True, generation=1)
+    bus.poll.return_value = True
+    return make_filter(bus)
+
+
+class FakeListenConnection:
+    """Stands in for the DBAPI connection an event bus listens on."""
+
+    def __init__(self):
+        self.notifies = []
+
+    def poll(self):
+        pass
+
+    def deliver(self, payload):
+        self.notifies.append(MagicMock(payload=payload))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test that every added item is reported as present."""
+    bloom = BloomFilter(capacity=1000)
+    codes = [f"code{i}" for i in range(1000)]
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate():
+    """Test that the false positive rate stays near the configured target."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"code{i}")
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_sizing():
+    """Test that the bit array and hash count follow the standard formulas."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    assert 9500 < bloom.size < 9700
+    assert bloom.hashes == 7
+
+
+def test_unloaded_filter_lets_everything_through(short_code_filter):
+    """Test that codes go to the database until the filter is loaded."""
+    assert not short_code_filter.ready
+    assert short_code_filter.might_exist("abc123")
+
+
+def test_definite_miss(short_code_filter):
+    """Test that unknown codes are rejected once the filter is loaded."""
+    load(short_code_filter, "abc123")
+    assert short_code_filter.might_exist("abc123")
+    assert not short_code_filter.might_exist("zzz999")
+    assert short_code_filter.definite_misses == 1
+
+
+def test_negative_cache(short_code_filter):
+    """Test that missing codes are remembered until they are created."""
+    load(short_code_filter, "abc123")
+    short_code_filter.remember_missing("abc123")
+    assert not short_code_filter.might_exist("abc123")
+
+    short_code_filter.add("abc123")
+    assert short_code_filter.might_exist("abc123")
+
+
+def test_codes_added_during_rebuild_are_kept(short_code_filter):
+    """Test that codes created while the filter is rebuilt are not lost."""
+    short_code_filter._row_count = lambda shard: 1
+    short_code_filter._bloom = BloomFilter(capacity=1000)
+
+    def add_during_scan(*args):
+        short_code_filter.add("new222")
+        return [(1, "old111")]
+
+    short_code_filter._live_codes = add_during_scan
+    short_code_filter.rebuild()
+
+    assert short_code_filter.might_exist("old111")
+    assert short_code_filter.might_exist("new222")
+
+
+def test_discard_triggers_rebuild(short_code_filter):
+    """Test that accumulating deleted codes schedules a rebuild."""
+    short_code_filter._bloom = BloomFilter(capacity=1000)
+    short_code_filter.discard(10)
+    assert not short_code_filter._wakeup.is_set()
+    short_code_filter.discard(300)
+    assert short_code_filter._wakeup.is_set()
+
+
+def test_filter_disabled_without_event_bus():
+    """Test that the filter never loads when other workers cannot reach it."""
+    short_code_filter = make_filter(MagicMock(enabled=False))
+    assert not short_code_filter.enabled
+
+
+def test_unknown_codes_pass_while_bus_is_not_listening(short_code_filter):
+    """Test that codes go to the database while events may be missed."""
+    load(short_code_filter, "abc123")
+    short_code_filter.remember_missing("zzz999")
+    short_code_filter.bus.listening = False
+    assert short_code_filter.might_exist("zzz999")
+    assert short_code_filter.might_exist("new222")
+
+
+def test_filter_is_not_trusted_after_reconnect_until_refreshed(short_code_filter):
+    """Test that a reconnected bus requires a refresh before codes are rejected."""
+    load(short_code_filter, "abc123")
+    short_code_filter.remember_missing("zzz999")
+
+    short_code_filter.bus.generation = 2
+    short_code_filter._on_reconnect()
+    assert short_code_filter._wakeup.is_set()
+    assert short_code_filter.might_exist("new222")
+
+    short_code_filter._live_codes = lambda shard, min_id: []
+    short_code_filter.refresh()
+    assert not short_code_filter.might_exist("new222")
+    # The missing code may have been created while disconnected
+    assert short_code_filter.negative_cache.get("zzz999") is None
+
+
+def test_filter_is_not_trusted_after_import_until_refreshed(short_code_filter):
+    """Test that imported codes are not rejected before a refresh loaded them."""
+    load(short_code_filter, "abc123")
+    short_code_filter.remember_missing("imp111")
+
+    short_code_filter._on_import(20000)
+    assert short_code_filter._wakeup.is_set()
+    assert short_code_filter.might_exist("imp111")
+    assert short_code_filter.negative_cache.get("imp111") is None
+
+    short_code_filter._live_codes = lambda shard, min_id: [(2, "imp111")]
+    short_code_filter.refresh()
+    assert short_code_filter.might_exist("imp111")
+    assert not short_code_filter.might_exist("zzz999")
+
+
+def test_code_created_on_another_worker_is_not_rejected():
+    """Test create-then-redirect across workers before the listener ran."""
+    creating_bus, serving_bus = EventBus(), EventBus()
+    serving_bus.app = Flask(__name__)
+    serving_bus.enabled = creating_bus.enabled = True
+    connection = FakeListenConnection()
+    serving_bus._connection = connection
+    serving_bus.generation = 1
+    serving_bus.listening = True
+
+    short_code_filter = make_filter(serving_bus)
+    load(short_code_filter, "old111")
+    short_code_filter.remember_missing("new222")
+
+    # Worker A commits new222; the event reaches B's connection, but B's
+    # listener thread has not dispatched it yet when the redirect arrives
+    with patch("app.server.events.db") as mock_db:
+        creating_bus.publish("url_created", "new222")
+    connection.deliver(mock_db.session.execute.call_args[0][1]["payload"])
+
+    assert short_code_filter.might_exist("new222")
+    assert short_code_filter.might_exist("old111")
+    assert not short_code_filter.might_exist("zzz999")
+    assert connection.notifies == []
+
+
+def test_code_created_during_its_lookup_is_not_remembered_missing(short_code_filter):
+    """Test that add() between a lookup's miss and remember_missing wins."""
+    # old111 was deleted and its code reused, so the filter lets it through
+    load(short_code_filter, "abc123", "old111")
+    app = short_code_filter.app
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+
+    def created_during_lookup(short_code):
+        # The lookup missed; the url_created event is handled before it returns
+        short_code_filter.add(short_code)
+        return None
+
+    with app.app_context(), patch("app.server.redirects.lookup_redirect") as lookup:
+        lookup.side_effect = created_during_lookup
+        assert resolve_redirect("old111") is None
+        assert short_code_filter.negative_cache.get("old111") is None
+
+        lookup.side_effect = None
+        lookup.return_value = RedirectEntry("https://example.com", None, True)
+        assert resolve_redirect("old111").original_url == "https://example.com"
+
+        lookup.return_value = None
+        assert resolve_redirect("abc123") is None
+        assert short_code_filter.negative_cache.get("abc123")
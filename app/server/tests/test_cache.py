@@ -0,0 +1,159 @@
+import threading
+import pytest
+from app.server.cache import TTLCache
+
+
+class FakeTimer:
+    """Manually advanced clock for TTL tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
+
+
+def test_get_missing_key(timer):
+    """Test that a missing key returns the default and counts a miss."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    assert cache.get("abc") is None
+    assert cache.get("abc", "default") == "default"
+    assert cache.misses == 2
+    assert cache.hits == 0
+
+
+def test_set_and_get(timer):
+    """Test that a stored value is returned and counts a hit."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("abc", "value")
+    assert cache.get("abc") == "value"
+    assert cache.hits == 1
+
+
+def test_entry_expires_after_ttl(timer):
+    """Test that entries are dropped once their TTL has passed."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("abc", "value")
+    timer.now = 9.9
+    assert cache.get("abc") == "value"
+    timer.now = 10
+    assert cache.get("abc") is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_overrides_default(timer):
+    """Test that a shorter per-entry TTL is honoured."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("abc", "value", ttl=1)
+    timer.now = 1
+    assert cache.get("abc") is None
+
+
+@pytest.mark.parametrize("ttl", [0, -5])
+def test_non_positive_ttl_is_not_cached(timer, ttl):
+    """Test that entries which would already be expired are not stored."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("abc", "value", ttl=ttl)
+    assert len(cache) == 0
+
+
+def test_lru_eviction(timer):
+    """Test that the least recently used entry is evicted first."""
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_invalidate_and_clear(timer):
+    """Test explicit invalidation of single keys and the whole cache."""
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_stats(timer):
+    """Test that stats report counters and hit rate."""
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+    assert cache.stats()["hit_rate"] == 0.0
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    stats = cache.stats()
+    assert stats["size"] == 1
+    assert stats["maxsize"] == 4
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_get_or_load(timer):
+    """Test that get_or_load fills misses and serves hits from the cache."""
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_load("a", loader) == 1
+    assert cache.get_or_load("a", loader) == 1
+    timer.now = 11
+    assert cache.get_or_load("a", loader) == 2
+    assert cache.stats()["loads"] == 2
+
+
+def test_get_or_load_is_single_flight(timer):
+    """Test that concurrent misses share one loader call."""
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("a", loader)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_get_or_load_does_not_cache_errors(timer):
+    """Test that a failing loader is retried on the next call."""
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+
+    def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("a", failing)
+    assert cache.get_or_load("a", lambda: "value") == "value"
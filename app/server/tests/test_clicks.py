@@ -0,0 +1,76 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from app.server.clicks import ClickAggregator
+from app.server.shards import ShardRouter
+
+
+@pytest.fixture
+def aggregator():
+    """Create a click aggregator bound to a minimal Flask app."""
+    app = Flask(__name__)
+    app.config["CLICK_FLUSH_INTERVAL"] = 3600
+    app.config["CLICK_FLUSH_MAX_PENDING"] = 10
+    app.config["URL_SHARDS_REBALANCING"] = False
+    ShardRouter(app)
+    with patch("app.server.clicks.atexit"):
+        aggregator = ClickAggregator(app)
+    # Never start the background thread in tests
+    aggregator._ensure_flusher = lambda: None
+    return aggregator
+
+
+def test_record_aggregates_per_short_code(aggregator):
+    """Test that clicks are summed per short code with the latest access time."""
+    first = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    later = first + timedelta(minutes=5)
+    aggregator.record("abc123", later)
+    aggregator.record("abc123", first)
+    aggregator.record("xyz789", first)
+
+    with patch.object(aggregator, "_write") as mock_write:
+        assert aggregator.flush() == 3
+
+    batch = mock_write.call_args[0][0]
+    assert batch == {"abc123": [2, later], "xyz789": [1, first]}
+    assert aggregator.stats()["pending_clicks"] == 0
+    assert aggregator.flushed_clicks == 3
+
+
+def test_flush_empty_buffer(aggregator):
+    """Test that flushing an empty buffer does not touch the database."""
+    with patch.object(aggregator, "_write") as mock_write:
+        assert aggregator.flush() == 0
+    mock_write.assert_not_called()
+
+
+def test_failed_flush_keeps_clicks(aggregator):
+    """Test that clicks of a failed flush are retried by the next flush."""
+    aggregator.record("abc123")
+    with patch.object(aggregator, "_write", side_effect=Exception("db down")):
+        assert aggregator.flush() == 0
+    assert aggregator.failed_flushes == 1
+
+    aggregator.record("abc123")
+    with patch.object(aggregator, "_write") as mock_write:
+        assert aggregator.flush() == 2
+    assert mock_write.call_args[0][0]["abc123"][0] == 2
+
+
+def test_max_pending_forces_flush(aggregator):
+    """Test that reaching the pending limit flushes inline."""
+    with patch.object(aggregator, "_write") as mock_write:
+        for _ in range(10):
+            aggregator.record("abc123")
+    mock_write.assert_called_once()
+    assert aggregator.stats()["pending_clicks"] == 0
+
+
+def test_clicks_dropped_while_database_unreachable(aggregator):
+    """Test that the buffer stays bounded while flushes keep failing."""
+    with patch.object(aggregator, "_write", side_effect=Exception("db down")):
+        for _ in range(15):
+            aggregator.record("abc123")
+    assert aggregator.stats()["pending_clicks"] == 10
+    assert aggregator.dropped_clicks == 5
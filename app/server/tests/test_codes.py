@@ -0,0 +1,157 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from app.server.codes import (
+    ALPHABET,
+    CodeAllocator,
+    FeistelPermutation,
+    decode_base62,
+    encode_base62,
+)
+
+
+@pytest.fixture
+def allocator():
+    """Create a code allocator bound to a minimal Flask app."""
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SHORT_CODE_KEY"] = None
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 10
+    return CodeAllocator(app)
+
+
+class FakeAllocationTable:
+    """Stands in for the short_code_allocation row."""
+
+    def __init__(self):
+        self.next_value = 1
+        self.calls = []
+
+    def reserve(self, size):
+        self.calls.append(size)
+        start = self.next_value
+        self.next_value += size
+        return start, start + size
+
+
+@pytest.mark.parametrize(
+    "number, length, expected",
+    [
+        (0, 6, "aaaaaa"),
+        (1, 6, "aaaaab"),
+        (61, 2, "a9"),
+        (62, 2, "ba"),
+        (62**3 - 1, 3, "999"),
+    ],
+)
+def test_encode_base62(number, length, expected):
+    """Test fixed-length base62 encoding."""
+    assert encode_base62(number, length) == expected
+    assert decode_base62(expected) == number
+
+
+@pytest.mark.parametrize("number", [-1, 62**3])
+def test_encode_base62_out_of_range(number):
+    """Test that numbers outside the code space are rejected."""
+    with pytest.raises(ValueError):
+        encode_base62(number, 3)
+
+
+@pytest.mark.parametrize("domain", [2, 62, 62**2, 1000, 3**7])
+def test_permutation_is_bijective(domain):
+    """Test that the permutation maps the domain onto itself one-to-one."""
+    permutation = FeistelPermutation(b"key", domain)
+    assert sorted(permutation(n) for n in range(domain)) == list(range(domain))
+
+
+def test_permutation_depends_on_key():
+    """Test that different keys give different permutations."""
+    first = FeistelPermutation(b"key-1", 62**6)
+    second = FeistelPermutation(b"key-2", 62**6)
+    assert [first(n) for n in range(10)] != [second(n) for n in range(10)]
+
+
+def test_permutation_out_of_domain():
+    """Test that values outside the domain are rejected."""
+    with pytest.raises(ValueError):
+        FeistelPermutation(b"key", 100)(100)
+
+
+def test_codes_respect_length(allocator):
+    """Test that codes have the configured or requested length."""
+    assert len(allocator.code_for(1)) == 6
+    assert len(allocator.code_for(1, length=8)) == 8
+    assert set(allocator.code_for(12345)) <= set(ALPHABET)
+
+
+def test_consecutive_ids_give_unique_scrambled_codes(allocator):
+    """Test that sequential ids map to distinct, non-sequential codes."""
+    codes = [allocator.code_for(n) for n in range(1, 10001)]
+    assert len(set(codes)) == len(codes)
+    assert [decode_base62(code) for code in codes[:10]] != list(range(1, 11))
+
+
+def test_codes_are_stable_for_the_same_key(allocator):
+    """Test that the same id always maps to the same code."""
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SHORT_CODE_KEY"] = None
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 10
+    assert CodeAllocator(app).code_for(42) == allocator.code_for(42)
+
+
+def test_ids_come_from_reserved_blocks(allocator):
+    """Test that one reservation serves a whole block of ids."""
+    table = FakeAllocationTable()
+    with patch.object(allocator, "_reserve_block", side_effect=table.reserve), patch(
+        "app.server.codes.threading.Thread"
+    ):
+        assert [allocator.next_id() for _ in range(5)] == [1, 2, 3, 4, 5]
+    assert table.calls == [10]
+
+
+def test_spare_block_is_reserved_before_exhaustion(allocator):
+    """Test that the next block is fetched in the background near the end."""
+    table = FakeAllocationTable()
+    with patch.object(allocator, "_reserve_block", side_effect=table.reserve), patch(
+        "app.server.codes.threading.Thread"
+    ) as mock_thread:
+        ids = [allocator.next_id() for _ in range(9)]
+        mock_thread.assert_called_once()
+        # Run the background refill, then keep allocating from the spare block
+        allocator._refill()
+        ids += [allocator.next_id() for _ in range(2)]
+
+    assert ids == list(range(1, 12))
+    assert table.calls == [10, 10]
+
+
+def test_unused_ids_are_skipped_after_fork(allocator):
+    """Test that a forked process never reuses its parent's block."""
+    table = FakeAllocationTable()
+    with patch.object(allocator, "_reserve_block", side_effect=table.reserve), patch(
+        "app.server.codes.threading.Thread"
+    ):
+        assert allocator.next_id() == 1
+        allocator._pid = -1
+        assert allocator.next_id() == 11
+
+
+def test_large_batches_get_a_dedicated_block(allocator):
+    """Test that bulk allocation larger than a block reserves exactly once."""
+    table = FakeAllocationTable()
+    with patch.object(allocator, "_reserve_block", side_effect=table.reserve):
+        codes = allocator.allocate_many(25)
+    assert len(set(codes)) == 25
+    assert table.calls == [25]
+
+
+def test_missing_allocation_row(allocator):
+    """Test that a missing allocation row raises a clear error."""
+    with patch("app.server.codes.db") as mock_db:
+        connection = mock_db.engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.scalar.return_value = None
+        with pytest.raises(RuntimeError, match="short_code_allocation"):
+            allocator._reserve_block(10)
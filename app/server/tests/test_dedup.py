@@ -0,0 +1,232 @@
+import os
+import threading
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from flask import Flask
+from sqlalchemy import text
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.codes import CodeAllocator
+from app.server.models import URL, User, normalize_url, url_digest
+from app.server.routes.user import user_bp
+from app.server.shards import ShardRouter, create_shard_tables
+
+
+def setup_shortening(app):
+    """Give an app with a database what shortening URLs needs."""
+    app.config["SHORT_CODE_KEY"] = "testing-code-key"
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 100
+    app.config["SHORTEN_BATCH_MAX_SIZE"] = 50
+    app.config.setdefault("SHORTEN_DEDUPLICATE", False)
+    CodeAllocator(app)
+    app.extensions["event_bus"] = MagicMock()
+    app.extensions["short_code_filter"] = MagicMock()
+    db.session.execute(
+        text("INSERT INTO short_code_allocation (id, next_value) VALUES (1, 1)")
+    )
+    db.session.add(User(username="alice", password="x", access_token="token"))
+    db.session.commit()
+
+
+@pytest.fixture
+def app():
+    """Create a user test client on SQLite with deduplication off by default."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.register_blueprint(user_bp)
+    with app.app_context():
+        db.create_all()
+        setup_shortening(app)
+        yield app
+        db.session.remove()
+
+
+def make_client(app):
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("alice", "user", "token"))
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return make_client(app)
+
+
+@pytest.mark.parametrize(
+    "url, normalized",
+    [
+        ("HTTPS://Example.COM", "https://example.com/"),
+        ("https://example.com:443/a?b=C#D", "https://example.com/a?b=C#D"),
+        (
+            "http://User:Pw@EXAMPLE.com:8080/Path",
+            "http://User:Pw@example.com:8080/Path",
+        ),
+        ("  http://[::1]:80/x ", "http://[::1]/x"),
+    ],
+)
+def test_normalize_url(url, normalized):
+    """Test that only parts which never change the resource are normalized."""
+    assert normalize_url(url) == normalized
+
+
+def test_url_digest_is_set_on_every_insert(client):
+    """Test the digest of URLs created one at a time and in batches."""
+    client.post("/shorten", json={"url": "https://Example.com"})
+    client.post("/shorten/batch", json={"urls": ["https://example.com:443/"]})
+
+    digests = {url.url_digest for url in URL.query.all()}
+    assert digests == {url_digest("https://example.com/")}
+    assert len(url_digest("https://example.com/")) == 32
+
+
+def test_deduplicate_returns_the_live_url(client):
+    """Test that a deduplicated shorten reuses the user's existing code."""
+    created = client.post("/shorten", json={"url": "https://example.com/a"})
+    repeated = client.post(
+        "/shorten", json={"url": "HTTPS://EXAMPLE.COM/a", "deduplicate": True}
+    )
+
+    assert created.status_code == 201
+    assert repeated.status_code == 200
+    assert repeated.json["deduplicated"] is True
+    assert repeated.json["short_code"] == created.json["short_code"]
+    assert repeated.json["original_url"] == "https://example.com/a"
+    assert URL.query.count() == 1
+    assert User.query.one().url_count == 1
+
+
+def test_deduplicate_matches_permanence_and_liveness(app, client):
+    """Test that permanent, temporary and expired URLs are not interchangeable."""
+    temporary = client.post("/shorten", json={"url": "https://example.com"})
+    permanent = client.post(
+        "/shorten",
+        json={"url": "https://example.com", "permanent": True, "deduplicate": True},
+    )
+    assert permanent.status_code == 201
+    assert permanent.json["short_code"] != temporary.json["short_code"]
+
+    url = URL.query.filter_by(short_code=temporary.json["short_code"]).one()
+    url.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.session.commit()
+    renewed = client.post(
+        "/shorten", json={"url": "https://example.com", "deduplicate": True}
+    )
+    assert renewed.status_code == 201
+    assert URL.query.count() == 3
+
+
+def test_deduplicate_defaults_to_config(app, client):
+    """Test that SHORTEN_DEDUPLICATE applies unless the request overrides it."""
+    client.post("/shorten", json={"url": "https://example.com"})
+    assert (
+        client.post("/shorten", json={"url": "https://example.com"}).status_code == 201
+    )
+
+    app.config["SHORTEN_DEDUPLICATE"] = True
+    assert (
+        client.post("/shorten", json={"url": "https://example.com"}).status_code == 200
+    )
+    response = client.post(
+        "/shorten", json={"url": "https://example.com", "deduplicate": False}
+    )
+    assert response.status_code == 201
+    assert URL.query.count() == 3
+
+
+@pytest.fixture
+def pg_sharded_app():
+    """Create a user test client app on scratch PostgreSQL primary and shards.
+
+    Skipped unless TEST_DATABASE_URL and TEST_SHARD_DATABASE_URLS, a comma
+    separated pair of further scratch databases, are set.
+    """
+    database_url = os.getenv("TEST_DATABASE_URL")
+    shard_urls = os.getenv("TEST_SHARD_DATABASE_URLS", "").split(",")
+    if not database_url or len(shard_urls) != 2:
+        pytest.skip("TEST_DATABASE_URL or TEST_SHARD_DATABASE_URLS is not set")
+
+    shards = ["url_shard_1", "url_shard_2"]
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_BINDS"] = dict(zip(shards, shard_urls))
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.register_blueprint(user_bp)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for shard in shards:
+            with db.engines[shard].begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS urls"))
+            create_shard_tables(db.engines[shard])
+        setup_shortening(app)
+        yield app
+        db.session.remove()
+        db.drop_all()
+        for shard in shards:
+            with db.engines[shard].begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS urls"))
+    for shard in shards:
+        db.metadatas.pop(shard, None)
+
+
+def race_shortens(app, url, requests=8):
+    """Shorten url with deduplication from concurrent clients at once.
+
+    Returns the (status, short_code) of every response.
+    """
+    results = []
+    barrier = threading.Barrier(requests)
+
+    def shorten(client):
+        barrier.wait()
+        response = client.post("/shorten", json={"url": url, "deduplicate": True})
+        results.append((response.status_code, response.json["short_code"]))
+
+    threads = [
+        threading.Thread(target=shorten, args=(make_client(app),))
+        for _ in range(requests)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_deduplicated_shortens_create_one_url(pg_app):
+    """Test that racing requests for the same URL share one row on PostgreSQL."""
+    setup_shortening(pg_app)
+    results = race_shortens(pg_app, "https://race.example")
+
+    try:
+        assert sorted(status for status, _ in results) == [200] * 7 + [201]
+        assert len({short_code for _, short_code in results}) == 1
+        assert URL.query.filter_by(original_url="https://race.example").count() == 1
+    finally:
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+def test_concurrent_deduplicated_shortens_create_one_url_when_sharded(
+    pg_sharded_app,
+):
+    """Test that racing requests share one row whichever shard it goes to."""
+    for i in range(10):
+        url = f"https://race-{i}.example"
+        results = race_shortens(pg_sharded_app, url)
+
+        assert sorted(status for status, _ in results) == [200] * 7 + [201]
+        assert len({short_code for _, short_code in results}) == 1
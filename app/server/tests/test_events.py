@@ -0,0 +1,109 @@
+import json
+import pytest
+from unittest.mock import patch, MagicMock
+from flask import Flask
+from app.server.events import CHANNEL, EventBus
+
+
+@pytest.fixture
+def bus():
+    """Create an enabled event bus bound to a minimal Flask app."""
+    bus = EventBus()
+    bus.app = Flask(__name__)
+    bus.enabled = True
+    return bus
+
+
+def event(topic, data=None, origin="other-worker"):
+    return json.dumps({"topic": topic, "data": data, "origin": origin})
+
+
+def test_dispatch_calls_handlers_of_the_topic(bus):
+    """Test that events reach only the handlers subscribed to their topic."""
+    created, deleted = MagicMock(), MagicMock()
+    bus.subscribe("url_created", created)
+    bus.subscribe("urls_deleted", deleted)
+
+    bus._dispatch(event("url_created", "abc123"))
+
+    created.assert_called_once_with("abc123")
+    deleted.assert_not_called()
+    assert bus.received == 1
+
+
+def test_dispatch_skips_own_events(bus):
+    """Test that a worker does not handle the events it published itself."""
+    handler = MagicMock()
+    bus.subscribe("url_created", handler)
+
+    bus._dispatch(event("url_created", "abc123", origin=bus._origin))
+
+    handler.assert_not_called()
+    assert bus.received == 0
+
+
+def test_dispatch_isolates_failing_handlers(bus):
+    """Test that one failing handler does not keep others from running."""
+    failing = MagicMock(side_effect=RuntimeError("boom"))
+    handler = MagicMock()
+    bus.subscribe("url_created", failing)
+    bus.subscribe("url_created", handler)
+
+    bus._dispatch(event("url_created", "abc123"))
+
+    failing.assert_called_once_with("abc123")
+    handler.assert_called_once_with("abc123")
+
+
+def test_dispatch_ignores_unknown_topics(bus):
+    """Test that events without subscribers are dropped quietly."""
+    bus._dispatch(event("something_else"))
+    assert bus.received == 1
+
+
+@patch("app.server.events.db")
+def test_publish_is_a_no_op_when_disabled(mock_db, bus):
+    """Test that nothing is sent when the event bus is disabled."""
+    bus.enabled = False
+    bus.publish("url_created", "abc123")
+    mock_db.session.execute.assert_not_called()
+
+
+@patch("app.server.events.db")
+def test_publish_notifies_with_origin(mock_db, bus):
+    """Test that published events carry their topic, data and origin."""
+    bus.publish("url_created", "abc123")
+
+    params = mock_db.session.execute.call_args[0][1]
+    assert params["channel"] == CHANNEL
+    assert json.loads(params["payload"]) == {
+        "topic": "url_created",
+        "data": "abc123",
+        "origin": bus._origin,
+    }
+
+
+def test_poll_without_connection(bus):
+    """Test that polling reports failure while the listener is not connected."""
+    assert not bus.poll()
+
+
+def test_poll_dispatches_arrived_events(bus):
+    """Test that polling dispatches events waiting on the listen connection."""
+    handler = MagicMock()
+    bus.subscribe("url_created", handler)
+    connection = MagicMock()
+    connection.notifies = [MagicMock(payload=event("url_created", "abc123"))]
+    bus._connection = connection
+
+    assert bus.poll()
+    handler.assert_called_once_with("abc123")
+    assert connection.notifies == []
+
+
+def test_poll_reports_connection_errors(bus):
+    """Test that a broken listen connection makes polling fail."""
+    connection = MagicMock()
+    connection.poll.side_effect = OSError("connection lost")
+    bus._connection = connection
+    assert not bus.poll()
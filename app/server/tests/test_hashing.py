@@ -0,0 +1,116 @@
+import threading
+import pytest
+from unittest.mock import patch
+from flask import Flask
+import bcrypt
+from app.server.hashing import HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    """Create a password hasher with a cheap cost factor."""
+    app = Flask(__name__)
+    app.config["BCRYPT_ROUNDS"] = 4
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    app.config["PASSWORD_HASH_MAX_QUEUE"] = 1
+    return PasswordHasher(app)
+
+
+def test_hash_and_verify(hasher):
+    """Test that hashed passwords verify and wrong passwords do not."""
+    hashed = hasher.hash("Secret123!")
+    assert hashed.startswith("$2b$04$")
+    assert hasher.verify("Secret123!", hashed)
+    assert not hasher.verify("wrong", hashed)
+
+
+def test_needs_rehash(hasher):
+    """Test that hashes with a different cost are flagged for rehashing."""
+    assert not hasher.needs_rehash(hasher.hash("Secret123!"))
+    old_hash = bcrypt.hashpw(b"Secret123!", bcrypt.gensalt(rounds=5)).decode()
+    assert hasher.needs_rehash(old_hash)
+    assert hasher.verify("Secret123!", old_hash)
+
+
+def test_queue_limit_rejects_excess_work(hasher):
+    """Test that hashes beyond the pool and queue are rejected, not queued."""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def slow_checkpw(password, hashed):
+        started.release()
+        release.wait(5)
+        return True
+
+    with patch("app.server.hashing.bcrypt.checkpw", side_effect=slow_checkpw):
+        # One running and one queued hash fill the pool and its queue
+        threads = [
+            threading.Thread(target=hasher.verify, args=("pw", "$2b$04$x"))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        started.acquire(timeout=5)
+        while hasher.stats()["in_flight"] < 2:
+            pass
+
+        with pytest.raises(HasherBusy):
+            hasher.verify("pw", "$2b$04$x")
+        assert hasher.stats()["queued"] == 1
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    stats = hasher.stats()
+    assert stats["rejected"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["verified"] == 2
+
+
+def test_latency_is_recorded(hasher):
+    """Test that completed hashes update the latency metrics."""
+    hasher.hash("Secret123!")
+    stats = hasher.stats()
+    assert stats["hashed"] == 1
+    assert stats["latency_avg_ms"] > 0
+    assert stats["latency_max_ms"] >= stats["latency_avg_ms"]
+
+
+@patch("app.server.routes.public.get_event_bus")
+@patch("app.server.routes.public.db")
+@patch("app.server.routes.public.User")
+def test_login_rehashes_on_cost_change(mock_user, mock_db, mock_bus, hasher):
+    """Test that logging in upgrades a hash made with an old cost factor."""
+    from app.server.routes.public import login
+
+    old_hash = bcrypt.hashpw(b"Secret123!", bcrypt.gensalt(rounds=5)).decode()
+    user = mock_user.query.filter_by.return_value.first.return_value
+    user.username, user.password = "testuser", old_hash
+    hasher.app.config["SECRET_KEY"] = "testing-key"
+
+    with hasher.app.test_request_context(
+        json={"username": "testuser", "password": "Secret123!"}
+    ):
+        response = login()
+
+    assert response.status_code == 200
+    assert user.password.startswith("$2b$04$")
+    assert hasher.verify("Secret123!", user.password)
+    mock_db.session.commit.assert_called_once()
+
+
+@patch("app.server.routes.public.User")
+def test_login_answers_503_when_busy(mock_user, hasher):
+    """Test that a full hashing queue turns into 503 with Retry-After."""
+    from app.server.routes.public import login
+
+    mock_user.query.filter_by.return_value.first.return_value.password = "$2b$04$x"
+
+    with hasher.app.test_request_context(
+        json={"username": "testuser", "password": "Secret123!"}
+    ), patch.object(hasher, "verify", side_effect=HasherBusy):
+        response = login()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,222 @@
+import io
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from sqlalchemy import func, select, text
+from app.server import db
+from app.server.codes import CodeAllocator
+from app.server.importer import (
+    CopyStream,
+    Importer,
+    InvalidRecord,
+    detect_format,
+    parse_record,
+    read_records,
+)
+from app.server.models import URL, User, url_digest
+from app.server.stats import load_system_stats
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def test_parse_record_fills_in_defaults():
+    """Test that optional fields default like links created through the API."""
+    username, url, short_code, expires_at, is_permanent = parse_record(
+        {"username": " alice ", "original_url": "https://example.com"}, NOW
+    )
+    assert (username, url, short_code, is_permanent) == (
+        "alice",
+        "https://example.com",
+        None,
+        False,
+    )
+    assert expires_at > NOW
+
+
+def test_parse_record_reads_explicit_fields():
+    """Test short codes, naive timestamps and permanence flags."""
+    record = {
+        "username": "alice",
+        "original_url": "https://example.com",
+        "short_code": "old-1",
+        "expires_at": "2027-03-04T05:06:07",
+    }
+    _, _, short_code, expires_at, _ = parse_record(record, NOW)
+    assert short_code == "old-1"
+    assert expires_at == datetime(2027, 3, 4, 5, 6, 7, tzinfo=timezone.utc)
+
+    record.update(is_permanent="yes")
+    assert parse_record(record, NOW)[3:] == (None, True)
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        None,
+        {"original_url": "https://example.com"},
+        {"username": "alice"},
+        {"username": "alice", "original_url": "not a url"},
+        {"username": "alice", "original_url": "https://a.b", "short_code": "x" * 11},
+        {"username": "alice", "original_url": "https://a.b", "short_code": "a/b"},
+        {"username": "alice", "original_url": "https://a.b", "expires_at": "soon"},
+        {"username": "alice", "original_url": "https://a.b", "is_permanent": "maybe"},
+    ],
+)
+def test_parse_record_rejects_invalid_records(record):
+    """Test that records which cannot be imported raise InvalidRecord."""
+    with pytest.raises(InvalidRecord):
+        parse_record(record, NOW)
+
+
+def test_read_records_numbers_lines():
+    """Test that records carry the line they start on, for error reports."""
+    csv_lines = io.StringIO(
+        'username,original_url\nalice,https://a.example\nbob,"https://b.example"\n'
+    )
+    assert [line for line, _ in read_records(csv_lines, "csv")] == [2, 3]
+
+    ndjson_lines = io.StringIO('{"username": "alice"}\n\nnot json\n')
+    assert list(read_records(ndjson_lines, "ndjson")) == [
+        (1, {"username": "alice"}),
+        (3, None),
+    ]
+
+    with pytest.raises(ValueError):
+        read_records(io.StringIO("user,url\n"), "csv")
+
+
+def test_detect_format():
+    """Test that formats are recognized from file names, compressed or not."""
+    assert detect_format("links.csv") == "csv"
+    assert detect_format("LINKS.NDJSON.gz") == "ndjson"
+    assert detect_format("links.jsonl") == "ndjson"
+    assert detect_format("links.txt") is None
+
+
+def test_copy_stream_reads_across_chunks():
+    """Test that reads of any size return the chunks in order and then end."""
+    stream = CopyStream(iter(["abc", "", "defgh", "ij"]))
+    assert stream.read(2) == "ab"
+    assert stream.read(4) == "cdef"
+    assert stream.read(-1) == "ghij"
+    assert stream.read(8) == ""
+
+
+@pytest.fixture
+def importing_app(pg_app):
+    """Give the PostgreSQL app a code allocator, users and one existing URL."""
+    pg_app.config["SHORT_CODE_KEY"] = "testing-code-key"
+    pg_app.config["SHORT_CODE_LENGTH"] = 6
+    pg_app.config["SHORT_CODE_BLOCK_SIZE"] = 100
+    CodeAllocator(pg_app)
+    pg_app.extensions["event_bus"] = MagicMock()
+    db.session.execute(
+        text("INSERT INTO short_code_allocation (id, next_value) VALUES (1, 1)")
+    )
+    alice = User(username="alice", password="x", access_token="alice-token")
+    db.session.add_all(
+        [alice, User(username="bob", password="x", access_token="bob-token")]
+    )
+    db.session.flush()
+    db.session.add(
+        URL(
+            original_url="https://existing.example",
+            short_code="taken",
+            user_id=alice.id,
+        )
+    )
+    db.session.commit()
+    yield pg_app
+    db.session.rollback()
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+    db.session.commit()
+
+
+def import_records(records, **options):
+    importer = Importer(**options)
+    summary = importer.run(list(enumerate(records, 1)), now=NOW)
+    return summary
+
+
+def test_import_stages_merges_and_counts(importing_app):
+    """Test a mixed import end to end, including counters and the staging tables."""
+    expires_at = NOW + timedelta(days=3)
+    records = [
+        {
+            "username": "alice",
+            "original_url": "https://1.example",
+            "short_code": "old1",
+        },
+        {"username": "bob", "original_url": "https://2.example", "is_permanent": "t"},
+        {
+            "username": "bob",
+            "original_url": "https://3.example",
+            "expires_at": expires_at.isoformat(),
+        },
+        {"username": "carol", "original_url": "https://4.example"},
+        {"username": "bob", "original_url": "not a url"},
+    ]
+
+    summary = import_records(records, chunk_size=2)
+
+    assert summary["imported"] == 3
+    # Codes are allocated while staging, before unknown users are dropped
+    assert summary["generated_codes"] == 3
+    assert summary["rejected"] == 1
+    assert summary["rejected_sample"] == [{"line": 5, "reason": "Invalid URL"}]
+    assert summary["unknown_user"] == 1
+    assert summary["unknown_users_sample"] == ["carol"]
+
+    urls = {url.original_url: url for url in URL.query.all()}
+    assert urls["https://1.example"].short_code == "old1"
+    assert urls["https://1.example"].url_digest == url_digest("https://1.example")
+    assert urls["https://2.example"].is_permanent
+    assert urls["https://3.example"].expires_at == expires_at
+    assert {user.username: user.url_count for user in User.query} == {
+        "alice": 1,
+        "bob": 2,
+    }
+    stats = load_system_stats()
+    assert stats["urls"]["total"] == 3
+    assert stats["urls"]["permanent"] == 1
+    importing_app.extensions["event_bus"].publish.assert_any_call("urls_imported", 2)
+
+    staging_tables = db.session.execute(
+        text("SELECT COUNT(*) FROM pg_tables WHERE tablename LIKE 'url_import_%'")
+    ).scalar()
+    assert staging_tables == 0
+
+
+@pytest.mark.parametrize("on_conflict", ["regenerate", "skip"])
+def test_import_resolves_short_code_conflicts(importing_app, on_conflict):
+    """Test codes taken by existing URLs or earlier records in the file."""
+    records = [
+        {
+            "username": "alice",
+            "original_url": "https://1.example",
+            "short_code": "taken",
+        },
+        {"username": "alice", "original_url": "https://2.example", "short_code": "dup"},
+        {"username": "bob", "original_url": "https://3.example", "short_code": "dup"},
+        {"username": "bob", "original_url": "https://4.example"},
+    ]
+
+    summary = import_records(records, on_conflict=on_conflict)
+
+    codes = dict(db.session.execute(select(URL.original_url, URL.short_code)).all())
+    assert codes["https://existing.example"] == "taken"
+    assert codes["https://2.example"] == "dup"
+    assert "https://4.example" in codes
+    assert len(set(codes.values())) == len(codes)
+    if on_conflict == "regenerate":
+        assert summary["imported"] == 4
+        assert summary["regenerated_codes"] == 2
+        assert codes["https://1.example"] not in ("taken", "dup")
+    else:
+        assert summary["imported"] == 2
+        assert summary["skipped"] == 2
+        assert "https://1.example" not in codes
+    assert db.session.execute(select(func.count()).select_from(URL)).scalar() == (
+        summary["imported"] + 1
+    )
@@ -0,0 +1,162 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, insert, text
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.dedup import find_live_url
+from app.server.models import Admin, URL, User, url_digest
+from app.server.pagination import encode_cursor
+from app.server.reaper import expired_chunk
+from app.server.stats import READ_COUNTERS, expiry_bucket
+
+SORT_FIELDS = ["created_at", "expires_at", "click_count", "short_code"]
+# Tables that grow with usage; the counter tables stay small and are read whole
+LARGE_TABLES = {"urls", "users"}
+
+
+@pytest.fixture(scope="module")
+def client(pg_app):
+    """Seed users, an admin and URLs of every kind, then return a test client."""
+    now = datetime.now(timezone.utc)
+    db.session.add(Admin(username="admin", access_token="admin-token"))
+    users = [
+        User(username=f"user{i}", password="x", access_token=f"token{i}")
+        for i in range(20)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.execute(
+        insert(URL),
+        [
+            {
+                "original_url": f"https://{user.id}-{i}.example",
+                "short_code": f"c{user.id:02d}{i:03d}",
+                "user_id": user.id,
+                "created_at": now - timedelta(minutes=i),
+                "expires_at": None if i % 10 == 0 else now + timedelta(hours=i - 25),
+                "is_permanent": i % 10 == 0,
+                "click_count": i,
+            }
+            for user in users
+            for i in range(50)
+        ],
+    )
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return pg_app.test_client()
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def sequential_scans(statement, parameters):
+    """Large tables a statement reads with a sequential scan if it must"""
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plan = connection.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + statement, parameters
+        ).scalar()
+    return [
+        node["Relation Name"]
+        for node in plan_nodes(plan[0]["Plan"])
+        if node["Node Type"] == "Seq Scan" and node["Relation Name"] in LARGE_TABLES
+    ]
+
+
+def executed_statements(client, path, cookie):
+    """Statements a request runs, with their parameters"""
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        client.set_cookie("auth_token", cookie)
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+    assert response.status_code == 200
+    return statements
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", SORT_FIELDS)
+def test_my_urls_queries_use_indexes(client, sort_by, order):
+    """Test that listing a user's URLs in every sort order avoids table scans."""
+    cookie = generate_jwt("user3", "user", "token3")
+    path = f"/my-urls?sort_by={sort_by}&order={order}&page=2"
+    for statement, parameters in executed_statements(client, path, cookie):
+        assert sequential_scans(statement, parameters) == [], statement
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", SORT_FIELDS)
+def test_admin_url_queries_use_indexes(client, sort_by, order):
+    """Test that listing all URLs in every sort order avoids table scans."""
+    cookie = generate_jwt("admin", "admin", "admin-token")
+    path = f"/admin/urls?sort_by={sort_by}&order={order}&page=3"
+    for statement, parameters in executed_statements(client, path, cookie):
+        assert sequential_scans(statement, parameters) == [], statement
+
+
+@pytest.mark.parametrize("direction", ["next", "prev"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", ["expires_at", "click_count"])
+def test_cursor_pages_use_indexes(client, sort_by, order, direction):
+    """Test that cursor pages deep into both listings start with an index seek."""
+    value = {"expires_at": datetime.now(timezone.utc), "click_count": 25}[sort_by]
+    cursor = encode_cursor(sort_by, order, direction, value, 500)
+    query = f"sort_by={sort_by}&order={order}&cursor={cursor}"
+    for path, cookie in [
+        (f"/my-urls?{query}", generate_jwt("user3", "user", "token3")),
+        (f"/admin/urls?{query}", generate_jwt("admin", "admin", "admin-token")),
+    ]:
+        statements = executed_statements(client, path, cookie)
+        assert not any("OFFSET" in statement for statement, _ in statements)
+        assert not any("count(" in statement for statement, _ in statements)
+        for statement, parameters in statements:
+            assert sequential_scans(statement, parameters) == [], statement
+
+
+def test_admin_user_queries_use_indexes(client):
+    """Test that listing users avoids table scans."""
+    cookie = generate_jwt("admin", "admin", "admin-token")
+    for statement, parameters in executed_statements(client, "/admin/users", cookie):
+        assert sequential_scans(statement, parameters) == [], statement
+
+
+def test_expiry_queries_use_indexes(client):
+    """Test that the reaper and the statistics find expired URLs by index."""
+    now = datetime.now(timezone.utc)
+    last = (now - timedelta(hours=10), 1)
+    for statement, params in [
+        (expired_chunk(now, 1000), {}),
+        (expired_chunk(now, 1000, last), {}),
+        (READ_COUNTERS, {"now": now, "current_bucket": expiry_bucket(now)}),
+    ]:
+        compiled = statement.compile(db.engine)
+        parameters = compiled.construct_params(params)
+        assert sequential_scans(compiled.string, parameters) == [], compiled.string
+
+
+@pytest.mark.parametrize("is_permanent", [False, True])
+def test_deduplication_lookup_uses_index(client, is_permanent):
+    """Test that finding a user's live URL by digest avoids table scans."""
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        user_id = User.query.filter_by(username="user3").one().id
+        find_live_url(user_id, url_digest("https://example.com"), is_permanent)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+    for statement, parameters in statements:
+        assert sequential_scans(statement, parameters) == [], statement
@@ -0,0 +1,153 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from datetime import datetime, timedelta, timezone
+from app.server import db
+from app.server.cache import TTLCache
+from app.server.models import URL, User
+from app.server.pagination import (
+    InvalidCursor,
+    count_rows,
+    decode_cursor,
+    encode_cursor,
+    estimated_count,
+    keyset_paginate,
+)
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app with a SQLite database holding one user's URLs."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="alice", password="x")
+        db.session.add(user)
+        db.session.flush()
+        for i in range(11):
+            permanent = i % 4 == 0
+            db.session.add(
+                URL(
+                    original_url=f"https://{i}.example",
+                    short_code=f"code{i:02d}",
+                    user_id=user.id,
+                    is_permanent=permanent,
+                    expires_at=None if permanent else NOW + timedelta(days=i % 3),
+                    click_count=i % 3,
+                )
+            )
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def expected_order(sort_by, order):
+    """All URL ids sorted like PostgreSQL: NULLs last ascending, first descending"""
+    urls = URL.query.all()
+    present = sorted(
+        (url for url in urls if getattr(url, sort_by) is not None),
+        key=lambda url: (getattr(url, sort_by), url.id),
+    )
+    missing = sorted(
+        (url for url in urls if getattr(url, sort_by) is None), key=lambda url: url.id
+    )
+    ids = [url.id for url in present + missing]
+    return ids if order == "asc" else ids[::-1]
+
+
+def paginate(sort_by, order, cursor, per_page=3):
+    column = getattr(URL, sort_by)
+    return keyset_paginate(URL.query, column, URL.id, sort_by, order, cursor, per_page)
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", ["expires_at", "click_count", "short_code"])
+def test_walk_forward_and_back(app, sort_by, order):
+    """Test that next and prev cursors visit every row once, in sort order."""
+    pages = [paginate(sort_by, order, None)]
+    assert pages[0].prev_cursor is None
+    while pages[-1].next_cursor:
+        pages.append(paginate(sort_by, order, pages[-1].next_cursor))
+
+    forward = [url.id for page in pages for url in page.items]
+    assert forward == expected_order(sort_by, order)
+
+    backward = [[url.id for url in pages[-1].items]]
+    page = pages[-1]
+    while page.prev_cursor:
+        page = paginate(sort_by, order, page.prev_cursor)
+        backward.insert(0, [url.id for url in page.items])
+    assert backward == [[url.id for url in page.items] for page in pages]
+
+
+def test_last_page_has_no_next_cursor(app):
+    """Test that a page ending exactly at the last row has no next cursor."""
+    page = paginate("short_code", "asc", None, per_page=11)
+    assert len(page.items) == 11
+    assert page.next_cursor is None
+    assert page.prev_cursor is None
+
+
+def test_datetime_cursor_round_trip():
+    """Test that datetime sort values survive encoding."""
+    cursor = encode_cursor("expires_at", "desc", "next", NOW, 42)
+    assert decode_cursor(cursor, "expires_at", "desc", URL.expires_at) == (
+        "next",
+        NOW,
+        42,
+    )
+
+
+def test_cursor_of_another_sort_order_is_rejected():
+    """Test that a cursor cannot be reused with a different sort order."""
+    cursor = encode_cursor("click_count", "asc", "next", 3, 42)
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "click_count", "desc", URL.click_count)
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "W10", "WyJhIl0"])
+def test_malformed_cursor_is_rejected(cursor):
+    """Test that garbage cursors raise InvalidCursor rather than crashing."""
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "click_count", "asc", URL.click_count)
+
+
+@pytest.fixture
+def count_cache(app):
+    app.extensions["count_cache"] = TTLCache(maxsize=8, ttl=60)
+    return app.extensions["count_cache"]
+
+
+def test_exact_count(app, count_cache):
+    """Test that exact totals are counted on every call."""
+    assert count_rows(URL.query, "urls", "exact") == (11, False)
+    assert len(count_cache) == 0
+
+
+def test_cached_count(app, count_cache):
+    """Test that cached totals are counted once per cache TTL."""
+    assert count_rows(URL.query, "urls", "cached") == (11, True)
+    db.session.delete(URL.query.first())
+    db.session.commit()
+    assert count_rows(URL.query, "urls", "cached") == (11, True)
+    assert count_rows(URL.query, "urls", "exact") == (10, False)
+
+
+def test_estimated_count_falls_back_without_statistics(app, count_cache):
+    """Test that estimates fall back to a cached count without planner data."""
+    assert count_rows(URL.query, "urls", "estimated") == (11, True)
+    assert len(count_cache) == 1
+
+
+def test_estimated_count_reads_planner_statistics(pg_app):
+    """Test that PostgreSQL estimates come from pg_class after ANALYZE."""
+    db.session.add_all([User(username=f"user{i}", password="x") for i in range(7)])
+    db.session.commit()
+    db.session.execute(text("ANALYZE users"))
+    db.session.commit()
+    assert estimated_count("users") == 7
@@ -0,0 +1,260 @@
+import os
+import pytest
+from unittest.mock import MagicMock
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from app.server import db
+from app.server.archive import URLArchiver
+from app.server.cache import TTLCache
+from app.server.models import ArchivedURL, URL, User
+from app.server.pagination import estimated_count
+from app.server.partitions import (
+    PartitionManager,
+    add_months,
+    is_partition,
+    month_start,
+    partition_month,
+    partition_name,
+    partition_urls,
+    urls_partitioned,
+)
+from app.server.reaper import Reaper
+from app.server.shards import ShardRouter
+from app.server.stats import (
+    load_system_stats,
+    record_url_created,
+    scan_system_stats,
+    update_counters,
+)
+
+NOW = datetime(2025, 1, 15, 12, tzinfo=timezone.utc)
+
+
+def test_month_arithmetic():
+    """Test that months are counted in UTC and across year boundaries."""
+    month = month_start(
+        datetime(2024, 12, 31, 23, tzinfo=timezone(-timedelta(hours=2)))
+    )
+    assert month == datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert add_months(month, -1) == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert add_months(month, 14) == datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+def test_partition_names():
+    """Test that month partitions are named after their month."""
+    month = datetime(2025, 3, 1, tzinfo=timezone.utc)
+    assert partition_name(month) == "urls_p2025_03"
+    assert partition_month("urls_p2025_03") == month
+    assert partition_month("urls_permanent") is None
+    assert is_partition("urls_p2025_03")
+    assert is_partition("urls_default")
+    assert not is_partition("urls")
+    assert not is_partition("users")
+
+
+def test_sqlite_urls_is_not_partitioned():
+    """Test that the plain table is reported as such off PostgreSQL."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        with db.engine.connect() as connection:
+            assert not urls_partitioned(connection)
+
+
+@pytest.fixture
+def pg_app():
+    """Create a Flask app on a scratch PostgreSQL database with urls partitioned.
+
+    The partitions of January to March 2025 exist. Skipped unless
+    TEST_DATABASE_URL is set.
+    """
+    database_url = os.getenv("TEST_DATABASE_URL")
+    if not database_url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["REAPER_CHUNK_SIZE"] = 2
+    app.config["REAPER_TIME_BUDGET"] = 30
+    app.config["ARCHIVE_ENABLED"] = False
+    app.config["URL_SHARDS_REBALANCING"] = False
+    app.config["URL_PARTITION_MONTHS_AHEAD"] = 2
+    db.init_app(app)
+    ShardRouter(app)
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["event_bus"] = MagicMock()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as connection:
+            partition_urls(connection, 2, now=NOW)
+        yield app
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for name in ["urls_p2025_01", "urls_p2025_02", "urls_p2025_03"]:
+                connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+def add_urls(expires_at):
+    """Add one user with a URL per expiry, None for permanent, all counted."""
+    user = User(username="alice", password="x")
+    db.session.add(user)
+    db.session.flush()
+    update_counters(db.session, {"total_users": 1})
+    for i, expiry in enumerate(expires_at):
+        url = URL(
+            original_url=f"https://{i}.example",
+            short_code=f"code{i:02d}",
+            user_id=user.id,
+            expires_at=expiry,
+            is_permanent=expiry is None,
+            click_count=i,
+        )
+        db.session.add(url)
+        db.session.flush()
+        record_url_created(db.session, url)
+        update_counters(db.session, {"total_clicks": i})
+    db.session.commit()
+    return user
+
+
+def partitions_of_codes():
+    """The partition holding each URL, by short code"""
+    rows = db.session.execute(
+        text("SELECT short_code, tableoid::regclass::text FROM urls")
+    ).all()
+    # Attaching partitions waits for no transaction reading urls
+    db.session.commit()
+    return dict(rows)
+
+
+def test_urls_go_to_the_partition_of_their_expiry(pg_app):
+    """Test that URLs are stored by expiry month, permanent ones apart."""
+    add_urls(
+        [
+            None,
+            NOW + timedelta(days=1),
+            NOW + timedelta(days=40),
+            NOW + timedelta(days=400),
+        ]
+    )
+
+    with db.engine.connect() as connection:
+        assert urls_partitioned(connection)
+    assert partitions_of_codes() == {
+        "code00": "urls_permanent",
+        "code01": "urls_p2025_01",
+        "code02": "urls_p2025_02",
+        "code03": "urls_default",
+    }
+
+
+def test_short_codes_stay_unique_across_partitions(pg_app):
+    """Test that a code taken in another partition cannot be inserted again."""
+    user = add_urls([None])
+
+    db.session.add(
+        URL(
+            original_url="https://other.example",
+            short_code="code00",
+            user_id=user.id,
+            expires_at=NOW + timedelta(days=1),
+        )
+    )
+    with pytest.raises(IntegrityError):
+        db.session.flush()
+    db.session.rollback()
+
+
+def test_create_ahead_moves_urls_out_of_the_default_partition(pg_app):
+    """Test that a new partition takes the URLs of its month along."""
+    add_urls([NOW + timedelta(days=100)])
+    assert partitions_of_codes() == {"code00": "urls_default"}
+
+    manager = PartitionManager(pg_app)
+    manager.months_ahead = 4
+    summary = manager.create_ahead(now=NOW)
+
+    assert summary["created"] == ["primary.urls_p2025_04", "primary.urls_p2025_05"]
+    assert partitions_of_codes() == {"code00": "urls_p2025_04"}
+    assert manager.create_ahead(now=NOW)["created"] == []
+
+
+def test_reaper_drops_expired_partitions(pg_app):
+    """Test that months that are over are dropped whole and uncounted."""
+    user = add_urls(
+        [
+            NOW - timedelta(days=60),
+            NOW + timedelta(days=1),
+            NOW + timedelta(days=2),
+            NOW + timedelta(days=40),
+            None,
+        ]
+    )
+    now = datetime(2025, 2, 10, tzinfo=timezone.utc)
+
+    summary = Reaper(pg_app).run(now=now)
+
+    assert summary["dropped_partitions"] == ["urls_p2025_01"]
+    # Two from the partition, one too old for any from the default partition
+    assert summary["deleted_count"] == 3
+    assert summary["complete"]
+    assert partitions_of_codes() == {
+        "code03": "urls_p2025_02",
+        "code04": "urls_permanent",
+    }
+    assert load_system_stats(now) == scan_system_stats(now)
+    assert db.session.get(User, user.id).url_count == 2
+    pg_app.extensions["short_code_filter"].discard.assert_any_call(2)
+    with db.engine.connect() as connection:
+        assert not connection.execute(
+            text("SELECT to_regclass('urls_p2025_01')")
+        ).scalar()
+
+
+def test_reaper_drops_partitions_left_detached(pg_app):
+    """Test that a partition detached by an interrupted run is still dropped."""
+    add_urls([NOW + timedelta(days=1), None])
+    db.session.execute(text("ALTER TABLE urls DETACH PARTITION urls_p2025_01"))
+    db.session.commit()
+    now = datetime(2025, 2, 10, tzinfo=timezone.utc)
+
+    summary = Reaper(pg_app).run(now=now)
+
+    assert summary["dropped_partitions"] == ["urls_p2025_01"]
+    assert summary["deleted_count"] == 1
+    assert load_system_stats(now) == scan_system_stats(now)
+
+
+def test_reaper_archives_partitions_before_dropping_them(pg_app, tmp_path):
+    """Test that with archiving on, the URLs of a dropped partition are kept."""
+    add_urls([NOW + timedelta(days=1), NOW + timedelta(days=2), None])
+    pg_app.config.update(ARCHIVE_ENABLED=True, ARCHIVE_DIR=str(tmp_path))
+    pg_app.config.update(ARCHIVE_IDLE_DAYS=0, ARCHIVE_CHUNK_SIZE=1)
+    pg_app.config.update(ARCHIVE_TIME_BUDGET=30)
+    URLArchiver(pg_app)
+    now = datetime(2025, 2, 10, tzinfo=timezone.utc)
+
+    summary = Reaper(pg_app).run(now=now)
+
+    assert summary["dropped_partitions"] == ["urls_p2025_01"]
+    archived = db.session.query(ArchivedURL.short_code, ArchivedURL.reason).all()
+    assert sorted(archived) == [("code00", "expired"), ("code01", "expired")]
+    assert len(os.listdir(tmp_path)) == 1
+    assert load_system_stats(now) == scan_system_stats(now)
+
+
+def test_estimated_count_sums_partitions(pg_app):
+    """Test that the row estimate of urls adds up its analyzed partitions."""
+    add_urls([None, NOW + timedelta(days=1), NOW + timedelta(days=40)])
+    db.session.execute(text("ANALYZE urls"))
+    db.session.commit()
+
+    assert estimated_count("urls") == 3
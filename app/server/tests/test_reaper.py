@@ -0,0 +1,126 @@
+import pytest
+from unittest.mock import MagicMock
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from app.server import db
+from app.server.cache import TTLCache
+from app.server.models import URL, User
+from app.server.reaper import Reaper
+from app.server.redirects import RedirectEntry
+from app.server.shards import ShardRouter
+from app.server.stats import (
+    load_system_stats,
+    record_url_created,
+    scan_system_stats,
+    update_counters,
+)
+
+NOW = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app with a SQLite database and mocked event consumers."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["REAPER_CHUNK_SIZE"] = 2
+    app.config["REAPER_TIME_BUDGET"] = 30
+    app.config["ARCHIVE_ENABLED"] = False
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["event_bus"] = MagicMock()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def add_urls(expired, live=1):
+    """Add one user with the given number of expired and live URLs, counted."""
+    user = User(username="alice", password="x")
+    db.session.add(user)
+    db.session.flush()
+    update_counters(db.session, {"total_users": 1})
+    for i in range(expired + live):
+        url = URL(
+            original_url=f"https://{i}.example",
+            short_code=f"code{i:02d}",
+            user_id=user.id,
+            expires_at=NOW + timedelta(minutes=i - expired if i < expired else 60),
+        )
+        db.session.add(url)
+        db.session.flush()
+        record_url_created(db.session, url)
+    db.session.commit()
+
+
+def test_reaper_deletes_expired_urls_in_chunks(app):
+    """Test that a run deletes every expired URL, chunk by chunk."""
+    add_urls(expired=5)
+
+    summary = Reaper(app).run(now=NOW)
+
+    assert summary["deleted_count"] == 5
+    assert summary["chunks"] == 3
+    assert summary["complete"]
+    assert [url.short_code for url in URL.query.all()] == ["code05"]
+    assert load_system_stats(NOW) == scan_system_stats(NOW)
+    app.extensions["short_code_filter"].discard.assert_called_with(1)
+
+
+def test_reaper_resumes_after_time_budget(app):
+    """Test that a run stops at its time budget and the next run continues."""
+    add_urls(expired=5)
+    reaper = Reaper(app)
+
+    summary = reaper.run(time_budget=0, now=NOW)
+    assert summary["deleted_count"] == 2
+    assert not summary["complete"]
+    assert reaper._cursor is not None
+
+    summary = reaper.run(now=NOW)
+    assert summary["deleted_count"] == 3
+    assert summary["complete"]
+    assert reaper._cursor is None
+    assert URL.query.count() == 1
+
+
+def test_reaper_evicts_deleted_codes(app):
+    """Test that deleted short codes are evicted from the redirect cache."""
+    add_urls(expired=2)
+    cache = app.extensions["redirect_cache"]
+    entry = RedirectEntry("https://example.com", None, True)
+    for short_code in ["code00", "code01", "code02"]:
+        cache.set(short_code, entry)
+
+    Reaper(app).run(now=NOW)
+
+    assert cache.get("code00") is None
+    assert cache.get("code01") is None
+    assert cache.get("code02") == entry
+    app.extensions["event_bus"].publish.assert_called_once_with("urls_deleted", 2)
+
+
+def test_reaper_keeps_permanent_urls(app):
+    """Test that permanent URLs are never deleted."""
+    user = User(username="alice", password="x")
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(
+        URL(
+            original_url="https://example.com",
+            short_code="perm01",
+            user_id=user.id,
+            is_permanent=True,
+        )
+    )
+    db.session.commit()
+
+    summary = Reaper(app).run(now=NOW)
+
+    assert summary["deleted_count"] == 0
+    assert URL.query.count() == 1
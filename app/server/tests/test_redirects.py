@@ -0,0 +1,86 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from app.server.auth import generate_jwt
+from app.server.cache import TTLCache
+from app.server.redirects import RedirectEntry, cache_ttl_for, resolve_redirect
+from app.server.routes.admin import cleanup_expired_urls
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app context with a redirect cache for tests."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["short_code_filter"].might_exist.return_value = True
+    with app.app_context():
+        yield app
+
+
+def test_cache_ttl_for_permanent_link(app):
+    """Test that permanent links use the full cache TTL."""
+    entry = RedirectEntry("https://example.com", None, True)
+    assert cache_ttl_for(entry) == 300
+
+
+def test_cache_ttl_capped_at_expiry(app):
+    """Test that an entry never outlives the link's own expiry."""
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    entry = RedirectEntry("https://example.com", now + timedelta(seconds=42), False)
+    assert cache_ttl_for(entry, now) == 42
+
+
+def test_cache_ttl_for_distant_expiry(app):
+    """Test that links expiring later than the TTL use the full TTL."""
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    entry = RedirectEntry("https://example.com", now + timedelta(days=30), False)
+    assert cache_ttl_for(entry, now) == 300
+
+
+@patch("app.server.redirects.lookup_redirect")
+def test_resolve_redirect_caches_live_link(mock_lookup, app):
+    """Test that a live link is served from the cache on the second lookup."""
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    mock_lookup.return_value = RedirectEntry("https://example.com", expires_at, False)
+
+    assert resolve_redirect("abc123").original_url == "https://example.com"
+    assert resolve_redirect("abc123").original_url == "https://example.com"
+    mock_lookup.assert_called_once()
+
+
+@patch("app.server.redirects.lookup_redirect")
+def test_resolve_redirect_does_not_cache_expired_link(mock_lookup, app):
+    """Test that a link already past its expiry is not cached."""
+    expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    mock_lookup.return_value = RedirectEntry("https://example.com", expires_at, False)
+
+    resolve_redirect("abc123")
+    assert len(app.extensions["redirect_cache"]) == 0
+
+
+@patch("app.server.routes.admin.get_reaper")
+@patch("app.server.auth.Admin")
+def test_cleanup_runs_the_reaper(mock_admin, mock_get_reaper, app):
+    """Test that cleanup runs the reaper with the requested time budget."""
+    mock_admin.query.filter_by.return_value.first.return_value = MagicMock()
+    mock_get_reaper.return_value.run.return_value = {
+        "deleted_count": 2,
+        "chunks": 1,
+        "complete": True,
+        "cutoff": "2025-01-01T00:00:00+00:00",
+        "elapsed_seconds": 0.01,
+    }
+
+    with app.test_request_context(
+        "/admin/cleanup?time_budget=5",
+        headers={"Cookie": f'auth_token={generate_jwt("admin", "admin", "token")}'},
+    ):
+        response = cleanup_expired_urls()
+
+    mock_get_reaper.return_value.run.assert_called_once_with(time_budget=5.0)
+    assert response.json["deleted_count"] == 2
+    assert response.json["complete"] is True
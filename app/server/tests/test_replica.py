@@ -0,0 +1,163 @@
+import pytest
+from unittest.mock import MagicMock
+from flask import Flask
+from sqlalchemy import insert, select, text
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.cache import TTLCache
+from app.server.codes import CodeAllocator
+from app.server.models import URL, User
+from app.server.replica import (
+    READ_PRIMARY_COOKIE,
+    ReadReplica,
+    reading_from_replica,
+    replica_reads,
+)
+from app.server.routes.public import public_bp
+from app.server.routes.user import user_bp
+from app.server.shards import ShardRouter
+
+
+def add_url(connection, short_code, original_url):
+    connection.execute(
+        insert(URL),
+        {
+            "original_url": original_url,
+            "short_code": short_code,
+            "user_id": 1,
+            "is_permanent": True,
+            "click_count": 0,
+        },
+    )
+
+
+@pytest.fixture
+def app():
+    """Create an app whose primary and replica are two SQLite databases."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_BINDS"] = {"replica": "sqlite://"}
+    app.config["REPLICA_MAX_LAG"] = 5
+    app.config["SHORT_CODE_KEY"] = "testing-code-key"
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 100
+    app.config["SHORTEN_DEDUPLICATE"] = False
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ReadReplica(app)
+    ShardRouter(app)
+    CodeAllocator(app)
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["short_code_filter"].might_exist.return_value = True
+    app.extensions["click_aggregator"] = MagicMock()
+    app.extensions["event_bus"] = MagicMock()
+    app.register_blueprint(public_bp)
+    app.register_blueprint(user_bp)
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines["replica"])
+        for engine in db.engines.values():
+            with engine.begin() as connection:
+                connection.execute(
+                    insert(User),
+                    {"id": 1, "username": "alice", "password": "x", "url_count": 1},
+                )
+                connection.execute(
+                    text("UPDATE users SET access_token = 'token' WHERE id = 1")
+                )
+        with db.engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO short_code_allocation (id, next_value) VALUES (1, 1)")
+            )
+            add_url(connection, "both11", "https://primary.example")
+        with db.engines["replica"].begin() as connection:
+            add_url(connection, "both11", "https://replica.example")
+        yield app
+        db.session.remove()
+    # init_app registers a metadata per bind on the shared db; later apps
+    # without the replica bind would fail to create_all() it
+    db.metadatas.pop("replica", None)
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("alice", "user", "token"))
+    return client
+
+
+def test_redirects_read_from_the_replica(client):
+    """Test that redirect lookups go to the replica by default."""
+    response = client.get("/both11")
+    assert response.status_code == 302
+    assert response.location == "https://replica.example"
+
+
+def test_codes_missing_on_the_replica_are_looked_up_on_the_primary(app, client):
+    """Test that freshly created codes resolve despite replica lag."""
+    with db.engine.begin() as connection:
+        add_url(connection, "new111", "https://new.example")
+
+    assert client.get("/new111").location == "https://new.example"
+    assert client.get("/stats/new111").json["original_url"] == "https://new.example"
+    assert client.get("/nope11").status_code == 404
+
+
+def test_url_stats_read_from_the_replica(client):
+    """Test that /stats/<code> is served by the replica when it has the code."""
+    response = client.get("/stats/both11")
+    assert response.json["original_url"] == "https://replica.example"
+
+
+def test_clients_that_wrote_read_from_the_primary(client):
+    """Test read-your-writes: a write pins the client's reads to the primary."""
+    listed = client.get("/my-urls").json["urls"]
+    assert [url["original_url"] for url in listed] == ["https://replica.example"]
+    assert client.get_cookie(READ_PRIMARY_COOKIE) is None
+
+    response = client.post("/shorten", json={"url": "https://fresh.example"})
+    assert response.status_code == 201
+    assert client.get_cookie(READ_PRIMARY_COOKIE) is not None
+
+    listed = client.get("/my-urls").json["urls"]
+    assert {url["original_url"] for url in listed} == {
+        "https://primary.example",
+        "https://fresh.example",
+    }
+
+
+def test_writes_and_locking_reads_stay_on_the_primary(app):
+    """Test that only plain SELECTs are routed to the replica."""
+    with replica_reads():
+        assert reading_from_replica()
+        assert URL.query.one().original_url == "https://replica.example"
+        locked = db.session.execute(select(URL.original_url).with_for_update())
+        assert locked.scalar() == "https://primary.example"
+
+        db.session.add(
+            URL(original_url="https://w.example", short_code="w11111", user_id=1)
+        )
+        db.session.commit()
+        assert db.session.info["wrote"]
+    assert not reading_from_replica()
+
+    with db.engine.connect() as connection:
+        stored = connection.execute(text("SELECT COUNT(*) FROM urls")).scalar()
+    with db.engines["replica"].connect() as connection:
+        replicated = connection.execute(text("SELECT COUNT(*) FROM urls")).scalar()
+    assert (stored, replicated) == (2, 1)
+
+
+def test_without_a_replica_everything_reads_from_the_primary(app):
+    """Test that replica reads are a no-op when no replica bind is configured."""
+    engines = dict(db.engines)
+    del db.engines["replica"]
+    try:
+        with replica_reads():
+            assert not reading_from_replica()
+            assert URL.query.one().original_url == "https://primary.example"
+    finally:
+        db.engines.update(engines)
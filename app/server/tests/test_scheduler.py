@@ -0,0 +1,75 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from flask import Flask
+from app.server.scheduler import Scheduler
+
+
+@pytest.fixture
+def scheduler():
+    """Create a scheduler with one job bound to a minimal Flask app."""
+    app = Flask(__name__)
+    app.config["SCHEDULER_ENABLED"] = True
+    scheduler = Scheduler()
+    scheduler.app = app
+    scheduler.enabled = True
+    scheduler.job = MagicMock(return_value={"repaired": 0})
+    scheduler.add_job("reconcile", scheduler.job, 60)
+    return scheduler
+
+
+def mock_connection(mock_db, locked=True, claimed=True):
+    """Make the advisory lock and the job claim succeed or fail."""
+    connection = mock_db.engine.connect.return_value
+    results = [
+        MagicMock(**{"scalar.return_value": locked}),
+        MagicMock(**{"first.return_value": ("reconcile",) if claimed else None}),
+        MagicMock(),
+    ]
+    connection.execute.side_effect = results
+    return connection
+
+
+@patch("app.server.scheduler.db")
+def test_job_runs_when_due(mock_db, scheduler):
+    """Test that a due job runs once and the lock is released."""
+    connection = mock_connection(mock_db)
+
+    assert scheduler.run_job("reconcile")
+
+    scheduler.job.assert_called_once()
+    assert connection.execute.call_count == 3
+    assert "pg_advisory_unlock" in str(connection.execute.call_args_list[2][0][0])
+    stats = scheduler.stats()["jobs"]["reconcile"]
+    assert stats["runs"] == 1
+    assert stats["last_result"] == {"repaired": 0}
+
+
+@patch("app.server.scheduler.db")
+def test_job_skipped_while_another_worker_runs_it(mock_db, scheduler):
+    """Test that a job is not run when the advisory lock is taken."""
+    connection = mock_connection(mock_db, locked=False)
+
+    assert not scheduler.run_job("reconcile")
+
+    scheduler.job.assert_not_called()
+    assert connection.execute.call_count == 1
+
+
+@patch("app.server.scheduler.db")
+def test_job_skipped_when_run_recently(mock_db, scheduler):
+    """Test that a job another worker ran within the interval is skipped."""
+    mock_connection(mock_db, claimed=False)
+    assert not scheduler.run_job("reconcile")
+    scheduler.job.assert_not_called()
+
+
+@patch("app.server.scheduler.db")
+def test_failing_job_is_counted(mock_db, scheduler):
+    """Test that job errors are recorded instead of killing the scheduler."""
+    connection = mock_connection(mock_db)
+    scheduler.job.side_effect = RuntimeError("boom")
+
+    assert scheduler.run_job("reconcile")
+
+    assert scheduler.stats()["jobs"]["reconcile"]["failures"] == 1
+    assert "pg_advisory_unlock" in str(connection.execute.call_args_list[2][0][0])
@@ -0,0 +1,444 @@
+import json
+import os
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from sqlalchemy import func, insert, select, text
+from app.server import db
+from app.server.auth import generate_jwt
+from app.server.cache import TTLCache
+from app.server.clicks import ClickAggregator
+from app.server.codes import CodeAllocator
+from app.server.models import Admin, URL, User
+from app.server.pagination import ShardedPagination, sort_key
+from app.server.reaper import Reaper
+from app.server.rebalance import Rebalancer
+from app.server.routes.admin import admin_bp
+from app.server.routes.public import public_bp
+from app.server.routes.user import user_bp
+from app.server.shards import (
+    ShardRouter,
+    create_shard_tables,
+    get_shard_router,
+    on_shard,
+)
+from app.server.stats import (
+    load_system_stats,
+    reconcile_counters,
+    reconcile_user_url_counts,
+    record_urls_created,
+    scan_system_stats,
+    update_counters,
+)
+
+SHARDS = ["url_shard_1", "url_shard_2"]
+NOW = datetime.now(timezone.utc)
+
+
+def make_router(shard_count, rebalancing=False):
+    """Create a shard router over the primary and shard_count shards."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_BINDS"] = {
+        f"url_shard_{n}": "sqlite://" for n in range(1, shard_count + 1)
+    }
+    app.config["URL_SHARDS_REBALANCING"] = rebalancing
+    return ShardRouter(app)
+
+
+@pytest.fixture
+def app():
+    """Create an app whose urls are spread over three SQLite databases."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "testing-key"
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_BINDS"] = {shard: "sqlite://" for shard in SHARDS}
+    app.config["URL_SHARDS_REBALANCING"] = False
+    app.config["SHORT_CODE_KEY"] = "testing-code-key"
+    app.config["SHORT_CODE_LENGTH"] = 6
+    app.config["SHORT_CODE_BLOCK_SIZE"] = 100
+    app.config["SHORTEN_DEDUPLICATE"] = False
+    app.config["ADMIN_COUNT_STRATEGY"] = "exact"
+    app.config["REAPER_CHUNK_SIZE"] = 2
+    app.config["REAPER_TIME_BUDGET"] = 30
+    app.config["ARCHIVE_ENABLED"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    CodeAllocator(app)
+    Reaper(app)
+    app.extensions["count_cache"] = TTLCache(maxsize=8, ttl=60)
+    app.extensions["redirect_cache"] = TTLCache(maxsize=100, ttl=300)
+    app.extensions["short_code_filter"] = MagicMock()
+    app.extensions["short_code_filter"].might_exist.return_value = True
+    app.extensions["click_aggregator"] = MagicMock()
+    app.extensions["event_bus"] = MagicMock()
+    app.register_blueprint(public_bp)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    with app.app_context():
+        db.create_all()
+        for shard in SHARDS:
+            assert create_shard_tables(db.engines[shard])
+        db.session.execute(
+            text("INSERT INTO short_code_allocation (id, next_value) VALUES (1, 1)")
+        )
+        db.session.add(Admin(username="admin", access_token="admin-token"))
+        db.session.add(User(username="alice", password="x", access_token="token"))
+        db.session.commit()
+        update_counters(db.session, {"total_users": 1})
+        db.session.commit()
+        yield app
+        db.session.remove()
+    # init_app registers a metadata per bind on the shared db; later apps
+    # without these binds would fail to create_all() them
+    for shard in SHARDS:
+        db.metadatas.pop(shard, None)
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("alice", "user", "token"))
+    return client
+
+
+def add_urls(count, on_primary=False, expires_in=timedelta(days=30), permanent=False):
+    """Add count URLs of alice, counted, on their shards or all on the primary."""
+    router = get_shard_router()
+    created = []
+    for i in range(count):
+        short_code = f"code{i:02d}"
+        shard = None if on_primary else router.shard_for(short_code)
+        with on_shard(shard):
+            row = db.session.execute(
+                insert(URL)
+                .values(
+                    original_url=f"https://{i}.example",
+                    short_code=short_code,
+                    user_id=1,
+                    created_at=NOW - timedelta(minutes=count - i),
+                    expires_at=None if permanent else NOW + expires_in,
+                    is_permanent=permanent,
+                    click_count=i,
+                )
+                .returning(URL.user_id, URL.is_permanent, URL.expires_at)
+            ).one()
+        created.append(row)
+    record_urls_created(db.session, created)
+    update_counters(db.session, {"total_clicks": sum(range(count))})
+    db.session.commit()
+
+
+def codes_on(shard):
+    """Short codes stored on shard, None for the primary."""
+    with db.engines[shard].connect() as connection:
+        return set(connection.execute(select(URL.short_code)).scalars())
+
+
+def test_shard_for_spreads_codes_and_moves_few_when_adding_a_shard():
+    """Test rendezvous hashing: stable, balanced, and minimal movement."""
+    codes = [f"c{i:05d}" for i in range(3000)]
+    three, four = make_router(2), make_router(3)
+    before = {code: three.shard_for(code) for code in codes}
+    after = {code: four.shard_for(code) for code in codes}
+
+    assert before == {code: make_router(2).shard_for(code) for code in codes}
+    assert all(
+        600 < list(before.values()).count(shard) < 1400 for shard in three.shards
+    )
+    moved = [code for code in codes if before[code] != after[code]]
+    assert {after[code] for code in moved} == {"url_shard_3"}
+    assert 450 < len(moved) < 1050
+
+
+def test_single_database_has_one_shard():
+    """Test that without shard binds everything stays on the primary."""
+    router = make_router(0)
+    assert not router.sharded
+    assert router.shard_for("abc123") is None
+    assert router.fallbacks(None) == []
+
+
+def test_shorten_stores_urls_on_their_shard(app, client):
+    """Test that new URLs land on their shard and resolve from it."""
+    codes = []
+    for i in range(12):
+        response = client.post(
+            "/shorten", json={"url": f"https://{i}.example", "permanent": True}
+        )
+        assert response.status_code == 201
+        assert response.json["original_url"] == f"https://{i}.example"
+        codes.append(response.json["short_code"])
+
+    router = get_shard_router()
+    for shard in router.shards:
+        assert codes_on(shard) == {c for c in codes if router.shard_for(c) == shard}
+    assert all(codes_on(shard) for shard in router.shards)
+
+    for i, short_code in enumerate(codes):
+        assert client.get(f"/{short_code}").location == f"https://{i}.example"
+        stats = client.get(f"/stats/{short_code}").json
+        assert stats["original_url"] == f"https://{i}.example"
+    assert db.session.get(User, 1).url_count == 12
+
+
+def test_my_urls_pages_merge_all_shards(app, client):
+    """Test that offset and cursor pages list URLs of every shard in order."""
+    add_urls(9)
+    expected = [f"code{i:02d}" for i in reversed(range(9))]
+
+    listed = []
+    for page in range(1, 4):
+        response = client.get(f"/my-urls?page={page}&per_page=4")
+        listed += [url["short_code"] for url in response.json["urls"]]
+        assert response.json["pagination"]["total"] == 9
+    assert listed == expected
+
+    listed, cursor = [], ""
+    while cursor is not None:
+        page = client.get(f"/my-urls?cursor={cursor}&per_page=4").json
+        listed += [url["short_code"] for url in page["urls"]]
+        cursor = page["pagination"]["next_cursor"]
+    assert listed == expected
+
+    previous = client.get(f"/my-urls?cursor={page['pagination']['prev_cursor']}")
+    assert [url["short_code"] for url in previous.json["urls"]] == expected[:8]
+
+
+def test_sharded_pagination_counts_every_shard(app):
+    """Test that an offset page asked for its total sums the shards' counts."""
+    add_urls(9)
+    page = ShardedPagination(
+        page=2,
+        per_page=4,
+        max_per_page=None,
+        error_out=False,
+        count=True,
+        # Plain rows, since ids repeat across shards
+        query=db.session.query(URL.short_code).order_by(URL.short_code.asc()),
+        shards=get_shard_router().shards,
+        key=sort_key("short_code", "short_code"),
+        reverse=False,
+    )
+    assert page.total == 9
+    assert page.pages == 3
+    assert [url.short_code for url in page.items] == [
+        f"code{i:02d}" for i in range(4, 8)
+    ]
+
+
+def test_admin_listing_and_export_cover_all_shards(app):
+    """Test admin URL listings and exports across shards with usernames."""
+    add_urls(7)
+    client = app.test_client()
+    client.set_cookie("auth_token", generate_jwt("admin", "admin", "admin-token"))
+
+    response = client.get("/admin/urls?per_page=5&sort_by=click_count&order=asc")
+    assert [url["short_code"] for url in response.json["urls"]] == [
+        f"code{i:02d}" for i in range(5)
+    ]
+    assert response.json["urls"][0]["user"] == {"username": "alice"}
+    assert response.json["pagination"]["total"] == 7
+
+    page = client.get("/admin/urls?cursor=&per_page=5&sort_by=short_code").json
+    assert len(page["urls"]) == 5
+    assert page["pagination"]["has_next"]
+
+    response = client.get("/admin/export")
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert sorted(row["short_code"] for row in rows) == [
+        f"code{i:02d}" for i in range(7)
+    ]
+    assert {row["user"]["username"] for row in rows} == {"alice"}
+    assert client.get("/admin/export?after_id=3").status_code == 400
+    assert get_shard_router().stats()["shards"] == ["primary"] + SHARDS
+
+
+def test_reaper_deletes_expired_urls_on_every_shard(app):
+    """Test that one reaper pass covers all shards and keeps the counters."""
+    add_urls(9, expires_in=timedelta(days=-1))
+
+    summary = app.extensions["reaper"].run()
+
+    assert summary["complete"]
+    assert summary["deleted_count"] == 9
+    assert not any(codes_on(shard) for shard in get_shard_router().shards)
+    assert load_system_stats()["urls"]["total"] == 0
+    assert db.session.get(User, 1).url_count == 0
+
+
+def test_system_stats_add_up_all_shards(app):
+    """Test that counted and scanned statistics agree across shards."""
+    add_urls(6)
+
+    stats = scan_system_stats(NOW)
+    assert stats["urls"]["total"] == 6
+    assert stats["clicks"]["total"] == sum(range(6))
+    assert stats["users"] == {"total": 1, "active": 1}
+    assert load_system_stats(NOW) == stats
+
+
+def test_rebalance_moves_urls_to_their_shard(app):
+    """Test that URLs stored before sharding move and stay reachable."""
+    add_urls(10, on_primary=True, permanent=True)
+    router = get_shard_router()
+    misplaced = {c for c in codes_on(None) if router.shard_for(c) is not None}
+    assert misplaced
+
+    dry_run = Rebalancer(dry_run=True).run()
+    assert dry_run["misplaced"] == len(misplaced)
+    assert dry_run["moved"] == 0
+
+    router.rebalancing = True
+    client = app.test_client()
+    short_code = sorted(misplaced)[0]
+    assert client.get(f"/{short_code}").status_code == 302
+
+    summary = Rebalancer(chunk_size=3).run()
+    assert summary["moved"] == len(misplaced)
+    assert summary["conflicts"] == 0
+    for shard in router.shards:
+        assert codes_on(shard) == {
+            f"code{i:02d}"
+            for i in range(10)
+            if router.shard_for(f"code{i:02d}") == shard
+        }
+    assert scan_system_stats(NOW)["clicks"]["total"] == sum(range(10))
+    assert Rebalancer().run()["misplaced"] == 0
+
+    router.rebalancing = False
+    app.extensions["redirect_cache"].clear()
+    assert client.get(f"/{short_code}").status_code == 302
+
+
+def test_rebalance_finishes_interrupted_moves(app):
+    """Test that copies of an interrupted run are recognized, conflicts kept."""
+    add_urls(10, on_primary=True)
+    router = get_shard_router()
+    copied, taken = [
+        f"code{i:02d}"
+        for i in range(10)
+        if router.shard_for(f"code{i:02d}") == "url_shard_1"
+    ][:2]
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            select(URL).where(URL.short_code.in_([copied, taken]))
+        ).all()
+    values = {
+        row.short_code: {
+            key: value for key, value in row._asdict().items() if key != "id"
+        }
+        for row in rows
+    }
+    with db.engines["url_shard_1"].begin() as connection:
+        connection.execute(insert(URL), values[copied])
+        connection.execute(
+            insert(URL), dict(values[taken], original_url="https://other.example")
+        )
+
+    summary = Rebalancer().run()
+
+    assert summary["conflicts"] == 1
+    assert summary["conflicts_sample"] == [
+        {"short_code": taken, "shard": "url_shard_1"}
+    ]
+    assert copied not in codes_on(None)
+    assert taken in codes_on(None)
+    with db.engines["url_shard_1"].connect() as connection:
+        stored = connection.execute(
+            select(func.count()).where(URL.short_code == copied)
+        ).scalar()
+    assert stored == 1
+
+
+@pytest.fixture
+def pg_sharded_app():
+    """Create an app on a scratch PostgreSQL database and two shard databases.
+
+    Skipped unless TEST_DATABASE_URL and TEST_SHARD_DATABASE_URLS, a comma
+    separated pair of further scratch databases, are set.
+    """
+    database_url = os.getenv("TEST_DATABASE_URL")
+    shard_urls = os.getenv("TEST_SHARD_DATABASE_URLS", "").split(",")
+    if not database_url or len(shard_urls) != 2:
+        pytest.skip("TEST_DATABASE_URL or TEST_SHARD_DATABASE_URLS is not set")
+
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_BINDS"] = dict(zip(SHARDS, shard_urls))
+    app.config["URL_SHARDS_REBALANCING"] = False
+    app.config["CLICK_FLUSH_INTERVAL"] = 3600
+    app.config["CLICK_FLUSH_MAX_PENDING"] = 1000
+    db.init_app(app)
+    ShardRouter(app)
+    with patch("app.server.clicks.atexit"):
+        ClickAggregator(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for shard in SHARDS:
+            with db.engines[shard].begin() as connection:
+                connection.execute(text("DROP TABLE IF EXISTS urls"))
+            create_shard_tables(db.engines[shard])
+        db.session.add(User(username="alice", password="x"))
+        update_counters(db.session, {"total_users": 1})
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    for shard in SHARDS:
+        db.metadatas.pop(shard, None)
+
+
+def test_clicks_are_flushed_to_every_shard(pg_sharded_app):
+    """Test that buffered clicks reach the shard of each code."""
+    add_urls(6, permanent=True)
+    aggregator = pg_sharded_app.extensions["click_aggregator"]
+    aggregator._ensure_flusher = lambda: None
+    for i in range(6):
+        for _ in range(i + 1):
+            aggregator.record(f"code{i:02d}")
+
+    assert aggregator.flush() == 21
+
+    router = get_shard_router()
+    for i in range(6):
+        with db.engines[router.shard_for(f"code{i:02d}")].connect() as connection:
+            click_count = connection.execute(
+                select(URL.click_count).where(URL.short_code == f"code{i:02d}")
+            ).scalar()
+        assert click_count == 2 * i + 1
+    assert load_system_stats()["clicks"]["total"] == sum(range(6)) + 21
+
+
+def test_clicks_on_urls_not_moved_yet_are_kept(pg_sharded_app):
+    """Test that while rebalancing clicks also reach rows left on the primary."""
+    add_urls(6, on_primary=True, permanent=True)
+    router = get_shard_router()
+    router.rebalancing = True
+    aggregator = pg_sharded_app.extensions["click_aggregator"]
+    aggregator._ensure_flusher = lambda: None
+    for i in range(6):
+        aggregator.record(f"code{i:02d}")
+
+    assert aggregator.flush() == 6
+    assert scan_system_stats()["clicks"]["total"] == sum(range(6)) + 6
+
+
+def test_reconcile_counts_urls_of_every_shard(pg_sharded_app):
+    """Test that reconciliation rebuilds counters from all shards."""
+    add_urls(8)
+    assert not any(reconcile_counters(NOW).values())
+
+    db.session.execute(text("DELETE FROM stat_counters"))
+    db.session.execute(text("DELETE FROM url_expiry_buckets"))
+    db.session.execute(text("UPDATE users SET url_count = 0"))
+    db.session.commit()
+
+    assert reconcile_counters(NOW)["total_urls"] == 8
+    assert reconcile_user_url_counts() == 1
+    assert load_system_stats(NOW) == scan_system_stats(NOW)
+    assert load_system_stats(NOW + timedelta(days=31))["urls"]["expired"] == 8
+    assert db.session.get(User, 1).url_count == 8
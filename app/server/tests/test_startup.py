@@ -0,0 +1,57 @@
+import os
+import pytest
+from flask import Flask
+from flask_migrate import Migrate
+from sqlalchemy import text
+from app.server import db
+from app.server.schema import head_revisions, schema_at_head
+from app.server.startup import StartupTimer
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), "..", "..", "..", "migrations")
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app on SQLite with the repository's migrations."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS)
+    with app.app_context():
+        yield app
+
+
+def test_startup_timer_times_the_first_request_only(app):
+    """Test that the factory and the first request are timed once."""
+    timer = StartupTimer(app, import_seconds=0.5)
+    app.add_url_rule("/", "index", lambda: "ok")
+    timer.factory_done()
+    client = app.test_client()
+
+    client.get("/")
+    first = timer.first_request_seconds
+    client.get("/")
+
+    assert first is not None
+    assert timer.first_request_seconds == first
+    stats = timer.stats()
+    assert stats["import_seconds"] == 0.5
+    assert stats["factory_seconds"] is not None
+    assert not stats["preloaded"]
+
+
+def test_schema_at_head(app):
+    """Test that a database is at head once stamped with the last revision."""
+    (head,) = head_revisions()
+    assert not schema_at_head()
+
+    with db.engine.begin() as connection:
+        connection.execute(text("CREATE TABLE alembic_version (version_num TEXT)"))
+        connection.execute(text("INSERT INTO alembic_version VALUES ('a7e3c9d41b52')"))
+    assert not schema_at_head()
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            text("UPDATE alembic_version SET version_num = :head"), {"head": head}
+        )
+    assert schema_at_head()
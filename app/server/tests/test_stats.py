@@ -0,0 +1,201 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from app.server import db
+from app.server.cache import TTLCache
+from app.server.models import URL, User
+from app.server.shards import ShardRouter
+from app.server.stats import (
+    cached_system_stats,
+    expiry_bucket,
+    load_system_stats,
+    record_url_created,
+    record_urls_deleted,
+    reconcile_user_url_counts,
+    scan_system_stats,
+    update_counters,
+)
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app backed by an in-memory SQLite database."""
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["URL_SHARDS_REBALANCING"] = False
+    db.init_app(app)
+    ShardRouter(app)
+    app.extensions["stats_cache"] = TTLCache(maxsize=8, ttl=30)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def add_urls(now):
+    """Add three users and a permanent, a live and an expired URL, counted."""
+    alice = User(username="alice", password="x")
+    bob = User(username="bob", password="x")
+    db.session.add_all([alice, bob, User(username="carol", password="x")])
+    db.session.flush()
+    update_counters(db.session, {"total_users": 3})
+    urls = [
+            URL(
+                original_url="https://a.example",
+                short_code="perm01",
+                user_id=alice.id,
+                is_permanent=True,
+                click_count=5,
+            ),
+            URL(
+                original_url="https://b.example",
+                short_code="live01",
+                user_id=alice.id,
+                expires_at=now + timedelta(days=1),
+                click_count=3,
+            ),
+            URL(
+                original_url="https://c.example",
+                short_code="gone01",
+                user_id=bob.id,
+                expires_at=now - timedelta(days=1),
+                click_count=2,
+            ),
+        ]
+    for url in urls:
+        db.session.add(url)
+        db.session.flush()
+        record_url_created(db.session, url)
+    update_counters(db.session, {"total_clicks": 10})
+    db.session.commit()
+    return urls
+
+
+@pytest.mark.parametrize("stats_function", [scan_system_stats, load_system_stats])
+def test_system_stats(app, stats_function):
+    """Test that the scan and the counters report the same dashboard numbers."""
+    now = datetime.now(timezone.utc)
+    add_urls(now)
+
+    stats = stats_function(now)
+
+    assert stats["urls"] == {"total": 3, "active": 2, "expired": 1, "permanent": 1}
+    assert stats["clicks"] == {"total": 10}
+    assert stats["users"] == {"total": 3, "active": 2}
+    assert stats["generated_at"] == now
+
+
+@pytest.mark.parametrize("stats_function", [scan_system_stats, load_system_stats])
+def test_system_stats_empty(app, stats_function):
+    """Test that an empty database reports zeros rather than nulls."""
+    stats = stats_function()
+    assert stats["urls"]["total"] == 0
+    assert stats["clicks"]["total"] == 0
+
+
+def test_expiry_bucket():
+    """Test that expiry times are floored to the hour in UTC."""
+    expires_at = datetime(2025, 1, 1, 14, 35, 10, tzinfo=timezone(timedelta(hours=2)))
+    assert expiry_bucket(expires_at) == datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    assert expiry_bucket(datetime(2025, 1, 1, 12, 59)) == datetime(
+        2025, 1, 1, 12, tzinfo=timezone.utc
+    )
+
+
+def test_counters_follow_expiry_within_the_hour(app):
+    """Test that URLs expiring in the current hour move from active to expired."""
+    now = datetime(2025, 1, 1, 12, 30, tzinfo=timezone.utc)
+    add_urls(now)
+    url = URL(
+        original_url="https://d.example",
+        short_code="soon01",
+        user_id=1,
+        expires_at=now + timedelta(minutes=10),
+    )
+    db.session.add(url)
+    db.session.flush()
+    record_url_created(db.session, url)
+    db.session.commit()
+
+    assert load_system_stats(now)["urls"]["active"] == 3
+    later = now + timedelta(minutes=20)
+    assert load_system_stats(later)["urls"] == scan_system_stats(later)["urls"]
+    assert load_system_stats(later)["urls"]["expired"] == 2
+
+
+def test_counters_after_delete(app):
+    """Test that deleting URLs uncounts them and users left without URLs."""
+    now = datetime.now(timezone.utc)
+    urls = add_urls(now)
+
+    expired = [url for url in urls if url.short_code == "gone01"]
+    for url in expired:
+        db.session.delete(url)
+    db.session.flush()
+    record_urls_deleted(db.session, expired)
+    db.session.commit()
+
+    stats = load_system_stats(now)
+    assert stats == scan_system_stats(now)
+    assert stats["users"]["active"] == 1
+    assert stats["clicks"]["total"] == 8
+
+
+def url_counts():
+    return dict(db.session.query(User.username, User.url_count).all())
+
+
+def test_user_url_counts(app):
+    """Test that every user's URL count follows inserts and deletes."""
+    now = datetime.now(timezone.utc)
+    urls = add_urls(now)
+    assert url_counts() == {"alice": 2, "bob": 1, "carol": 0}
+
+    expired = [url for url in urls if url.user.username != "carol"]
+    for url in expired:
+        db.session.delete(url)
+    db.session.flush()
+    record_urls_deleted(db.session, expired)
+    db.session.commit()
+
+    assert url_counts() == {"alice": 0, "bob": 0, "carol": 0}
+    assert load_system_stats(now)["users"]["active"] == 0
+
+
+def test_counters_are_sharded(app):
+    """Test that a counter is the sum of its shards."""
+    with patch("app.server.stats.random.randrange", side_effect=[0, 1, 1]):
+        update_counters(db.session, {"total_users": 2})
+        update_counters(db.session, {"total_users": 3})
+        update_counters(db.session, {"total_users": -1})
+    db.session.commit()
+
+    rows = db.session.execute(
+        db.text("SELECT shard, value FROM stat_counters ORDER BY shard")
+    ).all()
+    assert [tuple(row) for row in rows] == [(0, 2), (1, 2)]
+    assert load_system_stats()["users"]["total"] == 4
+
+
+def test_cached_system_stats(app):
+    """Test that dashboard statistics are computed once per cache TTL."""
+    with patch(
+        "app.server.stats.load_system_stats", return_value={"urls": {}}
+    ) as mock_load:
+        cached_system_stats()
+        cached_system_stats()
+    mock_load.assert_called_once()
+
+
+def test_reconcile_user_url_counts(app):
+    """Test that drifted per-user URL counts are recounted from urls."""
+    add_urls(datetime.now(timezone.utc))
+    User.query.filter_by(username="alice").update({"url_count": 7})
+    User.query.filter_by(username="carol").update({"url_count": -1})
+    db.session.commit()
+
+    assert reconcile_user_url_counts(batch_size=2) == 2
+    assert url_counts() == {"alice": 2, "bob": 1, "carol": 0}
+    assert reconcile_user_url_counts() == 0
@@ -1,30 +1,12 @@
 import secrets
 import string
-import os
-from app.server.models import URL
+import validators
+from app.server.codes import get_code_allocator
 
 
 def generate_short_code(length=None):
-    """Generate a random short code for URLs"""
-    if length is None:
-        length = int(os.getenv("SHORT_CODE_LENGTH", 6))
-
-    # Use base62 characters (a-z, A-Z, 0-9)
-    characters = string.ascii_letters + string.digits
-
-    # Generate codes until we find one that doesn't exist
-    max_attempts = 100
-    for _ in range(max_attempts):
-        short_code = "".join(secrets.choice(characters) for _ in range(length))
-
-        # Check if this code already exists
-        if not URL.query.filter_by(short_code=short_code).first():
-            return short_code
-
-    # If we couldn't generate a unique code after max_attempts, raise an error
-    raise Exception(
-        f"Could not generate unique short code after {max_attempts} attempts"
-    )
+    """Allocate a unique short code for URLs"""
+    return get_code_allocator().allocate(length)
 
 
 def generate_access_token(length=64):
@@ -36,8 +18,6 @@ def generate_access_token(length=64):
 
 def is_valid_url(url):
     """Basic URL validation"""
-    import validators
-
     return validators.url(url)
 
 
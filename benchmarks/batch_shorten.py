@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Throughput of POST /shorten, one URL per request, versus POST /shorten/batch.
+Usage: python benchmarks/batch_shorten.py [--links <n>] [--batch-size <n>]
+
+Runs the application in-process against DATABASE_URL with SECRET_KEY set,
+as for the server itself. Use a scratch PostgreSQL database; the user and
+links the benchmark creates are removed afterwards.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.server import create_app, db
+from app.server.auth import generate_jwt
+from app.server.models import URL, User
+from app.server.stats import record_urls_deleted
+
+BENCH_USERNAME = "batch-shorten-benchmark"
+
+
+def cleanup():
+    user = User.query.filter_by(username=BENCH_USERNAME).first()
+    if user:
+        urls = URL.query.filter_by(user_id=user.id).all()
+        for url in urls:
+            db.session.delete(url)
+        db.session.flush()
+        record_urls_deleted(db.session, urls)
+        db.session.delete(user)
+        db.session.commit()
+
+
+def single(client, links):
+    for i in range(links):
+        response = client.post("/shorten", json={"url": f"https://example.com/s/{i}"})
+        assert response.status_code == 201, response.json
+
+
+def batch(client, links, batch_size):
+    for start in range(0, links, batch_size):
+        urls = [
+            f"https://example.com/b/{i}"
+            for i in range(start, min(start + batch_size, links))
+        ]
+        response = client.post("/shorten/batch", json={"urls": urls})
+        assert response.status_code == 201, response.json
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch shortening")
+    parser.add_argument("--links", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") or not os.getenv("SECRET_KEY"):
+        print("Error: set DATABASE_URL and SECRET_KEY")
+        sys.exit(1)
+
+    app = create_app()
+    with app.app_context():
+        cleanup()
+        db.session.add(
+            User(username=BENCH_USERNAME, password="x", access_token="benchmark")
+        )
+        db.session.commit()
+        cookie = generate_jwt(BENCH_USERNAME, "user", "benchmark")
+
+    client = app.test_client()
+    client.set_cookie("auth_token", cookie)
+    try:
+        print(f"{'endpoint':<32}{'links':>8}{'seconds':>10}{'links/s':>10}")
+        for name, run in [
+            ("POST /shorten", lambda: single(client, args.links)),
+            (
+                f"POST /shorten/batch ({args.batch_size})",
+                lambda: batch(client, args.links, args.batch_size),
+            ),
+        ]:
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name:<32}{args.links:>8}{elapsed:>10.2f}{args.links / elapsed:>10.0f}"
+            )
+    finally:
+        with app.app_context():
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Cold start of the container command: seconds from launch to the first 302.
+Usage: python benchmarks/cold_start.py [--runs <n>] [--workers <n>]
+
+Compares the former start, flask db upgrade then gunicorn loading the app in
+every worker, with gunicorn.conf.py's preloading master checking the schema
+itself. Runs against DATABASE_URL with SECRET_KEY set, as for the server,
+migrated to head. Use a scratch PostgreSQL database; the user and link the
+benchmark creates are removed afterwards.
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from app.server import create_app, db
+from app.server.models import URL, User
+from app.server.stats import record_url_created, record_urls_deleted
+
+BENCH_USERNAME = "cold-start-benchmark"
+BENCH_SHORT_CODE = "coldst"
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def seed():
+    user = User(username=BENCH_USERNAME, password="x")
+    db.session.add(user)
+    db.session.flush()
+    url = URL(
+        original_url="https://example.com/cold-start",
+        short_code=BENCH_SHORT_CODE,
+        user_id=user.id,
+        is_permanent=True,
+    )
+    db.session.add(url)
+    db.session.flush()
+    record_url_created(db.session, url)
+    db.session.commit()
+
+
+def cleanup():
+    user = User.query.filter_by(username=BENCH_USERNAME).first()
+    if user:
+        urls = URL.query.filter_by(user_id=user.id).all()
+        for url in urls:
+            db.session.delete(url)
+        db.session.flush()
+        record_urls_deleted(db.session, urls)
+        db.session.delete(user)
+        db.session.commit()
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def first_redirect(command, env, port, timeout=60):
+    """Seconds from running command until /<code> answers 302"""
+    opener = urllib.request.build_opener(NoRedirect)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        ["/bin/sh", "-c", command],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                opener.open(f"http://127.0.0.1:{port}/{BENCH_SHORT_CODE}", timeout=5)
+            except urllib.error.HTTPError as e:
+                if e.code == 302:
+                    return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"No redirect within {timeout} seconds: {command}")
+    finally:
+        os.killpg(process.pid, 15)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from start to first 302")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        cleanup()
+        seed()
+
+    starts = {
+        "flask db upgrade, then a worker app each": (
+            "flask db upgrade && exec gunicorn run:app",
+            "false",
+        ),
+        "preloading master, schema check": ("exec gunicorn run:app", "true"),
+    }
+    try:
+        for label, (command, preload) in starts.items():
+            timings = []
+            for _ in range(args.runs):
+                port = free_port()
+                env = dict(
+                    os.environ,
+                    FLASK_APP="run.py",
+                    GUNICORN_BIND=f"127.0.0.1:{port}",
+                    GUNICORN_WORKERS=str(args.workers),
+                    GUNICORN_PRELOAD=preload,
+                    SCHEDULER_ENABLED="false",
+                )
+                timings.append(first_redirect(command, env, port))
+            print(
+                f"{label}: median {statistics.median(timings):.3f}s, "
+                f"min {min(timings):.3f}s over {args.runs} runs"
+            )
+    finally:
+        with app.app_context():
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the redirect lookup: ORM filter_by().first() versus the
+column-projected Core lookup used by the redirect endpoint.
+Usage: python benchmarks/redirect_lookup.py [--database-url <url>] [--iterations <n>]
+
+Runs against DATABASE_URL unless --database-url is given. Use a scratch
+PostgreSQL database; the rows the benchmark creates are removed afterwards.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask
+from app.server import db
+from app.server.models import URL, User
+from app.server.redirects import lookup_redirect
+
+BENCH_USERNAME = "redirect-benchmark"
+
+
+def create_bench_app(database_url):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def seed(rows):
+    """Insert benchmark rows and return their short codes"""
+    user = User(username=BENCH_USERNAME, password="x")
+    db.session.add(user)
+    db.session.flush()
+
+    short_codes = [f"b{i:07d}" for i in range(rows)]
+    db.session.add_all(
+        URL(
+            original_url=f"https://example.com/{code}",
+            short_code=code,
+            user_id=user.id,
+            is_permanent=i % 10 == 0,
+        )
+        for i, code in enumerate(short_codes)
+    )
+    db.session.commit()
+    return short_codes
+
+
+def cleanup():
+    user = User.query.filter_by(username=BENCH_USERNAME).first()
+    if user:
+        db.session.delete(user)
+        db.session.commit()
+
+
+def orm_lookup(short_code):
+    """The lookup redirect_url used before the column-projected query"""
+    url = URL.query.filter_by(short_code=short_code).first()
+    if not url or url.is_expired:
+        return None
+    return url.original_url
+
+
+def core_lookup(short_code):
+    entry = lookup_redirect(short_code)
+    return entry.original_url if entry else None
+
+
+def measure(lookup, short_codes):
+    """Return (CPU microseconds, wall microseconds) per lookup"""
+    # Warm up statement caches and the connection pool
+    for short_code in short_codes[:100]:
+        lookup(short_code)
+        db.session.remove()
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for short_code in short_codes:
+        lookup(short_code)
+        # Each redirect request ends with the session being removed
+        db.session.remove()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return cpu / len(short_codes) * 1e6, wall / len(short_codes) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the redirect lookup")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("Error: set DATABASE_URL or pass --database-url")
+        sys.exit(1)
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        db.create_all()
+        cleanup()
+        short_codes = seed(args.rows)
+        workload = [random.choice(short_codes) for _ in range(args.iterations)]
+
+        try:
+            print(f"{'lookup':<28}{'CPU us/req':>12}{'wall us/req':>14}")
+            for name, lookup in [
+                ("ORM filter_by().first()", orm_lookup),
+                ("Core projected lookup", core_lookup),
+            ]:
+                cpu, wall = measure(lookup, workload)
+                print(f"{name:<28}{cpu:>12.1f}{wall:>14.1f}")
+        finally:
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
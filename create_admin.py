@@ -1,30 +1,56 @@
 #!/usr/bin/env python3
 """
 Script to create admin users for the URL shortener application.
-Usage: python create_admin.py --username <username>
+Usage: python create_admin.py --username <username> [--rotate-token]
+
+With --rotate-token, an existing admin gets a new access token instead; the
+old one stops working on every worker at once.
 """
 
 import argparse
 import sys
-from app import create_app, db
-from app.models import Admin
-from app.utils import generate_access_token
-from app.auth import generate_jwt
+from app.server import create_app, db
+from app.server.models import Admin
+from app.server.utils import generate_access_token
+from app.server.auth import generate_jwt, forget_principal
+from app.server.events import get_event_bus
+
+def rotate_admin_token(admin):
+    """Give an existing admin a new access token, revoking the old one"""
+    revoked = ['admin', admin.username, admin.access_token]
+    admin.access_token = generate_access_token()
+    try:
+        # Published in the transaction, so workers evict the old token on commit
+        get_event_bus().publish('auth_revoked', revoked)
+        db.session.commit()
+        forget_principal(revoked)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error rotating the admin token: {str(e)}")
+        return False
+
+    jwt_token = generate_jwt(admin.username, 'admin', admin.access_token)
+    print(f"Access token of admin '{admin.username}' rotated!")
+    print(f"JWT Token: {jwt_token}")
+    print("\nThe previous token no longer works; save this one securely.")
+    return True
 
-def create_admin(username):
+def create_admin(username, rotate_token=False):
     """Create a new admin with a generated access token"""
     app = create_app()
     
     with app.app_context():
         # Check if admin already exists
         existing_admin = Admin.query.filter_by(username=username).first()
+        if existing_admin and rotate_token:
+            return rotate_admin_token(existing_admin)
         if existing_admin:
             print(f"Error: Admin '{username}' already exists!")
             return False
+        if rotate_token:
+            print(f"Error: Admin '{username}' does not exist!")
+            return False
         
-        from app.config import config
-        app.config.from_object(config['development'])
-
         # Generate access token
         access_token = generate_access_token()
         
@@ -59,6 +85,8 @@ def create_admin(username):
 def main():
     parser = argparse.ArgumentParser(description='Create a new admin for the URL shortener')
     parser.add_argument('--username', required=True, help='Username for the new admin')
+    parser.add_argument('--rotate-token', action='store_true',
+                        help="Replace an existing admin's access token instead")
     
     args = parser.parse_args()
     
@@ -66,7 +94,7 @@ def main():
         print("Error: Username cannot be empty!")
         sys.exit(1)
     
-    success = create_admin(args.username.strip())
+    success = create_admin(args.username.strip(), args.rotate_token)
     sys.exit(0 if success else 1)
 
 if __name__ == '__main__':
@@ -12,9 +12,12 @@ done
 
 echo "Database is ready!"
 
-# Run database migrations
-echo "Running database migrations..."
-flask db upgrade
+# Run database migrations; a preloading gunicorn master runs them itself, only
+# when the schema is behind, see gunicorn.conf.py
+if [ "${GUNICORN_PRELOAD:-true}" != "true" ]; then
+    echo "Running database migrations..."
+    flask db upgrade
+fi
 
-# Run the app
-gunicorn --bind 0.0.0.0:5000 --workers 2 --timeout 120 run:app
\ No newline at end of file
+# Run the app with the settings of gunicorn.conf.py
+exec gunicorn run:app
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Gunicorn settings of the container, read from the working directory.
+Usage: gunicorn run:app
+
+With GUNICORN_PRELOAD (the default), the master imports the application and
+runs the app factory once, then forks the workers, which start serving at
+once and share the imported code's memory. The master also migrates the
+database, only when it is behind. Each worker drops the database connections
+it inherited and opens its own; its background threads restart after a fork.
+"""
+
+import gc
+import logging
+import os
+import subprocess
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+# Threaded workers keep serving while logins wait for password hashing
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def on_starting(server):
+    # The application's logs, startup timings included, go with gunicorn's
+    logger = logging.getLogger("app.server")
+    logger.handlers = server.log.error_log.handlers
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    # Without preloading, docker-entrypoint.sh runs flask db upgrade instead
+    if not preload_app:
+        return
+
+    from app.server.schema import schema_at_head
+
+    with server.app.wsgi().app_context():
+        at_head = schema_at_head()
+    if not at_head:
+        server.log.info("Running database migrations")
+        # In a process of its own, since the migration environment
+        # reconfigures logging
+        subprocess.run(["flask", "db", "upgrade"], check=True)
+
+
+def pre_fork(server, worker):
+    # Keep the preloaded objects out of garbage collection in the workers, so
+    # collecting does not touch, and copy, the memory pages they share
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+
+    from app.server import db
+
+    # Connections the master opened must not be shared with it; close=False
+    # leaves them to the master rather than closing them here
+    with server.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
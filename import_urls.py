@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Script to bulk import URLs, e.g. from a previous URL shortener.
+Usage: python import_urls.py links.csv [--format csv|ndjson] [--on-conflict regenerate|skip]
+
+Records have username, original_url and optionally short_code, expires_at
+(ISO 8601, UTC if naive) and is_permanent. Gzipped files (.gz) are read as is.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+from app.server import create_app, db
+from app.server.importer import (
+    CONFLICT_POLICIES,
+    IMPORT_FORMATS,
+    MERGE_CHUNK_SIZE,
+    Importer,
+    detect_format,
+    read_records,
+)
+from app.server.shards import get_shard_router
+
+
+def open_input(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def import_urls(path, format, on_conflict, validate_urls, chunk_size):
+    """Import the URLs of a file and print a summary"""
+    app = create_app()
+
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            print("Error: Bulk imports need PostgreSQL (COPY FROM STDIN)")
+            return False
+        if get_shard_router().sharded:
+            # Conflicts are resolved against the primary's urls table only
+            print("Error: Bulk imports do not support sharded URLs yet")
+            return False
+
+        importer = Importer(
+            on_conflict=on_conflict,
+            validate_urls=validate_urls,
+            chunk_size=chunk_size,
+            report=lambda message: print(message, flush=True),
+        )
+        try:
+            with open_input(path) as lines:
+                summary = importer.run(read_records(lines, format))
+        except (OSError, ValueError) as e:
+            print(f"Error importing URLs: {str(e)}")
+            return False
+
+        print(json.dumps(summary, indent=2))
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import URLs for existing users")
+    parser.add_argument("path", help="CSV or NDJSON file to import, - for stdin")
+    parser.add_argument(
+        "--format",
+        choices=IMPORT_FORMATS,
+        help="Input format (default: from the file extension)",
+    )
+    parser.add_argument(
+        "--on-conflict",
+        choices=CONFLICT_POLICIES,
+        default="regenerate",
+        help="What to do with short codes that are already taken",
+    )
+    parser.add_argument(
+        "--no-validate-urls",
+        action="store_true",
+        help="Trust the input URLs instead of validating each one",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=MERGE_CHUNK_SIZE,
+        help="URLs inserted per transaction",
+    )
+
+    args = parser.parse_args()
+
+    format = args.format or detect_format(args.path)
+    if format is None:
+        print("Error: Cannot tell the format from the file name; pass --format")
+        sys.exit(1)
+
+    success = import_urls(
+        args.path,
+        format,
+        args.on_conflict,
+        not args.no_validate_urls,
+        max(args.chunk_size, 1),
+    )
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -51,6 +51,35 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_object_for(connection):
+    """Leave a partitioned urls' extra tables and indexes out of autogenerate
+
+    The partitions, and the plain indexes standing in for the primary key
+    and unique short_code, are not in the models; see app.server.partitions.
+    """
+    from app.server.partitions import (
+        PARTITIONED_INDEXES,
+        is_partition,
+        urls_partitioned,
+    )
+
+    # Looked up on first use, within the transaction of autogenerate
+    partitioned = []
+
+    def include_object(object, name, type_, reflected, compare_to):
+        if not partitioned:
+            partitioned.append(urls_partitioned(connection))
+        if not partitioned[0]:
+            return True
+        if type_ == 'table':
+            return not is_partition(name)
+        if type_ == 'index':
+            return name not in PARTITIONED_INDEXES
+        return True
+
+    return include_object
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -97,6 +126,8 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if conf_args.get("include_object") is None:
+            conf_args["include_object"] = include_object_for(connection)
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -0,0 +1,25 @@
+"""Add short code sequence
+
+Revision ID: 1a7fca21c5e0
+Revises: 3a8aaa5ca8f6
+Create Date: 2026-10-18 02:22:47.203721
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a7fca21c5e0'
+down_revision = '3a8aaa5ca8f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Integers fed through the short code permutation; never reused
+    op.execute(sa.schema.CreateSequence(sa.Sequence('short_code_seq')))
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(sa.Sequence('short_code_seq')))
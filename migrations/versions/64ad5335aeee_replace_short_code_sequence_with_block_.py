@@ -0,0 +1,41 @@
+"""Replace short code sequence with block allocation table
+
+Revision ID: 64ad5335aeee
+Revises: 1a7fca21c5e0
+Create Date: 2026-10-18 02:24:07.810563
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '64ad5335aeee'
+down_revision = '1a7fca21c5e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('short_code_allocation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Continue where the sequence left off so no integer is handed out twice
+    op.execute(
+        "INSERT INTO short_code_allocation (id, next_value) "
+        "SELECT 1, CASE WHEN is_called THEN last_value + 1 ELSE last_value END "
+        "FROM short_code_seq"
+    )
+    op.execute(sa.schema.DropSequence(sa.Sequence('short_code_seq')))
+
+
+def downgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('short_code_seq')))
+    op.execute(
+        "SELECT setval('short_code_seq', next_value, false) "
+        "FROM short_code_allocation WHERE id = 1"
+    )
+    op.drop_table('short_code_allocation')
@@ -0,0 +1,119 @@
+"""Add url_digest to urls
+
+Revision ID: 7252260c4350
+Revises: 9bc9f7fc68df
+Create Date: 2026-10-18 03:04:48.539508
+
+"""
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7252260c4350'
+down_revision = '9bc9f7fc68df'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH_SIZE = 10000
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+# Frozen copy of app.server.models.normalize_url at this revision
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return urlunsplit(parts._replace(scheme=scheme))
+    if host is None:
+        return urlunsplit(parts._replace(scheme=scheme))
+
+    netloc = f'[{host}]' if ':' in host else host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    userinfo, _, _ = parts.netloc.rpartition('@')
+    if userinfo:
+        netloc = f'{userinfo}@{netloc}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, parts.fragment))
+
+
+def backfill_url_digests():
+    connection = op.get_bind()
+    urls = sa.table(
+        'urls',
+        sa.column('id', sa.Integer),
+        sa.column('original_url', sa.Text),
+        sa.column('url_digest', sa.LargeBinary),
+    )
+    after = 0
+    while True:
+        rows = connection.execute(
+            sa.select(urls.c.id, urls.c.original_url)
+            .where(urls.c.id > after)
+            .order_by(urls.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        digests = [
+            hashlib.sha256(normalize_url(row.original_url).encode('utf-8')).digest()
+            for row in rows
+        ]
+        if connection.dialect.name == 'postgresql':
+            # One statement per batch rather than one round trip per row
+            connection.execute(
+                sa.text(
+                    'UPDATE urls SET url_digest = batch.digest '
+                    'FROM unnest(CAST(:ids AS integer[]), CAST(:digests AS bytea[])) '
+                    'AS batch (id, digest) WHERE urls.id = batch.id'
+                ),
+                {'ids': ids, 'digests': digests},
+            )
+        else:
+            connection.execute(
+                urls.update()
+                .where(urls.c.id == sa.bindparam('row_id'))
+                .values(url_digest=sa.bindparam('digest')),
+                [{'row_id': i, 'digest': d} for i, d in zip(ids, digests)],
+            )
+        after = ids[-1]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('urls', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('url_digest', sa.LargeBinary(length=32), nullable=True))
+
+    # ### end Alembic commands ###
+
+    backfill_url_digests()
+    with op.batch_alter_table('urls', schema=None) as batch_op:
+        batch_op.alter_column('url_digest', existing_type=sa.LargeBinary(length=32), nullable=False)
+
+    # Built CONCURRENTLY so writes to urls continue during the build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urls_user_id_url_digest',
+            'urls',
+            ['user_id', 'url_digest'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_urls_user_id_url_digest', table_name='urls', postgresql_concurrently=True)
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('urls', schema=None) as batch_op:
+        batch_op.drop_column('url_digest')
+
+    # ### end Alembic commands ###
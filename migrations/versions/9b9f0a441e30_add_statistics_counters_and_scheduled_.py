@@ -0,0 +1,58 @@
+"""Add statistics counters and scheduled jobs
+
+Revision ID: 9b9f0a441e30
+Revises: 64ad5335aeee
+Create Date: 2026-10-18 02:40:32.689306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b9f0a441e30'
+down_revision = '64ad5335aeee'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stat_counters',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('shard', sa.SmallInteger(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name', 'shard')
+    )
+    op.create_table('url_expiry_buckets',
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('shard', sa.SmallInteger(), nullable=False),
+    sa.Column('url_count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket_start', 'shard')
+    )
+    op.create_table('scheduled_jobs',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_run_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Start the counters from the current data; reconciliation keeps them honest
+    op.execute(
+        "INSERT INTO stat_counters (name, shard, value) "
+        "SELECT 'total_urls', 0, COUNT(*) FROM urls "
+        "UNION ALL SELECT 'permanent_urls', 0, COUNT(*) FROM urls WHERE is_permanent "
+        "UNION ALL SELECT 'total_clicks', 0, COALESCE(SUM(click_count), 0) FROM urls "
+        "UNION ALL SELECT 'total_users', 0, COUNT(*) FROM users "
+        "UNION ALL SELECT 'active_users', 0, COUNT(DISTINCT user_id) FROM urls"
+    )
+    op.execute(
+        "INSERT INTO url_expiry_buckets (bucket_start, shard, url_count) "
+        "SELECT date_trunc('hour', expires_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', "
+        "0, COUNT(*) FROM urls "
+        "WHERE is_permanent IS false AND expires_at IS NOT NULL GROUP BY 1"
+    )
+
+
+def downgrade():
+    op.drop_table('scheduled_jobs')
+    op.drop_table('url_expiry_buckets')
+    op.drop_table('stat_counters')
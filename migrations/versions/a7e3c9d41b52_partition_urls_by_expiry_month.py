@@ -0,0 +1,136 @@
+"""Partition urls by expiry month
+
+Revision ID: a7e3c9d41b52
+Revises: 7252260c4350
+Create Date: 2026-10-18 09:12:31.804117
+
+"""
+from datetime import datetime, timezone
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e3c9d41b52'
+down_revision = '7252260c4350'
+branch_labels = None
+depends_on = None
+
+
+# Month partitions created beyond the current month; the app creates later ones
+MONTHS_AHEAD = 12
+
+COLUMNS = (
+    'id, original_url, url_digest, short_code, user_id, created_at, '
+    'expires_at, is_permanent, click_count, last_accessed'
+)
+
+# Frozen copy of the layout of app.server.partitions at this revision
+PARTITION_KEY = (
+    "(CASE WHEN is_permanent THEN CAST('infinity' AS timestamptz) ELSE expires_at END)"
+)
+
+INDEXES = [
+    'CREATE INDEX ix_urls_user_id_created_at ON urls (user_id, created_at, id)',
+    'CREATE INDEX ix_urls_user_id_expires_at ON urls (user_id, expires_at, id)',
+    'CREATE INDEX ix_urls_user_id_click_count ON urls (user_id, click_count, id)',
+    'CREATE INDEX ix_urls_user_id_short_code ON urls (user_id, short_code)',
+    'CREATE INDEX ix_urls_user_id_url_digest ON urls (user_id, url_digest)',
+    'CREATE INDEX ix_urls_created_at ON urls (created_at, id)',
+    'CREATE INDEX ix_urls_expires_at ON urls (expires_at, id)',
+    'CREATE INDEX ix_urls_click_count ON urls (click_count, id)',
+    'CREATE INDEX ix_urls_expiring ON urls (expires_at, id) WHERE NOT is_permanent',
+]
+
+UNIQUE_SHORT_CODE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION urls_unique_short_code() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(
+            hashtext('urls.short_code'), hashtext(NEW.short_code)
+        );
+        IF EXISTS (SELECT 1 FROM urls WHERE short_code = NEW.short_code) THEN
+            RAISE unique_violation USING
+                MESSAGE = format('duplicate short code %L in urls', NEW.short_code),
+                CONSTRAINT = 'ix_urls_short_code';
+        END IF;
+        RETURN NEW;
+    END
+    $$
+"""
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def upgrade():
+    # SQLite keeps the plain table, and the reaper deletes rows one by one
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # Rows are copied while urls is locked, so plan for downtime on big tables
+    op.execute('ALTER TABLE urls RENAME TO urls_unpartitioned')
+    op.execute('ALTER SEQUENCE urls_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE urls (LIKE urls_unpartitioned INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE ({PARTITION_KEY})'
+    )
+    op.execute(
+        "CREATE TABLE urls_permanent PARTITION OF urls "
+        "FOR VALUES FROM ('infinity') TO (MAXVALUE)"
+    )
+    op.execute('CREATE TABLE urls_default PARTITION OF urls DEFAULT')
+
+    # Already expired URLs go to the default partition, which the reaper
+    # empties row by row, rather than into partitions of past months
+    now = datetime.now(timezone.utc)
+    month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    for months in range(MONTHS_AHEAD + 1):
+        start, end = add_months(month, months), add_months(month, months + 1)
+        op.execute(
+            f'CREATE TABLE urls_p{start.year:04d}_{start.month:02d} PARTITION OF urls '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+    op.execute(f'INSERT INTO urls ({COLUMNS}) SELECT {COLUMNS} FROM urls_unpartitioned')
+    op.execute('DROP TABLE urls_unpartitioned')
+    op.execute('ALTER SEQUENCE urls_id_seq OWNED BY urls.id')
+    op.execute(
+        'ALTER TABLE urls ADD CONSTRAINT urls_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES users (id)'
+    )
+
+    # The primary key and the unique short_code would have to include the
+    # partition key: plain indexes and a trigger keeping codes unique instead
+    for statement in INDEXES:
+        op.execute(statement)
+    op.execute('CREATE INDEX ix_urls_id ON urls (id)')
+    op.execute('CREATE INDEX ix_urls_short_code ON urls (short_code)')
+    op.execute(UNIQUE_SHORT_CODE_FUNCTION)
+    op.execute(
+        'CREATE TRIGGER urls_unique_short_code BEFORE INSERT ON urls '
+        'FOR EACH ROW EXECUTE FUNCTION urls_unique_short_code()'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # URLs of partitions already detached by the reaper are not brought back
+    op.execute('ALTER TABLE urls RENAME TO urls_partitioned')
+    op.execute('ALTER SEQUENCE urls_id_seq OWNED BY NONE')
+    op.execute('CREATE TABLE urls (LIKE urls_partitioned INCLUDING DEFAULTS)')
+    op.execute(f'INSERT INTO urls ({COLUMNS}) SELECT {COLUMNS} FROM urls_partitioned')
+    op.execute('DROP TABLE urls_partitioned')
+    op.execute('DROP FUNCTION urls_unique_short_code()')
+    op.execute('ALTER SEQUENCE urls_id_seq OWNED BY urls.id')
+    op.execute('ALTER TABLE urls ADD CONSTRAINT urls_pkey PRIMARY KEY (id)')
+    op.execute(
+        'ALTER TABLE urls ADD CONSTRAINT urls_user_id_fkey '
+        'FOREIGN KEY (user_id) REFERENCES users (id)'
+    )
+    for statement in INDEXES:
+        op.execute(statement)
+    op.execute('CREATE UNIQUE INDEX ix_urls_short_code ON urls (short_code)')
@@ -0,0 +1,52 @@
+"""Add indexes for listing, sorting and expiry queries
+
+Revision ID: ff74df0303da
+Revises: 9b9f0a441e30
+Create Date: 2026-10-18 02:45:22.949908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ff74df0303da'
+down_revision = '9b9f0a441e30'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, partial index predicate)
+INDEXES = [
+    ('ix_urls_user_id_created_at', 'urls', ['user_id', 'created_at', 'id'], None),
+    ('ix_urls_user_id_expires_at', 'urls', ['user_id', 'expires_at', 'id'], None),
+    ('ix_urls_user_id_click_count', 'urls', ['user_id', 'click_count', 'id'], None),
+    ('ix_urls_user_id_short_code', 'urls', ['user_id', 'short_code'], None),
+    ('ix_urls_created_at', 'urls', ['created_at', 'id'], None),
+    ('ix_urls_expires_at', 'urls', ['expires_at', 'id'], None),
+    ('ix_urls_click_count', 'urls', ['click_count', 'id'], None),
+    ('ix_urls_expiring', 'urls', ['expires_at', 'id'], 'NOT is_permanent'),
+    ('ix_users_created_at', 'users', ['created_at', 'id'], None),
+]
+
+
+def upgrade():
+    # Built CONCURRENTLY so writes to urls continue during the build, which
+    # cannot run inside a transaction. If a build fails, drop the INVALID
+    # index it leaves behind before upgrading again.
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                postgresql_where=sa.text(where) if where else None,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
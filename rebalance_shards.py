@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Script to move URLs to the shard their short code hashes to, after adding one.
+Usage: python rebalance_shards.py [--create-tables] [--dry-run] [--chunk-size N]
+
+Append the new database to URL_SHARD_DATABASE_URLS and set
+URL_SHARDS_REBALANCING=true for every worker and this script, run it with
+--create-tables until it reports nothing misplaced, then switch
+URL_SHARDS_REBALANCING off again.
+"""
+
+import argparse
+import json
+import sys
+from app.server import create_app, db
+from app.server.partitions import partition_urls, urls_partitioned
+from app.server.rebalance import REBALANCE_CHUNK_SIZE, Rebalancer
+from app.server.shards import create_shard_tables, get_shard_router
+
+
+def rebalance_shards(create_tables, dry_run, chunk_size):
+    """Move misplaced URLs and print a summary"""
+    app = create_app()
+
+    with app.app_context():
+        router = get_shard_router()
+        if not router.sharded:
+            print("Error: No shards configured; set URL_SHARD_DATABASE_URLS")
+            return False
+        if not router.rebalancing and not dry_run:
+            print(
+                "Error: Set URL_SHARDS_REBALANCING=true here and in every worker "
+                "first, or moved URLs will not be found while this runs"
+            )
+            return False
+
+        if create_tables:
+            with db.engine.connect() as connection:
+                partitioned = urls_partitioned(connection)
+            for shard in router.shards[1:]:
+                engine = db.engines[shard]
+                if create_shard_tables(engine):
+                    if partitioned:
+                        # Laid out like the primary's, see app.server.partitions
+                        with engine.begin() as connection:
+                            partition_urls(
+                                connection,
+                                app.config["URL_PARTITION_MONTHS_AHEAD"],
+                                foreign_keys=False,
+                            )
+                    print(f"Created the urls table on {shard}")
+
+        rebalancer = Rebalancer(
+            chunk_size=chunk_size,
+            dry_run=dry_run,
+            report=lambda message: print(message, flush=True),
+        )
+        summary = rebalancer.run()
+        print(json.dumps(summary, indent=2))
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move URLs to the shard their short code hashes to"
+    )
+    parser.add_argument(
+        "--create-tables",
+        action="store_true",
+        help="Create the urls table on shards that lack it first",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the URLs that would move",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=REBALANCE_CHUNK_SIZE,
+        help="URLs read from a shard at a time",
+    )
+
+    args = parser.parse_args()
+    success = rebalance_shards(
+        args.create_tables, args.dry_run, max(args.chunk_size, 1)
+    )
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()